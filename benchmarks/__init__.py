@@ -0,0 +1,4 @@
+"""
+   Package with benchmarks of the tools package.
+   Every module can be run as a script and writes its measurements as JSON.
+"""
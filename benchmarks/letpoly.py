@@ -0,0 +1,145 @@
+"""
+    Benchmark of WAlgorithm against JAlgorithm on programs with nested let and applications.
+
+    Run: python -m benchmarks.letpoly [-w workload,...] [-n size,...] [-r repeat] [-b budget] [-o file]
+"""
+import getopt
+import sys
+
+from benchmarks.timing import measure, scaling_exponent, environment, write_report
+from tools.jalgo import JAlgorithm
+from tools.tstructure import *
+from tools.walgo import WAlgorithm
+
+
+def nested_lets(n: int) -> Expression:
+    """
+    \\a.let x1 = \\z.z in let x2 = \\z.x1 z in ... in xn a
+    """
+    exp = Applique(Var("x" + str(n)), Var("a"))
+    for i in reversed(range(1, n + 1)):
+        if i == 1:
+            bound = Abstraction(Var("z"), Var("z"))
+        else:
+            bound = Abstraction(Var("z"), Applique(Var("x" + str(i - 1)), Var("z")))
+        exp = Let(Var("x" + str(i)), bound, exp)
+    return Abstraction(Var("a"), exp)
+
+
+def applications(n: int) -> Expression:
+    """
+    let id = \\x.x in let fst = \\x.\\y.x in fst (id (fst (id ... y))) ...
+    """
+    exp = Var("y")
+    for i in range(n):
+        if i % 2 == 0:
+            exp = Applique(Var("id"), exp)
+        else:
+            exp = Applique(Applique(Var("fst"), exp), Var("id"))
+    return Let(Var("id"), Abstraction(Var("x"), Var("x")),
+               Let(Var("fst"), Abstraction(Var("x"), Abstraction(Var("y"), Var("x"))), exp))
+
+
+def lambdas(n: int) -> Expression:
+    """
+    \\v1.\\v2...\\vn.let f = \\x.x v1 in f (\\z.z) - a big context at the let
+    """
+    exp = Let(Var("f"), Abstraction(Var("x"), Applique(Var("x"), Var("v1"))),
+              Applique(Var("f"), Abstraction(Var("z"), Var("z"))))
+    for i in reversed(range(1, n + 1)):
+        exp = Abstraction(Var("v" + str(i)), exp)
+    return exp
+
+
+WORKLOADS = {
+    "nested_lets": (nested_lets, [25, 50, 100, 200]),
+    "applications": (applications, [25, 50, 100, 200]),
+    "lambdas": (lambdas, [25, 50, 100, 200])
+}
+
+ENGINES = {
+    "w": lambda exp: WAlgorithm().infer_type(exp),
+    "j": lambda exp: JAlgorithm().infer_type(exp)
+}
+
+
+def run(workloads: list, sizes: list = None, repeat: int = 3, budget: float = 5.0) -> dict:
+    """
+    Time both algorithms on every workload. Sizes grow until one run takes more than budget seconds.
+
+    :return: report suitable for JSON
+    """
+    results = []
+    for workload in workloads:
+        generator, default_sizes = WORKLOADS[workload]
+        medians = {}
+        for engine in ENGINES:
+            points = []
+            for size in (sizes or default_sizes):
+                exp = generator(size)
+                timing = measure(ENGINES[engine], lambda: exp, repeat=repeat)
+                timing["size"] = size
+                points.append(timing)
+                medians[(engine, size)] = timing["median"]
+                print("{0:14} {1:3} {2:8} {3:12.6f} {4}".format(
+                        workload, engine, size, timing["median"], timing["outcome"]), file=sys.stderr)
+                if timing["median"] > budget:
+                    break
+
+            results.append({
+                "workload": workload,
+                "engine": engine,
+                "points": points,
+                "exponent": scaling_exponent([(p["size"], p["median"]) for p in points])
+            })
+
+        for size in (sizes or default_sizes):
+            if ("w", size) in medians and ("j", size) in medians:
+                print("{0:14} speedup of j at {1}: {2:.1f}x".format(
+                        workload, size, medians[("w", size)] / medians[("j", size)]), file=sys.stderr)
+
+    return {"benchmark": "letpoly", "environment": environment(), "results": results}
+
+
+def main(argv):
+    usage = "letpoly.py -w <workload,...> -n <size,...> -r <repeat> -b <budget> -o <output_file>"
+    workloads = list(WORKLOADS.keys())
+    sizes = None
+    repeat = 3
+    budget = 5.0
+    output_file = "-"
+
+    try:
+        opts, args = getopt.getopt(argv, "hw:n:r:b:o:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            print("workloads: " + ", ".join(WORKLOADS.keys()))
+            sys.exit()
+        elif opt == "-w":
+            workloads = arg.split(",")
+        elif opt == "-n":
+            sizes = [int(size) for size in arg.split(",")]
+        elif opt == "-r":
+            repeat = int(arg)
+        elif opt == "-b":
+            budget = float(arg)
+        elif opt == "-o":
+            output_file = arg
+
+    for name in workloads:
+        if name not in WORKLOADS:
+            print("Unknown workload: " + name)
+            sys.exit(2)
+
+    # WAlgorithm is recursive
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+    write_report(run(workloads, sizes, repeat, budget), output_file)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,332 @@
+"""
+    End-to-end benchmark of parsing, reduction and the inference engines on repeatable workloads.
+    Every workload produces the source text of an expression of the given size, engines that do not
+    support the workload (e.g. reduction of let) are skipped.
+
+    Run: python -m benchmarks.suite [-w workload,...] [-e engine,...] [-n size,...] [-r repeat] [-b budget] [-o file]
+    Compare: python -m benchmarks.suite -c <baseline.json> [-t threshold] [-o file]
+             python -m benchmarks.suite -c <baseline.json> -C <current.json> [-t threshold]
+    In compare mode every point slower than threshold times its baseline median is reported as a regression
+    and the exit code is 1.
+"""
+import getopt
+import json
+import random
+import sys
+
+from benchmarks.timing import measure, scaling_exponent, extrapolate, environment, write_report
+from tools.combinators import evaluate
+from tools.constraints import ConstraintResolver, WorklistResolver
+from tools.generator import TermGenerator
+from tools.inference import ClassicInferer
+from tools.tparsing import BaseParser, BufferParser
+from tools.tstructure import *
+from tools.types import type_add, type_mul, type_I
+from tools.utils import reduction
+from tools.walgo import WAlgorithm
+
+
+def numeral(n: int) -> str:
+    """
+    Church numeral n, tools.types.numbers holds only the first thirty.
+    """
+    return "(\\f.\\x." + "(f " * n + "x" + ")" * n + ")"
+
+
+def church_add(n: int) -> str:
+    """
+    n + n with Church numerals, normal form has n + n applications.
+    """
+    return "{0} {1} {1}".format(type_add, numeral(n))
+
+
+def church_mul(n: int) -> str:
+    """
+    n * n with Church numerals, normal form has n * n applications.
+    """
+    return "{0} {1} {1}".format(type_mul, numeral(n))
+
+
+def let_chain(n: int) -> str:
+    """
+    let x1 = \\z.z in let x2 = \\z.x1 z in ... in xn a
+    """
+    result = "x{0} a".format(n)
+    for i in reversed(range(1, n + 1)):
+        bound = "\\z.z" if i == 1 else "\\z.x{0} z".format(i - 1)
+        result = "let x{0} = {1} in {2}".format(i, bound, result)
+    return result
+
+
+def lambda_lets(n: int) -> str:
+    """
+    \\v1.let x1 = \\z.z in \\v2.let x2 = \\z.x1 z in ... in xn vn
+    Every let is under all previous abstractions, so the context of its generalization grows with n.
+    """
+    result = "x{0} v{0}".format(n)
+    for i in reversed(range(1, n + 1)):
+        bound = "\\z.z" if i == 1 else "\\z.x{0} z".format(i - 1)
+        result = "\\v{0}.let x{0} = {1} in {2}".format(i, bound, result)
+    return result
+
+
+def wide_application(n: int) -> str:
+    """
+    (\\x.x) (\\x.x) ... (\\x.x) with n arguments.
+    """
+    return " ".join([type_I] * (n + 1))
+
+
+def random_typable(n: int, seed: int = 0) -> str:
+    """
+    Random term of about n nodes that always has a type: variables are never applied,
+    only abstracted, passed to I or K and bound by let.
+    Let-bound expressions do not contain let, BaseParser cuts them at the first "in".
+    """
+    rand = random.Random(seed * 1000003 + n)
+    counter = [0]
+
+    def term(size: int, bound: list, lets: bool = True) -> Expression:
+        if size <= 1:
+            return Var(rand.choice(bound)) if bound else Abstraction(Var("u"), Var("u"))
+        choice = rand.randrange(4 if lets else 3)
+        if choice == 0:
+            counter[0] += 1
+            name = "v" + str(counter[0])
+            return Abstraction(Var(name), term(size - 1, bound + [name], lets))
+        elif choice == 1:
+            return Applique(Abstraction(Var("i"), Var("i")), term(size - 1, bound, lets))
+        elif choice == 2:
+            left = rand.randrange(1, size)
+            return Applique(Applique(Abstraction(Var("k"), Abstraction(Var("l"), Var("k"))),
+                                     term(left, bound, lets)), term(size - left, bound, lets))
+        else:
+            counter[0] += 1
+            name = "v" + str(counter[0])
+            left = rand.randrange(1, size)
+            return Let(Var(name), term(left, bound, False), term(size - left, bound + [name]))
+
+    return str(term(n, []))
+
+
+def random_normalising(n: int, seed: int = 0) -> str:
+    """
+    Random simply typed (so strongly normalising) term of about n nodes with redexes.
+    """
+    return str(TermGenerator(seed=seed, size=n, normalising=True, redex_density=0.1).term())
+
+
+WORKLOADS = {
+    "church_add": (church_add, [16, 32, 64, 128, 256]),
+    "church_mul": (church_mul, [4, 8, 16, 32]),
+    "let_chain": (let_chain, [25, 50, 100, 200, 400]),
+    "lambda_lets": (lambda_lets, [25, 50, 100, 200, 400]),
+    "wide_application": (wide_application, [4, 8, 12, 16, 24, 32, 64, 128]),
+    "random_typable": (random_typable, [50, 100, 200, 400, 800]),
+    "random_normalising": (random_normalising, [50, 100, 200, 400, 800])
+}
+
+
+def __constraints__(resolver_class):
+    def solve(exp: Expression):
+        resolver = resolver_class()
+        result_type = TVar("result")
+        return resolver.resolve(resolver.generate_constraint(exp, result_type), result_type)
+    return solve
+
+
+ENGINES = {
+    "parse": lambda text: BaseParser().parse(text),
+    "parse_buffer": lambda text: BufferParser().parse(text.encode("ascii")),
+    "reduction": reduction,
+    "explicit": lambda exp: reduction(exp, engine="explicit"),
+    "combinators": evaluate,
+    "classic": lambda exp: ClassicInferer().get_type(exp),
+    "w": lambda exp: WAlgorithm().infer_type(exp),
+    "constraints": __constraints__(ConstraintResolver),
+    "worklist": __constraints__(WorklistResolver)
+}
+
+# engines that take the source text instead of the parsed expression
+PARSERS = {"parse", "parse_buffer"}
+# engines that do not support let
+WITHOUT_LET = {"reduction", "classic"}
+LET_WORKLOADS = {"let_chain", "lambda_lets", "random_typable"}
+# engines that only evaluate closed terms to Church numerals and booleans
+ARITHMETIC = {"combinators"}
+ARITHMETIC_WORKLOADS = {"church_add", "church_mul"}
+
+
+def __applicable__(workload: str, engine: str) -> bool:
+    if engine in ARITHMETIC and workload not in ARITHMETIC_WORKLOADS:
+        return False
+    return not (workload in LET_WORKLOADS and engine in WITHOUT_LET)
+
+
+def run(workloads: list, engines: list, sizes: list = None, repeat: int = 5, budget: float = 5.0) -> dict:
+    """
+    Time every engine on every workload with warmup and repetitions.
+    Sizes grow until one run takes (or is predicted to take) more than budget seconds,
+    W and ConstraintResolver are exponential on some workloads.
+
+    :return: report suitable for JSON
+    """
+    parser_ = BaseParser()
+    results = []
+    for workload in workloads:
+        generator, default_sizes = WORKLOADS[workload]
+        for engine in engines:
+            if not __applicable__(workload, engine):
+                continue
+            points = []
+            for size in (sizes or default_sizes):
+                predicted = extrapolate([(p["size"], p["median"]) for p in points], size)
+                if predicted is not None and predicted > budget:
+                    print("{0:18} {1:12} {2:8} skipped, predicted {3:.1f}s".format(
+                            workload, engine, size, predicted), file=sys.stderr)
+                    break
+                text = generator(size)
+                if engine in PARSERS:
+                    timing = measure(ENGINES[engine], lambda: text, repeat=repeat, budget=budget)
+                else:
+                    exp = parser_.parse(text)
+                    timing = measure(ENGINES[engine], lambda: exp, repeat=repeat, budget=budget)
+                timing["size"] = size
+                points.append(timing)
+                print("{0:18} {1:12} {2:8} {3:12.6f} {4}".format(
+                        workload, engine, size, timing["median"], timing["outcome"]), file=sys.stderr)
+                if timing["median"] > budget:
+                    break
+
+            results.append({
+                "workload": workload,
+                "engine": engine,
+                "points": points,
+                "exponent": scaling_exponent([(p["size"], p["median"]) for p in points])
+            })
+
+    return {"benchmark": "suite", "environment": environment(), "results": results}
+
+
+def compare(baseline: dict, current: dict, threshold: float = 1.25) -> dict:
+    """
+    Compare medians of points present in both reports.
+
+    :param threshold: ratio of current to baseline median above which a point is a regression
+    :return: report with ratio of every common point and the list of regressions
+    """
+    def points(report: dict) -> dict:
+        result = {}
+        for entry in report["results"]:
+            for point in entry["points"]:
+                result[(entry["workload"], entry["engine"], point["size"])] = point
+        return result
+
+    old = points(baseline)
+    new = points(current)
+    rows = []
+    for key in sorted(set(old.keys()) & set(new.keys())):
+        workload, engine, size = key
+        before = old[key]["median"]
+        after = new[key]["median"]
+        row = {
+            "workload": workload,
+            "engine": engine,
+            "size": size,
+            "baseline": before,
+            "current": after,
+            "ratio": after / before if before > 0 else None,
+            "outcome": new[key]["outcome"]
+        }
+        row["regression"] = (row["ratio"] is not None and row["ratio"] > threshold) or \
+            (old[key]["outcome"] == "ok" and new[key]["outcome"] != "ok")
+        rows.append(row)
+        print("{0:18} {1:12} {2:8} {3:12.6f} {4:12.6f} {5:8.2f}{6}".format(
+                workload, engine, size, before, after, row["ratio"] or 0,
+                "  REGRESSION" if row["regression"] else ""), file=sys.stderr)
+
+    return {
+        "benchmark": "suite_compare",
+        "threshold": threshold,
+        "baseline_environment": baseline.get("environment"),
+        "current_environment": current.get("environment"),
+        "rows": rows,
+        "regressions": [row for row in rows if row["regression"]]
+    }
+
+
+def main(argv):
+    usage = "suite.py -w <workload,...> -e <engine,...> -n <size,...> -r <repeat> -b <budget> -o <output_file>" \
+            " [-c <baseline.json> [-C <current.json>] [-t <threshold>]]"
+    workloads = list(WORKLOADS.keys())
+    engines = list(ENGINES.keys())
+    sizes = None
+    repeat = 5
+    budget = 5.0
+    output_file = "-"
+    baseline_file = None
+    current_file = None
+    threshold = 1.25
+
+    try:
+        opts, args = getopt.getopt(argv, "hw:e:n:r:b:o:c:C:t:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            print("workloads: " + ", ".join(WORKLOADS.keys()))
+            print("engines: " + ", ".join(ENGINES.keys()))
+            sys.exit()
+        elif opt == "-w":
+            workloads = arg.split(",")
+        elif opt == "-e":
+            engines = arg.split(",")
+        elif opt == "-n":
+            sizes = [int(size) for size in arg.split(",")]
+        elif opt == "-r":
+            repeat = int(arg)
+        elif opt == "-b":
+            budget = float(arg)
+        elif opt == "-o":
+            output_file = arg
+        elif opt == "-c":
+            baseline_file = arg
+        elif opt == "-C":
+            current_file = arg
+        elif opt == "-t":
+            threshold = float(arg)
+
+    for name in workloads:
+        if name not in WORKLOADS:
+            print("Unknown workload: " + name)
+            sys.exit(2)
+    for name in engines:
+        if name not in ENGINES:
+            print("Unknown engine: " + name)
+            sys.exit(2)
+
+    # parser, reduction and most engines are recursive
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    if baseline_file is None:
+        write_report(run(workloads, engines, sizes, repeat, budget), output_file)
+        return
+
+    with open(baseline_file) as input_:
+        baseline = json.load(input_)
+    if current_file is None:
+        current = run(workloads, engines, sizes, repeat, budget)
+    else:
+        with open(current_file) as input_:
+            current = json.load(input_)
+    report = compare(baseline, current, threshold)
+    write_report(report, output_file)
+    if report["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+"""
+    Helpers shared by all benchmarks: timing with warmup and repetitions, scaling estimation and JSON output.
+"""
+import json
+import math
+import platform
+import sys
+import time
+
+
+def measure(func, make_input, repeat: int = 5, warmup: int = 1, budget: float = None) -> dict:
+    """
+    Time func on fresh inputs.
+    make_input is called before every run and is not timed, so func may mutate its input.
+
+    :param func: function of one argument to time
+    :param make_input: function without arguments producing input for func
+    :param repeat: number of timed runs
+    :param warmup: number of untimed runs before measuring
+    :param budget: if a warmup run takes more than budget seconds, it is the only (timed) run
+    :return: dict with min, median and max time in seconds and outcome of the last run
+    """
+    outcome = "ok"
+    for _ in range(warmup):
+        arg = make_input()
+        start = time.perf_counter()
+        outcome = __run__(func, arg)[0]
+        elapsed = time.perf_counter() - start
+        if budget is not None and elapsed > budget:
+            return {"min": elapsed, "median": elapsed, "max": elapsed, "repeat": 1, "outcome": outcome}
+
+    times = []
+    for _ in range(repeat):
+        arg = make_input()
+        start = time.perf_counter()
+        outcome, _ = __run__(func, arg)
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    return {
+        "min": times[0],
+        "median": times[len(times) // 2],
+        "max": times[-1],
+        "repeat": repeat,
+        "outcome": outcome
+    }
+
+
+def __run__(func, arg) -> (str, object):
+    """
+    Run func on arg turning exceptions into outcome.
+
+    :return: tuple(outcome name, result or None)
+    """
+    try:
+        return "ok", func(arg)
+    except Exception as err:
+        return type(err).__name__, None
+
+
+def scaling_exponent(points: list) -> float:
+    """
+    Estimate k in time ~ size^k by least squares over log-log points.
+
+    :param points: list of tuple(size, time)
+    :return: estimated exponent or None if there is not enough points
+    """
+    points = [(math.log(size), math.log(t)) for size, t in points if size > 0 and t > 0]
+    if len(points) < 2:
+        return None
+
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    dispersion = sum((x - mean_x) ** 2 for x, _ in points)
+    if dispersion == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / dispersion
+
+
+def extrapolate(points: list, size: int) -> float:
+    """
+    Predict time at the given size from the last two points assuming time ~ size^k between them.
+
+    :param points: list of tuple(size, time) in order of growing size
+    :return: predicted time or None if there is not enough points
+    """
+    if len(points) < 2:
+        return None
+    (size1, time1), (size2, time2) = points[-2], points[-1]
+    if size1 <= 0 or size2 <= size1 or time1 <= 0 or time2 <= 0:
+        return None
+    exponent = max(math.log(time2 / time1) / math.log(size2 / size1), 0)
+    return time2 * (size / size2) ** exponent
+
+
+def environment() -> dict:
+    """
+    Describe machine the benchmark runs on, so that reports from different machines are not compared blindly.
+    """
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "platform": platform.platform()
+    }
+
+
+def write_report(report: dict, path: str):
+    """
+    Write report as JSON to the given path, "-" means stdout.
+    """
+    if path == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(path, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
@@ -0,0 +1,245 @@
+"""
+    Benchmark of solvers of systems of type equations on generated families of systems.
+
+    Run: python -m benchmarks.unification [-f family,...] [-s solver,...] [-n size,...] [-r repeat] [-b budget] [-o file]
+    With -t count it instead compares solving count small random systems one by one and as one batch.
+"""
+import getopt
+import random
+import sys
+
+from benchmarks.timing import measure, scaling_exponent, environment, write_report
+from tools import batchunify
+from tools.batchunify import solve_batch, solve_single
+from tools.equations import Equation, solve_set_of_equations, solve_by_components
+from tools.terrors import InconsistentSystemError
+from tools.tstructure import TVar, TImpl
+
+
+def __vars__(prefix: str, n: int) -> list:
+    return [TVar(prefix + str(i)) for i in range(n)]
+
+
+def chain(n: int) -> list:
+    """
+    x0 = x1->a0, x1 = x2->a1, ..., every equation depends on the next one.
+    """
+    x = __vars__("x", n + 1)
+    a = __vars__("a", n)
+    return [Equation(x[i], TImpl(x[i + 1], a[i])) for i in range(n)]
+
+
+def fan_out(n: int) -> list:
+    """
+    x = y0, x = y1, ..., x = yn and y0 = a->a, one variable shared by all equations.
+    """
+    x = TVar("x")
+    y = __vars__("y", n)
+    a = TVar("a")
+    return [Equation(x, var) for var in y] + [Equation(y[0], TImpl(a, a))]
+
+
+def tower(n: int) -> list:
+    """
+    Single equation a0->(a1->...) = (b0->b0)->((b1->b1)->...) between two implications of depth n.
+    """
+    a = __vars__("a", n + 1)
+    b = __vars__("b", n + 1)
+    left = a[n]
+    right = b[n]
+    for i in reversed(range(n)):
+        left = TImpl(a[i], left)
+        right = TImpl(TImpl(b[i], b[i]), right)
+    return [Equation(left, right)]
+
+
+def occurs(n: int) -> list:
+    """
+    Chain of length n closed into a cycle, so the system is inconsistent only because of the occurs check.
+    """
+    x = __vars__("x", n + 1)
+    a = __vars__("a", n)
+    result = [Equation(x[i], TImpl(x[i + 1], a[i])) for i in range(n)]
+    result.append(Equation(x[n], TImpl(x[0], a[0])))
+    return result
+
+
+def sharing(n: int) -> list:
+    """
+    x0 = x1->x1, x1 = x2->x2, ..., the solved form of x0 has 2^n leaves.
+    """
+    x = __vars__("x", n + 1)
+    return [Equation(x[i], TImpl(x[i + 1], x[i + 1])) for i in range(n)]
+
+
+def random_system(n: int, seed: int = 0) -> list:
+    """
+    Consistent system of n equations between random types.
+    Equations are produced by unifying random types with their instances, so the system always has a solution.
+    """
+    rnd = random.Random(seed * 1000003 + n)
+    x = __vars__("x", max(2, n // 2))
+
+    def random_type(depth: int):
+        if depth == 0 or rnd.random() < 0.3:
+            return rnd.choice(x)
+        return TImpl(random_type(depth - 1), random_type(depth - 1))
+
+    result = []
+    for _ in range(n):
+        t = random_type(4)
+        fresh = TVar("r" + str(len(result)))
+        result.append(Equation(fresh, t))
+        result.append(Equation(TImpl(fresh, fresh), TImpl(t, TVar("s" + str(len(result))))))
+    return result[:n]
+
+
+FAMILIES = {
+    "chain": (chain, [16, 32, 64, 128, 256]),
+    "fan_out": (fan_out, [16, 32, 64, 128, 256]),
+    "tower": (tower, [16, 32, 64, 128, 256]),
+    "occurs": (occurs, [16, 32, 64, 128, 256]),
+    "sharing": (sharing, [4, 6, 8, 10, 12]),
+    "random": (random_system, [16, 32, 64, 128, 256])
+}
+
+SOLVERS = {
+    "classic": solve_set_of_equations,
+    "components": solve_by_components,
+    "batch": solve_single
+}
+
+
+def run(families: list, solvers: list, sizes: list = None, repeat: int = 3, budget: float = 5.0) -> dict:
+    """
+    Time every solver on every family.
+    Sizes of a family grow until one run takes more than budget seconds.
+
+    :param families: names of families from FAMILIES
+    :param solvers: names of solvers from SOLVERS
+    :param sizes: sizes to use instead of the default sizes of families
+    :param repeat: number of timed runs per size
+    :param budget: time limit for one run in seconds
+    :return: report suitable for JSON
+    """
+    results = []
+    for family in families:
+        generator, default_sizes = FAMILIES[family]
+        for solver in solvers:
+            points = []
+            for size in (sizes or default_sizes):
+                timing = measure(SOLVERS[solver], lambda: generator(size), repeat=repeat)
+                timing["size"] = size
+                points.append(timing)
+                print("{0:10} {1:12} {2:8} {3:12.6f} {4}".format(
+                        family, solver, size, timing["median"], timing["outcome"]), file=sys.stderr)
+                if timing["median"] > budget:
+                    break
+
+            results.append({
+                "family": family,
+                "solver": solver,
+                "points": points,
+                "exponent": scaling_exponent([(p["size"], p["median"]) for p in points])
+            })
+
+    return {"benchmark": "unification", "environment": environment(), "results": results}
+
+
+def run_throughput(count: int, size: int = 4, repeat: int = 3) -> dict:
+    """
+    Compare solving count random systems of given size in a loop with solve_set_of_equations and with solve_batch,
+    with and without its numpy passes (only the pure Python one if numpy is not installed).
+
+    :return: report suitable for JSON
+    """
+    def make_input():
+        return [random_system(size, seed) for seed in range(count)]
+
+    def loop(systems: list) -> list:
+        result = []
+        for system in systems:
+            try:
+                result.append(solve_set_of_equations(system))
+            except InconsistentSystemError:
+                result.append(None)
+        return result
+
+    solvers = [("loop", loop), ("batch", lambda systems: solve_batch(systems, vectorize=False))]
+    if batchunify.numpy is not None:
+        solvers.append(("batch_numpy", lambda systems: solve_batch(systems, vectorize=True)))
+
+    results = []
+    for name, solver in solvers:
+        timing = measure(solver, make_input, repeat=repeat)
+        timing["systems_per_second"] = count / timing["median"]
+        timing["solver"] = name
+        results.append(timing)
+        print("{0:12} {1:8} {2:12.6f} {3:12.0f}/s".format(
+                name, count, timing["median"], timing["systems_per_second"]), file=sys.stderr)
+
+    return {
+        "benchmark": "unification_throughput",
+        "environment": environment(),
+        "count": count,
+        "size": size,
+        "results": results
+    }
+
+
+def main(argv):
+    usage = "unification.py -f <family,...> -s <solver,...> -n <size,...> -r <repeat> -b <budget> -o <output_file>" \
+            " | -t <count>"
+    families = list(FAMILIES.keys())
+    solvers = list(SOLVERS.keys())
+    sizes = None
+    repeat = 3
+    budget = 5.0
+    output_file = "-"
+    throughput = None
+
+    try:
+        opts, args = getopt.getopt(argv, "hf:s:n:r:b:o:t:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            print("families: " + ", ".join(FAMILIES.keys()))
+            print("solvers: " + ", ".join(SOLVERS.keys()))
+            sys.exit()
+        elif opt == "-f":
+            families = arg.split(",")
+        elif opt == "-s":
+            solvers = arg.split(",")
+        elif opt == "-n":
+            sizes = [int(size) for size in arg.split(",")]
+        elif opt == "-r":
+            repeat = int(arg)
+        elif opt == "-b":
+            budget = float(arg)
+        elif opt == "-o":
+            output_file = arg
+        elif opt == "-t":
+            throughput = int(arg)
+
+    if throughput is not None:
+        write_report(run_throughput(throughput, repeat=repeat), output_file)
+        return
+
+    for name in families:
+        if name not in FAMILIES:
+            print("Unknown family: " + name)
+            sys.exit(2)
+    for name in solvers:
+        if name not in SOLVERS:
+            print("Unknown solver: " + name)
+            sys.exit(2)
+
+    write_report(run(families, solvers, sizes, repeat, budget), output_file)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
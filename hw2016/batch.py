@@ -0,0 +1,308 @@
+"""
+    Batch runner for the homework solvers: one expression per line of the input file.
+    Expressions are parsed on the main process and solved by a pool of worker processes in chunks,
+    a chunk is sent in the binary form of tools.serialize (pickle of deep trees hits the recursion limit).
+    Answers are written in input order through a bounded reorder buffer,
+    so memory does not depend on the size of the input.
+    With a cache file (tools.cache) answers of expressions alpha-equivalent to already solved ones
+    are taken from it on the main process and only the others are sent to the workers.
+
+    Run: python -m hw2016.batch -t <task> -i <input_file> -o <output_file>
+                                [-w <workers>] [-c <chunk>] [-b <buffer>] [-l <timeout>] [-k <cache_file>]
+"""
+import getopt
+import multiprocessing
+import signal
+import sys
+from collections import deque
+
+from hw2016 import first, second, third, fifth
+from tools.cache import ResultCache
+from tools.instrument import instrumented, Report
+from tools.jalgo import JAlgorithm
+from tools.serialize import dumps_all, loads_all
+from tools.tparsing import BufferParser
+
+TASKS = {
+    "1": first.answer,
+    "2": second.answer,
+    "3": third.answer,
+    "3j": lambda exp: third.answer(exp, JAlgorithm),
+    "5": fifth.answer,
+}
+
+# key of task -> (operation, version, answer depends on names of binders) of its entries in the cache,
+# the version must be increased whenever answers of the task change
+CACHE_KEYS = {
+    "1": ("reduce", 2, False),
+    # types of binders are named by their position, not by their names
+    "2": ("infer_simple", 2, False),
+    "3": ("infer_w", 2, True),
+    "3j": ("infer_j", 1, True),
+    "5": ("infer_constraints", 3, True),
+}
+
+TIMEOUT_ANSWER = "Время вычисления истекло"
+
+
+class TimeLimitError(BaseException):
+    """
+        Raised by SIGALRM in a worker, not an Exception so that solvers cannot swallow it.
+    """
+    pass
+
+
+def __alarm__(signum, frame):
+    raise TimeLimitError()
+
+
+def init_worker():
+    """
+    Initializer of worker processes: time limits are delivered by SIGALRM.
+    """
+    signal.signal(signal.SIGALRM, __alarm__)
+    sys.setrecursionlimit(100000)
+
+
+def with_time_limit(timeout: float, func, *args):
+    """
+    Call func(*args) in a process initialized by init_worker.
+    Throws TimeLimitError if it takes more than timeout seconds.
+
+    :param timeout: seconds, 0 means no limit
+    """
+    if timeout > 0:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        if timeout > 0:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def __solve_one__(task: str, exp, timeout: float) -> str:
+    """
+    Solve one expression, answer of failed expression is the error message.
+    :param timeout: seconds for the expression, 0 means no limit
+    """
+    if exp is None:
+        return "Ошибка разбора"
+    try:
+        return with_time_limit(timeout, TASKS[task], exp)
+    except TimeLimitError:
+        return TIMEOUT_ANSWER
+    except Exception as e:
+        return "Ошибка: " + str(e)
+
+
+def __solve_chunk__(args) -> (list, dict):
+    """
+    :param args: tuple(task, expressions or their tools.serialize stream, timeout, profile)
+    :return: tuple(answers, counters of instrumentation or None if profile is off)
+    """
+    task, expressions, timeout, profile = args
+    if isinstance(expressions, bytes):
+        expressions = loads_all(expressions)
+    if not profile:
+        return [__solve_one__(task, exp, timeout) for exp in expressions], None
+    with instrumented() as report:
+        answers = [__solve_one__(task, exp, timeout) for exp in expressions]
+    return answers, report.to_dict()
+
+
+def __chunks__(input_file, chunk: int):
+    """
+    Parse lines of input_file, empty lines are skipped.
+    :return: generator of lists of at most chunk parsed expressions (None for unparsable lines)
+    """
+    parser_ = BufferParser()
+    current = []
+    for line in input_file:
+        if not line.strip():
+            continue
+        try:
+            current.append(parser_.parse(line.encode("utf-8")))
+        except Exception:
+            current.append(None)
+        if len(current) == chunk:
+            yield current
+            current = []
+    if current:
+        yield current
+
+
+def __lookup__(cache: ResultCache, task: str, expressions: list) -> (list, list, list):
+    """
+    :return: tuple(keys (None for unparsable expressions), cached answers (None if missing),
+                   expressions to solve)
+    """
+    if cache is None:
+        return None, None, expressions
+    op, version, names = CACHE_KEYS[task]
+    keys = [cache.key(op, version, exp, names) if exp is not None else None for exp in expressions]
+    cached = [cache.get(key) if key is not None else None for key in keys]
+    return keys, cached, [exp for exp, answer in zip(expressions, cached) if answer is None]
+
+
+def __merge__(cache: ResultCache, keys: list, cached: list, result: tuple) -> tuple:
+    """
+    Put solved answers between the cached ones and store them in the cache.
+    """
+    if cache is None:
+        return result
+    answers, counters = result
+    solved = iter(answers)
+    merged = []
+    for key, answer in zip(keys, cached):
+        if answer is None:
+            answer = next(solved)
+            # a timeout depends on the machine, not on the expression
+            if key is not None and answer != TIMEOUT_ANSWER:
+                cache.put(key, answer)
+        merged.append(answer)
+    return merged, counters
+
+
+def __write__(output_file, result: tuple, profile: Report):
+    answers, counters = result
+    if profile is not None:
+        profile.merge(counters)
+    for answer in answers:
+        output_file.write(answer.rstrip("\n") + "\n")
+        if "\n" in answer.rstrip("\n"):
+            # multi-line answers are separated by an empty line
+            output_file.write("\n")
+
+
+def run(task: str, input_file, output_file, workers: int = None, chunk: int = 64, buffer: int = None,
+        timeout: float = 0, profile: Report = None, cache: ResultCache = None) -> int:
+    """
+    Solve every expression of input_file and write answers to output_file in input order.
+
+    :param task: key of TASKS
+    :param workers: number of worker processes, os.cpu_count() by default; 0 solves on the main process
+    :param chunk: number of expressions sent to a worker at once
+    :param buffer: maximal number of chunks in flight (solving or waiting to be written), 2 * workers by default
+    :param timeout: seconds for one expression, 0 means no limit
+    :param profile: if given, counters of instrumentation of all workers are added to it
+    :param cache: if given, answers are looked up in it before solving and solved ones are stored in it
+    :return: number of solved expressions
+    """
+    if task not in TASKS:
+        raise ValueError("Unknown task " + task)
+    count = 0
+
+    if workers == 0:
+        # time limits are delivered by SIGALRM to the main process as they are to workers
+        previous = signal.signal(signal.SIGALRM, __alarm__) if timeout > 0 else None
+        try:
+            for expressions in __chunks__(input_file, chunk):
+                keys, cached, misses = __lookup__(cache, task, expressions)
+                result = __solve_chunk__((task, misses, timeout, profile is not None))
+                __write__(output_file, __merge__(cache, keys, cached, result), profile)
+                count += len(expressions)
+        finally:
+            if previous is not None:
+                signal.signal(signal.SIGALRM, previous)
+        return count
+
+    workers = workers or multiprocessing.cpu_count()
+    buffer = buffer or 2 * workers
+    with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+        # tuple(keys, cached answers, result) of submitted chunks in input order, the oldest one is written first
+        pending = deque()
+
+        def write_oldest():
+            keys, cached, result = pending.popleft()
+            __write__(output_file, __merge__(cache, keys, cached, result.get()), profile)
+
+        for expressions in __chunks__(input_file, chunk):
+            if len(pending) == buffer:
+                write_oldest()
+            keys, cached, misses = __lookup__(cache, task, expressions)
+            args = (task, dumps_all(misses), timeout, profile is not None)
+            pending.append((keys, cached, pool.apply_async(__solve_chunk__, (args,))))
+            count += len(expressions)
+        while pending:
+            write_oldest()
+    return count
+
+
+def main(argv):
+    usage = "batch.py -t <1|2|3|3j|5> -i <input_file> -o <output_file> [-w <workers>] [-c <chunk>] [-b <buffer>]" \
+            " [-l <timeout>] [-p <profile.json>] [-k <cache_file>] [-m <cache_bytes>]"
+    task = "1"
+    input_file = "-"
+    output_file = "-"
+    workers = None
+    chunk = 64
+    buffer = None
+    timeout = 0
+    profile_file = None
+    cache_file = None
+    cache_bytes = 256 * 1024 * 1024
+
+    try:
+        opts, args = getopt.getopt(argv, "ht:i:o:w:c:b:l:p:k:m:",
+                                   ["task=", "input_file=", "output_file=", "workers=", "chunk=", "buffer=",
+                                    "timeout=", "profile=", "cache=", "cache_bytes="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            print("  -w  number of worker processes (cpu count by default, 0 to solve on the main process)")
+            print("  -c  expressions per chunk sent to a worker")
+            print("  -b  maximal number of chunks in flight")
+            print("  -l  time limit for one expression in seconds")
+            print("  -p  write counters of calls and time of hot functions of tools as JSON")
+            print("  -k  cache of answers (SQLite file), shared by runs")
+            print("  -m  limit of size of the cache in bytes")
+            sys.exit()
+        elif opt in ("-t", "--task"):
+            task = arg
+        elif opt in ("-i", "--input_file"):
+            input_file = arg
+        elif opt in ("-o", "--output_file"):
+            output_file = arg
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt in ("-c", "--chunk"):
+            chunk = int(arg)
+        elif opt in ("-b", "--buffer"):
+            buffer = int(arg)
+        elif opt in ("-l", "--timeout"):
+            timeout = float(arg)
+        elif opt in ("-p", "--profile"):
+            profile_file = arg
+        elif opt in ("-k", "--cache"):
+            cache_file = arg
+        elif opt in ("-m", "--cache_bytes"):
+            cache_bytes = int(arg)
+
+    input_ = sys.stdin if input_file == "-" else open(input_file, "r")
+    output_ = sys.stdout if output_file == "-" else open(output_file, "w")
+    profile = Report() if profile_file is not None else None
+    cache = ResultCache(cache_file, cache_bytes) if cache_file is not None else None
+    try:
+        run(task, input_, output_, workers, chunk, buffer, timeout, profile, cache)
+        if cache is not None:
+            print("cache: " + ", ".join("{0} {1}".format(name, value) for name, value in cache.stats().items()),
+                  file=sys.stderr)
+        if profile is not None:
+            with open(profile_file, "w") as profile_output:
+                profile_output.write(profile.to_json())
+            print(profile.to_text(), file=sys.stderr)
+    finally:
+        if cache is not None:
+            cache.close()
+        if input_ is not sys.stdin:
+            input_.close()
+        if output_ is not sys.stdout:
+            output_.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
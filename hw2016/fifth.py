@@ -2,29 +2,36 @@ import getopt
 import os
 import sys
 
-from tools.tparsing import BaseParser
+from tools.tparsing import parse_file
 from tools.constraints import *
 from tools.tstructure import TVar
 
 
-def solve(input_file, output_file):
-    infer = ConstraintResolver()
-    parser_ = BaseParser()
-    temp = input_file.readline()
-
-    exp = parser_.parse(temp)
+def answer(exp: Expression) -> str:
+    """
+    :return: type of the given expression, instantiations of let-bound variables, the type bound to result
+             and types of other variables
+    """
+    infer = WorklistResolver()
     result_type = TVar("result")
     constraint = infer.generate_constraint(exp, result_type)
 
-    output_file.write(str(infer.resolve(constraint, result_type)) + "\n")
+    result = str(infer.resolve(constraint, result_type)) + "\n"
 
-    for eq in set(infer.inst):
+    # repeated lines are printed once, in the order they were found
+    for eq in dict.fromkeys(infer.inst):
         if eq.left in infer.variable_map:
             del infer.variable_map[eq.left]
-        output_file.write(str(eq.left) + " : " + str(eq.right) + "\n")
+        result += str(eq.left) + " : " + str(eq.right) + "\n"
 
     for eq in infer.variable_map.keys():
-        output_file.write(str(eq) + " : " + str(infer.variable_map[eq]) + "\n")
+        result += str(eq) + " : " + str(infer.variable_map[eq]) + "\n"
+    return result
+
+
+def solve(input_file, output_file):
+    exp = parse_file(input_file)
+    output_file.write(answer(exp))
 
 def main(argv):
     input_file = 'task5.in'
@@ -2,40 +2,66 @@ import getopt
 import os
 import sys
 
-from tools.tparsing import BaseParser
-from tools.utils import reduction
+from tools.explicit import stream_normal_form
+from tools.tparsing import parse_file
+from tools.tstructure import Expression
+from tools.utils import reduction, REDUCTION_ENGINES
 
 
-def solve(input_file, output_file):
-    parser_ = BaseParser()
-    exp = parser_.parse(input_file.readline())
-    output_file.write(str(reduction(exp)))
+def answer(exp: Expression, engine: str = "substitution") -> str:
+    """
+    :param engine: key of tools.utils.REDUCTION_ENGINES
+    :return: normal form of the given expression
+    """
+    return str(reduction(exp, engine=engine))
+
+
+def solve(input_file, output_file, engine: str = "substitution", stream: bool = False):
+    """
+    :param stream: write the normal form head first while its arguments are still reduced (engine is not used)
+    """
+    exp = parse_file(input_file)
+    if stream:
+        for piece in stream_normal_form(exp):
+            output_file.write(piece)
+    else:
+        output_file.write(answer(exp, engine))
 
 
 def main(argv):
     input_file = 'task1.in'
     output_file = 'task1.out'
+    engine = "substitution"
+    stream = False
 
     try:
-        opts, args = getopt.getopt(argv, "hi:o:", ["input_file=", "output_file="])
+        opts, args = getopt.getopt(argv, "hi:o:e:s", ["input_file=", "output_file=", "engine=", "stream"])
     except getopt.GetoptError:
         print("fifth.py -i <input_file> -o <output_file>")
         sys.exit(2)
 
     for opt, arg in opts:
         if opt == "-h":
-            print("first.py -i <input_file> -o <output_file>")
+            print("first.py -i <input_file> -o <output_file> [-e <{0}>] [-s]".format("|".join(REDUCTION_ENGINES)))
+            print("  -s  write the normal form head first while it is reduced")
             sys.exit()
         elif opt in ("-i", "-input_file"):
             input_file = arg
         elif opt in ("-o", "-output_file"):
             output_file = arg
+        elif opt in ("-e", "-engine"):
+            if arg not in REDUCTION_ENGINES:
+                print("Unknown engine " + arg)
+                sys.exit(2)
+            engine = arg
+        elif opt in ("-s", "-stream"):
+            stream = True
 
     script_path = os.path.dirname(__file__)
     input_ = open(os.path.join(script_path, input_file), "r")
     output_ = open(os.path.join(script_path, output_file), "w")
 
-    solve(input_, output_)
+    solve(input_, output_, engine, stream)
 
 
 if __name__ == "__main__":
@@ -2,21 +2,27 @@ import getopt
 import os
 import sys
 
-from tools.tparsing import BaseParser
+from tools.tparsing import parse_file
 from tools.inference import *
 
 
-def solve(input_file, output_file):
-    parser_ = BaseParser()
-    exp = parser_.parse(input_file.readline())
-
+def answer(exp: Expression) -> str:
+    """
+    :return: type of the given expression and types of its free variables, one per line
+    """
     context, t = ClassicInferer().get_type_with_context(exp)
-    if type is None:
-        output_file.write("Лямбда-выражение не имеет типа")
-    else:
-        output_file.write(str(t) + "\n")
-        for var in context.keys():
-            output_file.write(str(var) + " : " + str(context[var]) + "\n")
+    if t is None:
+        return "Лямбда-выражение не имеет типа"
+
+    result = str(t) + "\n"
+    for var in context.keys():
+        result += str(var) + " : " + str(context[var]) + "\n"
+    return result
+
+
+def solve(input_file, output_file):
+    exp = parse_file(input_file)
+    output_file.write(answer(exp))
 
 
 def main(argv):
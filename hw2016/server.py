@@ -0,0 +1,293 @@
+"""
+    Long-lived server for reduction and type inference requests, so that a request does not pay
+    interpreter startup and imports of tools.
+    Protocol is JSON lines: request {"id": ..., "op": <operation>, "expression": <string>
+    [, "max_steps": <int>] [, "timeout": <seconds>] [, "profile": true]}, response {"id": ..., "ok": true,
+    "result": ...} or {"id": ..., "ok": false, "error": <message>}, with "profile" it also has counters
+    of tools.instrument. Responses of one client come in order of completion.
+    Operations:
+        reduce            - normal form (first homework),
+        infer_simple      - type without let polymorphism (second homework),
+        infer_w           - type by algorithm W (third homework),
+        infer_constraints - type by constraint solving (fifth homework).
+    Requests are solved by a pool of worker processes started together with the server.
+
+    Run: python -m hw2016.server [-s <unix_socket>] [-w <workers>] [-l <timeout>] [-m <max_steps>]
+    Without -s requests are read from stdin and responses are written to stdout.
+"""
+import asyncio
+import getopt
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from hw2016.batch import init_worker, with_time_limit, TimeLimitError
+from tools.constraints import WorklistResolver
+from tools.inference import ClassicInferer
+from tools.instrument import instrumented
+from tools.tparsing import BufferParser
+from tools.tstructure import TVar
+from tools.utils import reduction
+from tools.walgo import WAlgorithm
+
+
+def __context__(context: dict) -> dict:
+    return dict((str(var), str(t)) for var, t in context.items())
+
+
+def __normal_form__(exp, max_steps: int) -> dict:
+    return {"normal_form": str(reduction(exp, max_steps))}
+
+
+def __simple_type__(exp, max_steps: int) -> dict:
+    context, t = ClassicInferer().get_type_with_context(exp)
+    if t is None:
+        return {"type": None}
+    return {"type": str(t), "context": __context__(context)}
+
+
+def __w_type__(exp, max_steps: int) -> dict:
+    walgo = WAlgorithm()
+    context, t = walgo.infer_type(exp)
+    return {"type": str(t), "context": __context__(context),
+            "inst": [[str(eq.left), str(eq.right)] for eq in walgo.inst]}
+
+
+def __constraint_type__(exp, max_steps: int) -> dict:
+    infer = WorklistResolver()
+    result_type = TVar("result")
+    t = infer.resolve(infer.generate_constraint(exp, result_type), result_type)
+    return {"type": str(t), "context": __context__(infer.variable_map),
+            "inst": [[str(eq.left), str(eq.right)] for eq in infer.inst]}
+
+
+OPERATIONS = {
+    "reduce": __normal_form__,
+    "infer_simple": __simple_type__,
+    "infer_w": __w_type__,
+    "infer_constraints": __constraint_type__,
+}
+
+
+def __evaluate__(op: str, text: str, max_steps: int, timeout: float) -> dict:
+    try:
+        exp = BufferParser().parse(text.encode("utf-8"))
+        result = with_time_limit(timeout, OPERATIONS[op], exp, max_steps)
+        return {"ok": True, "result": result}
+    except TimeLimitError:
+        return {"ok": False, "error": "Time limit of {0} seconds exceeded".format(timeout)}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+def evaluate(op: str, text: str, max_steps: int = None, timeout: float = 0, profile: bool = False) -> dict:
+    """
+    Parse and solve one request, runs in a worker process.
+
+    :param max_steps: limit of reduction steps, None means no limit
+    :param timeout: seconds for the request, 0 means no limit
+    :param profile: add counters of calls and time of hot functions of tools to the response
+    :return: response without id
+    """
+    if not profile:
+        return __evaluate__(op, text, max_steps, timeout)
+    with instrumented() as report:
+        response = __evaluate__(op, text, max_steps, timeout)
+    response["profile"] = report.to_dict()
+    return response
+
+
+def __non_negative__(request: dict, field: str, integer: bool):
+    """
+    :param integer: the field must be an int, otherwise any finite number
+    :return: value of the optional field of the request, None if it is absent
+    :raise ValueError: if the value is not a non-negative number of that kind
+    """
+    value = request.get(field)
+    if value is None:
+        return None
+    kinds = (int,) if integer else (int, float)
+    # bool is an int for isinstance, and "not value >= 0" is true for nan
+    if isinstance(value, bool) or not isinstance(value, kinds) or not value >= 0 or value == float("inf"):
+        raise ValueError("{0} must be a non-negative {1}".format(field, "integer" if integer else "number"))
+    return value
+
+
+def __request_id__(line: str):
+    """
+    :return: id of the request line or None if it can not be read
+    """
+    try:
+        request = json.loads(line)
+    except ValueError:
+        return None
+    return request.get("id") if isinstance(request, dict) else None
+
+
+def __limit__(requested, limit):
+    """
+    :return: the smallest of requested and server limit, None (or 0 for time) means no limit
+    """
+    if not requested:
+        return limit
+    if not limit:
+        return requested
+    return min(requested, limit)
+
+
+class Server:
+    """
+        Dispatches JSON-lines requests of any number of clients to one warm process pool.
+    """
+
+    def __init__(self, workers: int = None, timeout: float = 0, max_steps: int = None):
+        """
+        :param workers: number of worker processes, cpu count by default
+        :param timeout: limit of seconds for one request, 0 means no limit
+        :param max_steps: limit of reduction steps for one request, None means no limit
+        """
+        self.workers = workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.pool = None
+
+    def start(self):
+        self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker)
+        # start all workers now, so that the first requests do not wait for them
+        for future in [self.pool.submit(os.getpid) for i in range(self.workers)]:
+            future.result()
+
+    def stop(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def handle(self, line: str) -> dict:
+        """
+        :return: response to one request line, an error response if anything fails,
+                 so that the client always gets a line for its request
+        """
+        try:
+            return await self.__handle__(line)
+        except Exception as e:
+            return {"id": __request_id__(line), "ok": False, "error": "{0}: {1}".format(type(e).__name__, e)}
+
+    async def __handle__(self, line: str) -> dict:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be an object")
+        except ValueError as e:
+            return {"id": None, "ok": False, "error": "Invalid request: " + str(e)}
+
+        id = request.get("id")
+        op = request.get("op")
+        text = request.get("expression")
+        if op not in OPERATIONS:
+            return {"id": id, "ok": False, "error": "Unknown operation: " + str(op)}
+        if not isinstance(text, str):
+            return {"id": id, "ok": False, "error": "Expression must be a string"}
+
+        try:
+            max_steps = __limit__(__non_negative__(request, "max_steps", True), self.max_steps)
+            timeout = __limit__(__non_negative__(request, "timeout", False), self.timeout)
+        except ValueError as e:
+            return {"id": id, "ok": False, "error": "Invalid request: " + str(e)}
+        loop = asyncio.get_running_loop()
+        response = {"id": id}
+        response.update(await loop.run_in_executor(self.pool, evaluate, op, text, max_steps, timeout,
+                                                   bool(request.get("profile"))))
+        return response
+
+    async def serve_stream(self, reader: asyncio.StreamReader, write):
+        """
+        Serve requests of one client concurrently until end of its stream.
+
+        :param write: function writing a response line
+        """
+        tasks = set()
+
+        async def respond(line: str):
+            write(json.dumps(await self.handle(line), ensure_ascii=False) + "\n")
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.decode("utf-8").strip()
+            if line:
+                task = asyncio.ensure_future(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def serve_stdio(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        def write(line: str):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+        await self.serve_stream(reader, write)
+
+    async def serve_unix(self, path: str):
+        async def client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                await self.serve_stream(reader, lambda line: writer.write(line.encode("utf-8")))
+                await writer.drain()
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(client, path)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv):
+    usage = "server.py [-s <unix_socket>] [-w <workers>] [-l <timeout>] [-m <max_steps>]"
+    socket_path = None
+    workers = None
+    timeout = 0
+    max_steps = None
+
+    try:
+        opts, args = getopt.getopt(argv, "hs:w:l:m:", ["socket=", "workers=", "timeout=", "max_steps="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            print("  -s  listen on unix socket instead of stdin/stdout")
+            print("  -w  number of worker processes (cpu count by default)")
+            print("  -l  time limit for one request in seconds")
+            print("  -m  limit of reduction steps for one request")
+            sys.exit()
+        elif opt in ("-s", "--socket"):
+            socket_path = arg
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt in ("-l", "--timeout"):
+            timeout = float(arg)
+        elif opt in ("-m", "--max_steps"):
+            max_steps = int(arg)
+
+    server = Server(workers, timeout, max_steps)
+    server.start()
+    try:
+        if socket_path is None:
+            asyncio.run(server.serve_stdio())
+        else:
+            asyncio.run(server.serve_unix(socket_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
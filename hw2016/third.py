@@ -2,39 +2,49 @@ import getopt
 import os
 import sys
 
-from tools.tparsing import BaseParser
+from tools.tparsing import parse_file
+from tools.jalgo import JAlgorithm
 from tools.walgo import *
 
 
-def solve(input_file, output_file):
-    parser_ = BaseParser()
-    walgo = WAlgorithm()
-    temp = input_file.readline()
-
-    exp = parser_.parse(temp)
+def answer(exp: Expression, algorithm=WAlgorithm) -> str:
+    """
+    :return: type of the given expression, types of its free variables and instantiations of let-bound ones
+    """
+    walgo = algorithm()
     context, t = walgo.infer_type(exp)
-    output_file.write(str(t) + "\n")
+    result = str(t) + "\n"
     for var in context.keys():
-        output_file.write(str(var) + " : " + str(context[var]) + "\n")
+        result += str(var) + " : " + str(context[var]) + "\n"
 
     for eq in walgo.inst:
-        output_file.write(str(eq.left) + " : " + str(eq.right) + "\n")
+        result += str(eq.left) + " : " + str(eq.right) + "\n"
+    return result
+
+
+def solve(input_file, output_file, algorithm=WAlgorithm):
+    exp = parse_file(input_file)
+    output_file.write(answer(exp, algorithm))
 
 
 def main(argv):
     input_file = 'task3.in'
     output_file = 'task3.out'
+    algorithm = WAlgorithm
 
     try:
-        opts, args = getopt.getopt(argv, "hi:o:", ["input_file=", "output_file="])
+        opts, args = getopt.getopt(argv, "hji:o:", ["input_file=", "output_file="])
     except getopt.GetoptError:
-        print("third.py -i <input_file> -o <output_file>")
+        print("third.py [-j] -i <input_file> -o <output_file>")
         sys.exit(2)
 
     for opt, arg in opts:
         if opt == "-h":
-            print("third.py -i <input_file> -o <output_file>")
+            print("third.py [-j] -i <input_file> -o <output_file>")
+            print("  -j  use algorithm J (one mutable solution store) instead of W")
             sys.exit()
+        elif opt == "-j":
+            algorithm = JAlgorithm
         elif opt in ("-i", "-input_file"):
             input_file = arg
         elif opt in ("-o", "-output_file"):
@@ -44,7 +54,7 @@ def main(argv):
     input_ = open(os.path.join(script_path, input_file), "r")
     output_ = open(os.path.join(script_path, output_file), "w")
 
-    solve(input_, output_)
+    solve(input_, output_, algorithm)
 
 
 if __name__ == "__main__":
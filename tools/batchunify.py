@@ -0,0 +1,488 @@
+"""
+    Unification of many small independent systems of equations at once.
+    Systems are encoded into flat integer arrays (one node space for the whole batch),
+    solved with a single union-find pass and decoded back to lists of Equation.
+
+    When numpy is installed, unification and decoding of large batches are vectorized over systems:
+    every round takes the next pair of each system at once. Pairs of a system are taken in the same order
+    as by the pure Python pass, so the results are the same.
+"""
+from array import array
+
+from tools.equations import Equation, solve_set_of_equations
+from tools.terrors import InconsistentSystemError
+from tools.tstructure import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TAG_VAR = 0
+TAG_IMPL = 1
+
+# smaller batches are solved in pure Python, numpy calls of a round cost more than they save there
+VECTORIZE_MIN_SYSTEMS = 64
+
+
+class EncodedBatch:
+    """
+        Flat representation of a batch of systems.
+        Node i is a variable (tags[i] == TAG_VAR, names[name_ids[i]] is its name)
+        or an implication (tags[i] == TAG_IMPL with children left[i] and right[i]).
+        Nodes of system k are system_start[k] .. system_start[k + 1] - 1,
+        equations of system k are eq_start[k] .. eq_start[k + 1] - 1.
+    """
+
+    def __init__(self):
+        self.tags = array('b')
+        self.left = array('l')
+        self.right = array('l')
+        self.name_ids = array('l')
+        self.owner = array('l')
+        self.names = []
+        self.system_start = array('l', [0])
+        self.eq_left = array('l')
+        self.eq_right = array('l')
+        self.eq_start = array('l', [0])
+
+    def __len__(self):
+        return len(self.system_start) - 1
+
+
+def encode_systems(systems: list) -> EncodedBatch:
+    """
+    Encode given systems into one EncodedBatch.
+    Variables with the same name share one node inside a system, shared subtrees are encoded once.
+
+    :param systems: list of lists of Equation
+    :return: encoded batch
+    """
+    batch = EncodedBatch()
+    name_table = {}
+    tags = batch.tags
+    left = batch.left
+    right = batch.right
+    name_ids = batch.name_ids
+    owner = batch.owner
+
+    for number, system in enumerate(systems):
+        var_nodes = {}
+        encoded = {}
+
+        def encode(t: TType) -> int:
+            stack = [t]
+            while stack:
+                cur = stack[-1]
+                if id(cur) in encoded:
+                    stack.pop()
+                elif isinstance(cur, TVar):
+                    stack.pop()
+                    node = var_nodes.get(cur.name)
+                    if node is None:
+                        node = len(tags)
+                        name_id = name_table.get(cur.name)
+                        if name_id is None:
+                            name_id = name_table[cur.name] = len(batch.names)
+                            batch.names.append(cur.name)
+                        tags.append(TAG_VAR)
+                        left.append(-1)
+                        right.append(-1)
+                        name_ids.append(name_id)
+                        owner.append(number)
+                        var_nodes[cur.name] = node
+                    encoded[id(cur)] = (node, cur)
+                elif isinstance(cur, TImpl):
+                    l = encoded.get(id(cur.left))
+                    r = encoded.get(id(cur.right))
+                    if l is None:
+                        stack.append(cur.left)
+                    if r is None:
+                        stack.append(cur.right)
+                    if l is not None and r is not None:
+                        stack.pop()
+                        node = len(tags)
+                        tags.append(TAG_IMPL)
+                        left.append(l[0])
+                        right.append(r[0])
+                        name_ids.append(-1)
+                        owner.append(number)
+                        encoded[id(cur)] = (node, cur)
+                else:
+                    raise Exception("encode_systems exception: No such type {0}".format(cur))
+            # The object is kept in the table so that its id is not reused while encoding
+            return encoded[id(t)][0]
+
+        for equation in system:
+            batch.eq_left.append(encode(equation.left))
+            batch.eq_right.append(encode(equation.right))
+
+        batch.system_start.append(len(tags))
+        batch.eq_start.append(len(batch.eq_left))
+
+    return batch
+
+
+def __can_vectorize__(batch: EncodedBatch) -> bool:
+    """
+    :return: True if numpy is installed and the batch has many systems, none of which is much larger than others
+             (stacks of pairs of all systems have the size of the largest one)
+    """
+    if numpy is None or len(batch) < VECTORIZE_MIN_SYSTEMS:
+        return False
+    return len(batch) * __stack_size__(batch) <= 4 * (len(batch.tags) + len(batch.eq_left))
+
+
+def __stack_size__(batch: EncodedBatch) -> int:
+    """
+    :return: bound of the number of pairs waiting for unification in one system:
+             a pair of implications is replaced by two pairs of children and merges two classes of nodes
+    """
+    nodes = numpy.diff(numpy.frombuffer(batch.system_start, dtype='l'))
+    equations = numpy.diff(numpy.frombuffer(batch.eq_start, dtype='l'))
+    return int((nodes + equations).max(initial=0)) + 1
+
+
+def __roots__(parent, nodes):
+    """
+    Find roots of given nodes in parent (numpy array) and make them parents of the nodes.
+    """
+    roots = parent[nodes]
+    while True:
+        up = parent[roots]
+        if numpy.array_equal(up, roots):
+            break
+        roots = up
+    parent[nodes] = roots
+    return roots
+
+
+def __bottom_up__(batch: EncodedBatch, parent):
+    """
+    Order roots of implications so that roots of their children come first.
+
+    :param parent: numpy array of union-find with compressed paths
+    :return: tuple(ordered roots, roots that are left on cycles or above them)
+    """
+    tags = numpy.frombuffer(batch.tags, dtype=numpy.int8)
+    roots = parent == numpy.arange(len(parent))
+    done = roots & (tags == TAG_VAR)
+    pending = numpy.nonzero(roots & (tags == TAG_IMPL))[0]
+    left = parent[numpy.frombuffer(batch.left, dtype='l')[pending]]
+    right = parent[numpy.frombuffer(batch.right, dtype='l')[pending]]
+    order = []
+    while len(pending):
+        ready = done[left] & done[right]
+        if not ready.any():
+            break
+        order.append(pending[ready])
+        done[pending[ready]] = True
+        waiting = ~ready
+        pending, left, right = pending[waiting], left[waiting], right[waiting]
+    return (numpy.concatenate(order) if order else pending[:0]), pending
+
+
+def __unify_vectorized__(batch: EncodedBatch) -> (array, array):
+    """
+    unify_batch with numpy: each system has its own stack of pairs, every round pops the top pair of all of them.
+    """
+    tags = numpy.frombuffer(batch.tags, dtype=numpy.int8)
+    left = numpy.frombuffer(batch.left, dtype='l')
+    right = numpy.frombuffer(batch.right, dtype='l')
+    eq_start = numpy.frombuffer(batch.eq_start, dtype='l')
+    parent = numpy.arange(len(tags), dtype='l')
+
+    counts = numpy.diff(eq_start)
+    owners = numpy.repeat(numpy.arange(len(batch)), counts)
+    column = numpy.arange(len(owners)) - eq_start[owners]
+    stack_left = numpy.zeros((len(batch), __stack_size__(batch)), dtype='l')
+    stack_right = numpy.zeros_like(stack_left)
+    stack_left[owners, column] = numpy.frombuffer(batch.eq_left, dtype='l')
+    stack_right[owners, column] = numpy.frombuffer(batch.eq_right, dtype='l')
+    depth = counts.copy()
+
+    active = numpy.nonzero(depth)[0]
+    while len(active):
+        depth[active] -= 1
+        top = depth[active]
+        a = __roots__(parent, stack_left[active, top])
+        b = __roots__(parent, stack_right[active, top])
+        differ = a != b
+        systems, a, b = active[differ], a[differ], b[differ]
+        # the same choice as in the loop of unify_batch
+        a_var = tags[a] == TAG_VAR
+        b_var = ~a_var & (tags[b] == TAG_VAR)
+        parent[a[~b_var]] = b[~b_var]
+        parent[b[b_var]] = a[b_var]
+        both = ~a_var & ~b_var
+        systems, a, b = systems[both], a[both], b[both]
+        top = depth[systems]
+        stack_left[systems, top] = left[a]
+        stack_right[systems, top] = left[b]
+        stack_left[systems, top + 1] = right[a]
+        stack_right[systems, top + 1] = right[b]
+        depth[systems] += 2
+        active = active[depth[active] > 0]
+
+    while True:
+        up = parent[parent]
+        if numpy.array_equal(up, parent):
+            break
+        parent = up
+
+    failed = numpy.zeros(len(batch), dtype=numpy.int8)
+    cyclic = __bottom_up__(batch, parent)[1]
+    failed[numpy.frombuffer(batch.owner, dtype='l')[cyclic]] = 1
+    return array('l', parent.tobytes()), array('b', failed.tobytes())
+
+
+def unify_batch(batch: EncodedBatch, vectorize: bool = None) -> (array, array):
+    """
+    Unify all equations of the batch. Node spaces of systems are disjoint, so they are solved in one pass.
+
+    :param batch: encoded batch
+    :param vectorize: use numpy, by default if it is installed and the batch is large enough
+    :return: tuple(parent array of union-find with compressed paths, array with 1 for every inconsistent system)
+    """
+    if vectorize is None:
+        vectorize = __can_vectorize__(batch)
+    if vectorize:
+        return __unify_vectorized__(batch)
+
+    tags = batch.tags
+    left = batch.left
+    right = batch.right
+    parent = array('l', range(len(tags)))
+
+    def find(node: int) -> int:
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    stack = list(zip(batch.eq_left, batch.eq_right))
+    while stack:
+        a, b = stack.pop()
+        a = find(a)
+        b = find(b)
+        if a == b:
+            continue
+        if tags[a] == TAG_VAR:
+            parent[a] = b
+        elif tags[b] == TAG_VAR:
+            parent[b] = a
+        else:
+            # Merge before unifying children, so cyclic systems terminate
+            parent[a] = b
+            stack.append((left[a], left[b]))
+            stack.append((right[a], right[b]))
+
+    for node in range(len(parent)):
+        find(node)
+
+    failed = array('b', bytes(len(batch)))
+    # Occurs check: a cycle among roots of implications. 0 - not visited, 1 - on stack, 2 - done
+    color = bytearray(len(tags))
+    for start in range(len(tags)):
+        if color[start] != 0 or parent[start] != start:
+            continue
+        color[start] = 1
+        stack = [(start, 0)]
+        while stack:
+            node, child = stack[-1]
+            if tags[node] != TAG_IMPL or child == 2:
+                color[node] = 2
+                stack.pop()
+                continue
+            stack[-1] = (node, child + 1)
+            next = parent[left[node] if child == 0 else right[node]]
+            if color[next] == 0:
+                color[next] = 1
+                stack.append((next, 0))
+            elif color[next] == 1:
+                failed[batch.owner[node]] = 1
+
+    return parent, failed
+
+
+def __decode_vectorized__(batch: EncodedBatch, parent: array, failed: array) -> list:
+    """
+    decode_solutions with numpy: types of all roots are built in one loop in bottom-up order.
+    """
+    names = batch.names
+    name_ids = batch.name_ids
+    tags = numpy.frombuffer(batch.tags, dtype=numpy.int8)
+    nodes = numpy.arange(len(tags))
+    parent_ = numpy.frombuffer(parent, dtype='l')
+    built = [None] * len(tags)
+
+    for node in numpy.nonzero((parent_ == nodes) & (tags == TAG_VAR))[0].tolist():
+        built[node] = TVar(names[name_ids[node]])
+    order = __bottom_up__(batch, parent_)[0]
+    lefts = parent_[numpy.frombuffer(batch.left, dtype='l')[order]].tolist()
+    rights = parent_[numpy.frombuffer(batch.right, dtype='l')[order]].tolist()
+    for node, l, r in zip(order.tolist(), lefts, rights):
+        built[node] = TImpl(built[l], built[r])
+
+    result = [None if failed[number] else [] for number in range(len(batch))]
+    solved = numpy.nonzero((parent_ != nodes) & (tags == TAG_VAR))[0]
+    owners = numpy.frombuffer(batch.owner, dtype='l')[solved].tolist()
+    for node, number in zip(solved.tolist(), owners):
+        equations = result[number]
+        if equations is not None:
+            equations.append(Equation(TVar(names[name_ids[node]]), built[parent[node]]))
+    return result
+
+
+def decode_solutions(batch: EncodedBatch, parent: array, failed: array, vectorize: bool = None) -> list:
+    """
+    Build solved form x=T of every system from the result of unify_batch.
+
+    :param vectorize: use numpy, by default if it is installed and the batch is large enough
+    :return: list with list of Equation for every consistent system and None for every inconsistent one
+    """
+    if vectorize is None:
+        vectorize = __can_vectorize__(batch)
+    if vectorize:
+        return __decode_vectorized__(batch, parent, failed)
+
+    tags = batch.tags
+    left = batch.left
+    right = batch.right
+    names = batch.names
+    name_ids = batch.name_ids
+    built = {}
+
+    def build(root: int) -> TType:
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            if node in built:
+                stack.pop()
+            elif tags[node] == TAG_VAR:
+                built[node] = TVar(names[name_ids[node]])
+                stack.pop()
+            else:
+                l = parent[left[node]]
+                r = parent[right[node]]
+                if l in built and r in built:
+                    built[node] = TImpl(built[l], built[r])
+                    stack.pop()
+                else:
+                    stack.append(l)
+                    stack.append(r)
+        return built[root]
+
+    result = []
+    for number in range(len(batch)):
+        if failed[number]:
+            result.append(None)
+            continue
+        solved = []
+        for node in range(batch.system_start[number], batch.system_start[number + 1]):
+            if tags[node] == TAG_VAR and parent[node] != node:
+                solved.append(Equation(TVar(names[name_ids[node]]), build(parent[node])))
+        result.append(solved)
+
+    return result
+
+
+def solve_batch(systems: list, vectorize: bool = None) -> list:
+    """
+    Solve many independent systems of equations.
+    The solution of every system is in the same form as the result of solve_set_of_equations.
+
+    :param systems: list of lists of Equation
+    :param vectorize: use numpy, by default if it is installed and the batch is large enough
+    :return: list with solved system or None if the system is inconsistent, in the order of systems
+    """
+    batch = encode_systems(systems)
+    if vectorize is None:
+        vectorize = __can_vectorize__(batch)
+    parent, failed = unify_batch(batch, vectorize)
+    return decode_solutions(batch, parent, failed, vectorize)
+
+
+def solve_single(equations: list) -> list:
+    """
+    Solve one system through the batch solver.
+    Throws InconsistentSystemError like solve_set_of_equations.
+    """
+    result = solve_batch([equations])[0]
+    if result is None:
+        raise InconsistentSystemError("equation of type x=T and x in T")
+    return result
+
+
+def test():
+    from tools.equations import apply_system
+
+    def I(t1: TType, t2: TType) -> TImpl:
+        return TImpl(t1, t2)
+
+    t0 = TVar("t0")
+    t1 = TVar("t1")
+    t2 = TVar("t2")
+    t3 = TVar("t3")
+
+    systems = [
+        [Equation(I(t0, t1), I(t1, I(t2, t2)))],
+        [Equation(t0, I(t1, t2)), Equation(t1, t0)],
+        [Equation(t0, t1), Equation(t1, t2), Equation(t2, I(t3, t3))],
+        [],
+        [Equation(t0, t0)],
+        [Equation(I(t0, t0), I(I(t1, t1), t2)), Equation(t2, I(t3, t3))]
+    ]
+
+    print("!!!Testing batch of {0} systems...\n".format(len(systems)))
+    solved = solve_batch(systems)
+    for system, result in zip(systems, solved):
+        print("System {0} solved as {1}".format(
+                [str(i) for i in system], None if result is None else [str(i) for i in result]))
+        try:
+            expected = solve_set_of_equations(list(system))
+        except InconsistentSystemError:
+            assert result is None
+            print("Passed\n")
+            continue
+
+        # Solution may orient x=y differently, so check that it unifies the system and has the same size
+        assert len(result) == len(expected)
+        for equation in system:
+            assert apply_system(equation.left, result) == apply_system(equation.right, result)
+        print("Passed\n")
+
+    if numpy is None:
+        print("numpy is not installed, vectorized passes are not tested\n")
+        return
+
+    print("Testing vectorized passes give the same result")
+    names = [TVar("t" + str(i)) for i in range(4)]
+    batch = []
+    for number in range(3 * VECTORIZE_MIN_SYSTEMS):
+        # small systems over few variables, many of them are inconsistent
+        types = [names[(number + i) % 4] for i in range(6)]
+        for i in range(number % 5):
+            types.append(I(types[-1 - i % 3], types[(number * i) % len(types)]))
+        batch.append([Equation(types[-1 - i], types[(number + 2 * i) % len(types)]) for i in range(number % 4)])
+    batch += systems
+    encoded = encode_systems(batch)
+    assert __can_vectorize__(encoded)
+    parent, failed = unify_batch(encoded, vectorize=False)
+    assert (parent, failed) == unify_batch(encoded, vectorize=True)
+    assert 0 < sum(failed) < len(batch)
+
+    def show(result: list) -> list:
+        return [None if system is None else [str(i) for i in system] for system in result]
+
+    assert show(decode_solutions(encoded, parent, failed, vectorize=True)) == \
+        show(decode_solutions(encoded, parent, failed, vectorize=False))
+    assert show(solve_batch(batch)) == show(solve_batch(batch, vectorize=False))
+    assert solve_batch([], vectorize=True) == [] and solve_batch([[]], vectorize=True) == [[]]
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,245 @@
+"""
+    Persistent cache of results of reduction and type inference in an SQLite file.
+    A result is keyed by a hash of the alpha-invariant key of the parsed expression (tools.canonical)
+    together with the name and the version of the operation, so alpha-equivalent expressions share one entry
+    and bumping the version of an operation invalidates its old results.
+    Answers that print names of bound variables (types of variables, instantiations of let) are keyed
+    by the names of binders too.
+    Values are strings compressed by zlib, the least recently used entries are evicted when the total
+    size of values exceeds the limit.
+"""
+import hashlib
+import os
+import sqlite3
+import zlib
+
+from tools.canonical import canonical_expression
+from tools.tstructure import *
+
+# first byte of a stored value
+__PLAIN__ = b"s"
+__ZLIB__ = b"z"
+# values shorter than this are not worth compressing
+__COMPRESS_FROM__ = 64
+# number of writes between commits
+__COMMIT_EVERY__ = 256
+
+__SCHEMA__ = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+"""
+
+
+def __binders__(exp: Expression) -> list:
+    """
+    :return: names of variables of abstractions and lets in pre-order
+    """
+    names = []
+    stack = [exp]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, Applique):
+            stack.append(cur.right)
+            stack.append(cur.left)
+        elif isinstance(cur, Abstraction):
+            names.append(cur.variable.name)
+            stack.append(cur.expression)
+        elif isinstance(cur, Let):
+            names.append(cur.variable.name)
+            stack.append(cur.expression)
+            stack.append(cur.subst)
+    return names
+
+
+def __encode__(value: str) -> bytes:
+    data = value.encode("utf-8")
+    if len(data) >= __COMPRESS_FROM__:
+        compressed = zlib.compress(data, 9)
+        if len(compressed) < len(data):
+            return __ZLIB__ + compressed
+    return __PLAIN__ + data
+
+
+def __decode__(data: bytes) -> str:
+    if data[:1] == __ZLIB__:
+        return zlib.decompress(data[1:]).decode("utf-8")
+    return data[1:].decode("utf-8")
+
+
+class ResultCache:
+    """
+        Results of operations on expressions by key, see ResultCache.key.
+        Only the process that opened the cache may use it.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param path: SQLite file, created if it does not exist; ":memory:" for a cache without a file
+        :param max_bytes: limit of total size of stored values
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.connection = sqlite3.connect(path)
+        if path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(__SCHEMA__)
+        size, used = self.connection.execute("SELECT COALESCE(SUM(size), 0), COALESCE(MAX(used), 0) FROM results")\
+            .fetchone()
+        self.size = size
+        # logical clock of uses, the entry with the smallest one is evicted first
+        self.clock = used
+        self.uncommitted = 0
+
+    @staticmethod
+    def key(op: str, version: int, exp: Expression, names: bool = False) -> str:
+        """
+        :param op: name of operation
+        :param version: version of operation, results of other versions are never returned
+        :param names: if True, expressions that differ in names of binders have different keys
+        :return: key of result of op applied to exp
+        """
+        canonical = canonical_expression(exp)
+        parts = [op, version, canonical.key]
+        if names:
+            parts.append(__binders__(exp))
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        :return: stored value or None
+        """
+        row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.clock += 1
+        self.connection.execute("UPDATE results SET used = ? WHERE key = ?", (self.clock, key))
+        self.__written__()
+        return __decode__(row[0])
+
+    def put(self, key: str, value: str):
+        data = __encode__(value)
+        old = self.connection.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+        if old is not None:
+            self.size -= old[0]
+        self.clock += 1
+        self.connection.execute("INSERT OR REPLACE INTO results (key, value, size, used) VALUES (?, ?, ?, ?)",
+                                (key, data, len(data), self.clock))
+        self.size += len(data)
+        self.writes += 1
+        self.__evict__()
+        self.__written__()
+
+    def __evict__(self):
+        while self.size > self.max_bytes:
+            rows = self.connection.execute("SELECT key, size FROM results ORDER BY used LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.size <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.size -= size
+                self.evictions += 1
+
+    def __written__(self):
+        self.uncommitted += 1
+        if self.uncommitted >= __COMMIT_EVERY__:
+            self.flush()
+
+    def flush(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "bytes": self.size
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def test():
+    import tempfile
+    from tools.tparsing import BaseParser
+
+    parser_ = BaseParser()
+    key = ResultCache.key
+
+    print("Testing keys of alpha-equivalent expressions")
+    assert key("reduce", 1, parser_.parse("\\x.\\y.x y")) == key("reduce", 1, parser_.parse("\\a.\\b.a b"))
+    assert key("reduce", 1, parser_.parse("\\x.x y")) != key("reduce", 1, parser_.parse("\\x.x z"))
+    assert key("reduce", 1, parser_.parse("\\x.x")) != key("reduce", 2, parser_.parse("\\x.x"))
+    assert key("reduce", 1, parser_.parse("\\x.x")) != key("infer_w", 1, parser_.parse("\\x.x"))
+    assert key("infer_w", 1, parser_.parse("let f = \\x.x in f"), True) != \
+        key("infer_w", 1, parser_.parse("let g = \\x.x in g"), True)
+    assert key("infer_w", 1, parser_.parse("let f = \\x.x in f"), True) == \
+        key("infer_w", 1, parser_.parse("let f = \\x.x in (f)"), True)
+    print("Passed\n")
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "cache.sqlite")
+
+    print("Testing persistence and metrics")
+    with ResultCache(path) as cache:
+        assert cache.get("a") is None
+        cache.put("a", "short")
+        cache.put("b", "long " * 100)
+        assert cache.get("a") == "short"
+        assert cache.get("b") == "long " * 100
+        assert cache.size < 100
+        assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+    with ResultCache(path) as cache:
+        assert cache.get("b") == "long " * 100
+        assert len(cache) == 2
+    print("Passed\n")
+
+    print("Testing eviction of least recently used entries")
+    with ResultCache(":memory:", max_bytes=100) as cache:
+        for name in "abcd":
+            cache.put(name, name * 20)
+        assert cache.get("a") == "a" * 20
+        cache.put("e", "e" * 20)
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("e") is not None
+        assert cache.size <= 100 and cache.evictions == 1
+    print("Passed\n")
+
+    os.remove(path)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    test()
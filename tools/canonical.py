@@ -0,0 +1,285 @@
+"""
+    Canonical form of types: variables are renamed t0, t1, t2 ... in order of first occurrence.
+    Two types are equal modulo renaming of variables iff their canonical forms are equal.
+    Also alpha-invariant keys of expressions: bound variables are replaced by de Bruijn indices.
+"""
+from tools.tstructure import *
+
+__VISIT__ = 0
+__BUILD__ = 1
+__UNBIND__ = 2
+__DEF__ = 3
+
+
+class CanonicalType:
+    """
+        Canonical form of a type together with a flat key of it.
+        Equality and hash use only the key, so instances can be used as dictionary keys and compared in O(n).
+    """
+
+    def __init__(self, type: TType, key: tuple):
+        self.type = type
+        self.key = key
+        self.hash = hash(key)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return isinstance(other, CanonicalType) and self.hash == other.hash and self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return str(self.type)
+
+
+def canonical_type(t: TType) -> CanonicalType:
+    """
+    Rename all variables of given type (TVar, TImpl, TUni, TSigma and constraints inside TSigma)
+    in order of first occurrence. Variables bound by quantifiers get the next name at the binder.
+
+    :param t: given type
+    :return: canonical form
+    """
+    key = []
+    results = []
+    names = {}
+    counter = 0
+    stack = [(__VISIT__, t, None)]
+
+    def bind(var: TVar) -> int:
+        nonlocal counter
+        number = counter
+        counter += 1
+        stack.append((__UNBIND__, var.name, names.get(var.name)))
+        names[var.name] = number
+        return number
+
+    while stack:
+        task, cur, extra = stack.pop()
+        if task == __UNBIND__:
+            if extra is None:
+                del names[cur]
+            else:
+                names[cur] = extra
+        elif task == __BUILD__:
+            if isinstance(cur, TImpl):
+                right = results.pop()
+                results.append(TImpl(results.pop(), right))
+            elif isinstance(cur, TUni):
+                results.append(TUni(TVar("t" + str(extra)), results.pop()))
+            elif isinstance(cur, TSigma):
+                type = results.pop()
+                constraint = results.pop()
+                sigma = TSigma([TVar("t" + str(number)) for number in extra], constraint, type)
+                sigma.subst = cur.subst
+                results.append(sigma)
+            elif isinstance(cur, CExistence):
+                results.append(CExistence(TVar("t" + str(extra)), results.pop()))
+            elif isinstance(cur, CDef):
+                constraint = results.pop()
+                results.append(CDef(TVar("t" + str(extra)), results.pop(), constraint))
+            else:
+                right = results.pop()
+                results.append(cur.__class__(results.pop(), right))
+        elif task == __DEF__:
+            number = bind(cur.var)
+            stack[extra] = (__BUILD__, cur, number)
+            key.append(number)
+            stack.append((__VISIT__, cur.constraint, None))
+        elif cur is None:
+            key.append("none")
+            results.append(None)
+        elif isinstance(cur, TVar):
+            number = names.get(cur.name)
+            if number is None:
+                number = names[cur.name] = counter
+                counter += 1
+            key.append(number)
+            results.append(TVar("t" + str(number)))
+        elif isinstance(cur, (TImpl, CRelationL, CRelationEq, CAnd)):
+            key.append(cur.__class__.__name__)
+            stack.append((__BUILD__, cur, None))
+            stack.append((__VISIT__, cur.right, None))
+            stack.append((__VISIT__, cur.left, None))
+        elif isinstance(cur, TUni):
+            stack.append((__BUILD__, cur, None))
+            number = bind(cur.var)
+            stack[-2] = (__BUILD__, cur, number)
+            key.append("TUni")
+            key.append(number)
+            stack.append((__VISIT__, cur.expression, None))
+        elif isinstance(cur, CExistence):
+            stack.append((__BUILD__, cur, None))
+            number = bind(cur.var)
+            stack[-2] = (__BUILD__, cur, number)
+            key.append("CExistence")
+            key.append(number)
+            stack.append((__VISIT__, cur.constraint, None))
+        elif isinstance(cur, TSigma):
+            stack.append((__BUILD__, cur, None))
+            numbers = [bind(var) for var in cur.vars]
+            stack[-1 - len(numbers)] = (__BUILD__, cur, numbers)
+            key.append("TSigma")
+            key.append(len(numbers))
+            key.extend(numbers)
+            stack.append((__VISIT__, cur.type, None))
+            stack.append((__VISIT__, cur.constraint, None))
+        elif isinstance(cur, CDef):
+            # x is bound in the constraint, but not in its own scheme
+            key.append("CDef")
+            stack.append((__BUILD__, cur, None))
+            build = len(stack) - 1
+            stack.append((__DEF__, cur, build))
+            stack.append((__VISIT__, cur.sigma, None))
+        else:
+            raise Exception("canonical_type exception: No such type {0}".format(cur))
+
+    return CanonicalType(results[0], tuple(key))
+
+
+
+class CanonicalExpression:
+    """
+        Alpha-invariant key of an expression. Bound variables are de Bruijn indices (int), free ones are names,
+        so alpha-equivalent expressions have equal keys. free is the set of names of free variables.
+    """
+
+    def __init__(self, key: tuple, free: set):
+        self.key = key
+        self.free = free
+        self.hash = hash(key)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return isinstance(other, CanonicalExpression) and self.hash == other.hash and self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def canonical_expression(exp: Expression) -> CanonicalExpression:
+    """
+    Produce alpha-invariant key of given expression (Var, Applique, Abstraction and Let).
+    In let x = e1 in e2 variable x is bound only in e2.
+
+    :param exp: given expression
+    :return: canonical key
+    """
+    key = []
+    free = set()
+    scope = {}
+    depth = 0
+    stack = [(__VISIT__, exp)]
+    while stack:
+        task, cur = stack.pop()
+        if task == __UNBIND__:
+            depth -= 1
+            scope[cur].pop()
+        elif task == __DEF__:
+            # Body of abstraction or of let: the variable is bound from here
+            depth += 1
+            scope.setdefault(cur.variable.name, []).append(depth)
+            stack.append((__UNBIND__, cur.variable.name))
+            stack.append((__VISIT__, cur.expression))
+        elif isinstance(cur, Var):
+            bound = scope.get(cur.name)
+            if bound:
+                key.append(depth - bound[-1])
+            else:
+                free.add(cur.name)
+                key.append(cur.name)
+        elif isinstance(cur, Applique):
+            key.append("@")
+            stack.append((__VISIT__, cur.right))
+            stack.append((__VISIT__, cur.left))
+        elif isinstance(cur, Abstraction):
+            key.append("\\")
+            stack.append((__DEF__, cur))
+        elif isinstance(cur, Let):
+            key.append("=")
+            stack.append((__DEF__, cur))
+            stack.append((__VISIT__, cur.subst))
+        else:
+            raise Exception("Unknown type of" + str(cur))
+
+    return CanonicalExpression(tuple(key), free)
+
+
+def types_equivalent(t1: TType, t2: TType) -> bool:
+    """
+    Check if two types are equal modulo renaming of variables.
+
+    :param t1: first type
+    :param t2: second type
+    :return: True if types are equivalent
+    """
+    if t1 is None or t2 is None:
+        return t1 is t2
+    return canonical_type(t1) == canonical_type(t2)
+
+
+def test():
+    def test_equivalent(t1: TType, t2: TType, result: bool):
+        print("Testing types '{0}' and '{1}': equivalent must be {2}".format(t1, t2, result))
+        assert types_equivalent(t1, t2) == result
+        assert (hash(canonical_type(t1)) == hash(canonical_type(t2))) or not result
+        print("Passed\n")
+
+    def I(t1: TType, t2: TType) -> TImpl:
+        return TImpl(t1, t2)
+
+    a = TVar("a")
+    b = TVar("b")
+    c = TVar("c")
+
+    test_equivalent(I(a, I(b, a)), I(b, I(c, b)), True)
+    test_equivalent(I(a, I(b, a)), I(b, I(b, b)), False)
+    test_equivalent(TUni(a, I(a, b)), TUni(c, I(c, a)), True)
+    test_equivalent(TUni(a, I(a, b)), TUni(c, I(b, c)), False)
+    test_equivalent(I(a, TUni(a, a)), I(b, TUni(c, c)), True)
+    test_equivalent(I(TUni(a, a), a), I(TUni(c, c), b), True)
+    test_equivalent(TSigma([a], None, I(a, b)), TSigma([c], None, I(c, a)), True)
+    test_equivalent(TSigma([a], CRelationEq(a, b), a), TSigma([c], CRelationEq(c, a), c), True)
+    test_equivalent(TSigma([a], CRelationEq(a, b), a), TSigma([c], CRelationEq(a, c), c), False)
+
+    print("Testing canonical form of '{0}'".format(TUni(b, I(a, I(b, a)))))
+    temp = canonical_type(TUni(b, I(a, I(b, a))))
+    assert temp.type == TUni(TVar("t0"), I(TVar("t1"), I(TVar("t0"), TVar("t1"))))
+    print("Passed\n")
+
+    print("Testing deduplication of types")
+    assert len({canonical_type(I(a, b)), canonical_type(I(b, c)), canonical_type(I(a, a))}) == 2
+    print("Passed\n")
+
+    def test_alpha(exp1: Expression, exp2: Expression, result: bool):
+        print("Testing expressions '{0}' and '{1}': alpha-equivalent must be {2}".format(exp1, exp2, result))
+        assert (canonical_expression(exp1) == canonical_expression(exp2)) == result
+        print("Passed\n")
+
+    x = Var("x")
+    y = Var("y")
+    z = Var("z")
+    test_alpha(Abstraction(x, Abstraction(y, x)), Abstraction(y, Abstraction(x, y)), True)
+    test_alpha(Abstraction(x, Abstraction(y, x)), Abstraction(x, Abstraction(y, y)), False)
+    test_alpha(Abstraction(x, Applique(x, z)), Abstraction(y, Applique(y, z)), True)
+    test_alpha(Abstraction(x, Applique(x, z)), Abstraction(y, Applique(y, x)), False)
+    test_alpha(Let(x, x, x), Let(y, x, y), True)
+    test_alpha(Let(x, x, x), Let(y, y, y), False)
+    assert canonical_expression(Let(x, Applique(y, x), Abstraction(z, Applique(x, z)))).free == {"x", "y"}
+
+    depth = 100000
+    print("Testing type of depth {0}".format(depth))
+    deep = a
+    for i in range(depth):
+        deep = I(deep, b)
+    assert canonical_type(deep).key[-1] == 1
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,449 @@
+"""
+    Compilation of lambda terms to combinators and graph reduction of combinator terms.
+
+    compile_expression - bracket abstraction of an expression (let is compiled as an applied abstraction)
+                         with the optimisations of Turner: K, I, eta, B, C, S', B*, C'; the result is built
+                         of Applique, Combinator and Var (free variables) only,
+    GraphReducer       - reduction of a combinator term as a graph: a redex is overwritten in place by its result
+                         and arguments are shared, not copied, so there are neither bound variables nor substitution,
+    decompile          - Church numeral or boolean denoted by a combinator term as a lambda term in normal form,
+                         read back by applying the term to two fresh variables,
+    evaluate           - normal form of a closed arithmetic expression computed by the two above.
+"""
+from tools.terrors import ReductionLimitError
+from tools.traversal import fold, CHILDREN
+from tools.tstructure import *
+
+
+class Combinator(Expression):
+    """
+        Constant of combinatory logic, one of ARITY
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __str__(self):
+        return self.name
+
+
+S = Combinator("S")
+K = Combinator("K")
+I = Combinator("I")
+B = Combinator("B")
+C = Combinator("C")
+S_PRIME = Combinator("S'")
+B_STAR = Combinator("B*")
+C_PRIME = Combinator("C'")
+
+# number of arguments of a redex of every combinator
+ARITY = {
+    "S": 3,
+    "K": 2,
+    "I": 1,
+    "B": 3,
+    "C": 3,
+    "S'": 4,
+    "B*": 4,
+    "C'": 4,
+}
+
+COMBINATORS = dict((combinator.name, combinator) for combinator in (S, K, I, B, C, S_PRIME, B_STAR, C_PRIME))
+
+__CHILDREN__ = dict(CHILDREN)
+__CHILDREN__[Combinator] = lambda node: ()
+
+
+def __apply__(head: Expression, *args) -> Expression:
+    for arg in args:
+        head = Applique(head, arg)
+    return head
+
+
+def __is_b__(term: Expression) -> bool:
+    """
+    :return: True if term is B p q
+    """
+    return term.__class__ is Applique and term.left.__class__ is Applique and term.left.left is B
+
+
+def __abstract__(name: str, term: Expression) -> Expression:
+    """
+    Bracket abstraction of variable name from combinator term.
+    Subterms without the variable are kept as they are and get K from their parent, so S (K p) (K q) = K (p q).
+
+    :return: term without the variable such that it applied to v reduces to term with v in place of the variable
+    """
+    def var(node: Var, values) -> (bool, Expression):
+        if node.name == name:
+            return True, I
+        return False, node
+
+    def applique(node: Applique, values) -> (bool, Expression):
+        (left_free, left), (right_free, right) = values
+        if not left_free and not right_free:
+            return False, node
+        if not left_free:
+            # S (K p) I = p, S (K p) (B q r) = B* p q r, S (K p) q = B p q
+            if right is I:
+                return True, left
+            if __is_b__(right):
+                return True, __apply__(B_STAR, left, right.left.right, right.right)
+            return True, __apply__(B, left, right)
+        if not right_free:
+            # S (B p q) (K r) = C' p q r, S p (K q) = C p q
+            if __is_b__(left):
+                return True, __apply__(C_PRIME, left.left.right, left.right, right)
+            return True, __apply__(C, left, right)
+        # S (B p q) r = S' p q r
+        if __is_b__(left):
+            return True, __apply__(S_PRIME, left.left.right, left.right, right)
+        return True, __apply__(S, left, right)
+
+    table = {
+        Var: var,
+        Combinator: lambda node, values: (False, node),
+        Applique: applique,
+    }
+    free, result = fold(term, table, __CHILDREN__)
+    return result if free else Applique(K, term)
+
+
+__COMPILE__ = {
+    Var: lambda exp, values: exp,
+    Applique: lambda exp, values: Applique(values[0], values[1]),
+    Abstraction: lambda exp, values: __abstract__(exp.variable.name, values[0]),
+    # let x = a in b is (\x.b) a
+    Let: lambda exp, values: Applique(__abstract__(exp.variable.name, values[1]), values[0]),
+}
+
+
+def compile_expression(exp: Expression) -> Expression:
+    """
+    :param exp: expression, free variables stay variables of the result
+    :return: combinator term equal to exp
+    """
+    return fold(exp, __COMPILE__)
+
+
+__APP__ = 0
+__COMB__ = 1
+__VAR__ = 2
+__IND__ = 3
+
+
+class __Node__:
+    """
+        Cell of the graph: application of left to right, combinator or free variable with name left,
+        or indirection to left (a redex of I or K becomes an indirection to its existing result).
+    """
+    __slots__ = ("kind", "left", "right")
+
+    def __init__(self, kind: int, left, right=None):
+        self.kind = kind
+        self.left = left
+        self.right = right
+
+
+def __follow__(node: __Node__) -> __Node__:
+    while node.kind is __IND__:
+        node = node.left
+    return node
+
+
+def __app__(left: __Node__, right: __Node__) -> __Node__:
+    return __Node__(__APP__, left, right)
+
+
+def __become_app__(node: __Node__, left: __Node__, right: __Node__):
+    node.kind = __APP__
+    node.left = left
+    node.right = right
+
+
+def __become_ind__(node: __Node__, target: __Node__):
+    node.kind = __IND__
+    node.left = target
+    node.right = None
+
+
+# combinator -> function(redex, arguments) overwriting the redex by its result
+__REWRITE__ = {
+    "I": lambda redex, a: __become_ind__(redex, a[0]),
+    "K": lambda redex, a: __become_ind__(redex, a[0]),
+    "S": lambda redex, a: __become_app__(redex, __app__(a[0], a[2]), __app__(a[1], a[2])),
+    "B": lambda redex, a: __become_app__(redex, a[0], __app__(a[1], a[2])),
+    "C": lambda redex, a: __become_app__(redex, __app__(a[0], a[2]), a[1]),
+    "S'": lambda redex, a: __become_app__(redex, __app__(a[0], __app__(a[1], a[3])), __app__(a[2], a[3])),
+    "B*": lambda redex, a: __become_app__(redex, a[0], __app__(a[1], __app__(a[2], a[3]))),
+    "C'": lambda redex, a: __become_app__(redex, __app__(a[0], __app__(a[1], a[3])), a[2]),
+}
+
+
+class GraphReducer:
+    """
+        Normal order reduction of combinator terms as graphs.
+    """
+
+    def __init__(self, max_steps: int = None):
+        """
+        :param max_steps: maximal number of reduction steps, None means no limit
+        """
+        self.max_steps = max_steps
+        self.steps = 0
+        self.constants = dict((name, __Node__(__COMB__, name)) for name in ARITY)
+
+    def build(self, term: Expression) -> __Node__:
+        """
+        :param term: combinator term (see compile_expression)
+        :return: root of the graph of term
+        """
+        table = {
+            Var: lambda exp, values: __Node__(__VAR__, exp.name),
+            Combinator: lambda exp, values: self.constants[exp.name],
+            Applique: lambda exp, values: __app__(values[0], values[1]),
+        }
+        return fold(term, table, __CHILDREN__)
+
+    def __whnf__(self, node: __Node__) -> __Node__:
+        """
+        Reduce the spine of node until its head is a variable or a combinator without enough arguments.
+
+        :return: node of the spine, node itself or its result
+        """
+        # applications of the spine, the outermost first
+        spine = []
+        while True:
+            node = __follow__(node)
+            if node.kind is __APP__:
+                spine.append(node)
+                node = node.left
+                continue
+            if node.kind is __COMB__:
+                arity = ARITY[node.left]
+                if len(spine) >= arity:
+                    self.steps += 1
+                    if self.max_steps is not None and self.steps > self.max_steps:
+                        raise ReductionLimitError(self.max_steps)
+                    args = [spine[-1 - i].right for i in range(arity)]
+                    redex = spine[-arity]
+                    del spine[-arity:]
+                    __REWRITE__[node.left](redex, args)
+                    node = redex
+                    continue
+            return spine[0] if spine else node
+
+    def normalize(self, root: __Node__) -> __Node__:
+        """
+        Reduce root to normal form in place.
+
+        :return: node of the normal form (root or its result)
+        """
+        root = self.__whnf__(root)
+        pending = [root]
+        while pending:
+            node = self.__whnf__(pending.pop())
+            args = []
+            while node.kind is __APP__:
+                args.append(node.right)
+                node = __follow__(node.left)
+            # the leftmost argument is reduced first
+            pending.extend(args)
+        return __follow__(root)
+
+    def read(self, root: __Node__) -> Expression:
+        """
+        :return: combinator term of the graph, shared nodes become shared subterms
+        """
+        terms = {}
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            if id(node) in terms:
+                stack.pop()
+                continue
+            if node.kind is __APP__:
+                left = terms.get(id(node.left))
+                right = terms.get(id(node.right))
+                if left is None:
+                    stack.append(node.left)
+                elif right is None:
+                    stack.append(node.right)
+                else:
+                    terms[id(node)] = Applique(left, right)
+                    stack.pop()
+            elif node.kind is __IND__:
+                target = terms.get(id(node.left))
+                if target is None:
+                    stack.append(node.left)
+                else:
+                    terms[id(node)] = target
+                    stack.pop()
+            else:
+                terms[id(node)] = COMBINATORS[node.left] if node.kind is __COMB__ else Var(node.left)
+                stack.pop()
+        return terms[id(root)]
+
+
+def normal_form(term: Expression, max_steps: int = None) -> Expression:
+    """
+    :param term: combinator term
+    :return: normal form of term
+    """
+    reducer = GraphReducer(max_steps)
+    return reducer.read(reducer.normalize(reducer.build(term)))
+
+
+def __numeral__(n: int) -> Expression:
+    """
+    :return: Church numeral n named as by tools.utils.reduction
+    """
+    body = Var("t2")
+    for i in range(n):
+        body = Applique(Var("t1"), body)
+    return Abstraction(Var("t1"), Abstraction(Var("t2"), body))
+
+
+def decompile(term: Expression, max_steps: int = None) -> Expression:
+    """
+    Numerals and booleans are read back by their behaviour on two arguments, so the result is the same
+    for eta-equivalent terms; numeral 0 and false are the same term.
+
+    :param term: combinator term of a Church numeral or boolean
+    :param max_steps: maximal number of reduction steps, None means no limit
+    :return: the numeral or boolean as lambda term in normal form
+    :raise ValueError: if term is not a numeral or boolean
+    """
+    reducer = GraphReducer(max_steps)
+    f = __Node__(__VAR__, "f")
+    x = __Node__(__VAR__, "x")
+    node = reducer.normalize(__app__(__app__(reducer.build(term), f), x))
+    count = 0
+    while node.kind is __APP__ and __follow__(node.left) is f:
+        count += 1
+        node = __follow__(node.right)
+    if node is x:
+        return __numeral__(count)
+    if node is f and count == 0:
+        return Abstraction(Var("t1"), Abstraction(Var("t2"), Var("t1")))
+    raise ValueError("Normal form is not a numeral or boolean")
+
+
+def evaluate(exp: Expression, max_steps: int = None) -> Expression:
+    """
+    Normal form of an expression that reduces to a Church numeral or boolean by graph reduction of its combinators.
+
+    :param max_steps: maximal number of reduction steps, None means no limit
+    :return: normal form as tools.utils.reduction prints it
+    :raise ValueError: if the normal form is not a numeral or boolean
+    """
+    return decompile(compile_expression(exp), max_steps)
+
+
+def test():
+    from tools.tparsing import BufferParser
+    from tools.types import numbers, type_true, type_false, type_not, type_is_zero, type_is_even, type_add, \
+        type_mul, type_pow, type_S, type_K, type_I
+    from tools.utils import reduction
+
+    parser_ = BufferParser()
+
+    def parse(raw: str) -> Expression:
+        return parser_.parse(raw.encode("ascii"))
+
+    def test_compile(raw: str, result: str):
+        print("Testing compilation of '{0}': result must be '{1}'".format(raw, result))
+        assert str(compile_expression(parse(raw))) == result
+        print("Passed\n")
+
+    test_compile(type_S, "S")
+    test_compile(type_K, "K")
+    test_compile(type_I, "I")
+    test_compile("\\x.\\y.y", "(K I)")
+    test_compile("\\x.\\y.y x", "(C I)")
+    test_compile("\\x.a (b x)", "((B a) b)")
+    test_compile("\\x.a x b", "((C a) b)")
+    test_compile("\\f.\\x.f (f x)", "((S B) I)")
+    test_compile("let f = \\x.x in f f", "(((S I) I) I)")
+
+    print("Testing graph reduction of combinators")
+    a, b, c, d = Var("a"), Var("b"), Var("c"), Var("d")
+    for term, result in ((__apply__(S, a, b, c), "((a c) (b c))"), (__apply__(K, a, b), "a"), (__apply__(I, a), "a"),
+                         (__apply__(B, a, b, c), "(a (b c))"), (__apply__(C, a, b, c), "((a c) b)"),
+                         (__apply__(S_PRIME, a, b, c, d), "((a (b d)) (c d))"),
+                         (__apply__(B_STAR, a, b, c, d), "(a (b (c d)))"),
+                         (__apply__(C_PRIME, a, b, c, d), "((a (b d)) c)"),
+                         (__apply__(S, K), "(S K)"), (__apply__(S, K, K, a), "a"),
+                         (__apply__(a, __apply__(K, I, b), c), "((a I) c)")):
+        assert str(normal_form(term)) == result
+    print("Passed\n")
+
+    def test_evaluate(raw: str):
+        exp = parse(raw)
+        print("Testing evaluation of '{0}'".format(raw if len(raw) < 60 else raw[:57] + "..."))
+        assert str(evaluate(exp)) == str(reduction(exp))
+        print("Passed\n")
+
+    test_evaluate("{0} {1} {2}".format(type_add, numbers[3], numbers[4]))
+    test_evaluate("{0} {1} {2}".format(type_mul, numbers[3], numbers[4]))
+    test_evaluate("{0} {1} {2}".format(type_pow, numbers[2], numbers[3]))
+    test_evaluate("{0} {1}".format(type_is_zero, numbers[0]))
+    test_evaluate("{0} {1}".format(type_is_zero, numbers[2]))
+    test_evaluate("{0} {1}".format(type_is_even, numbers[5]))
+    test_evaluate("{0} {1}".format(type_not, type_false))
+
+    print("Testing evaluation of let")
+    assert str(evaluate(parse("let two = {0} in {1} two two".format(numbers[2], type_mul)))) == \
+        str(reduction(parse("(\\two.{1} two two) {0}".format(numbers[2], type_mul))))
+    print("Passed\n")
+
+    print("Testing non-numerals and the step limit")
+    for raw in ("\\x.\\y.x y y", "\\x.\\y.\\z.z", "a"):
+        try:
+            evaluate(parse(raw))
+            assert False
+        except ValueError:
+            pass
+    try:
+        evaluate(parse("(\\x.x x) (\\x.x x)"), 1000)
+        assert False
+    except ReductionLimitError:
+        pass
+    print("Passed\n")
+
+    def value(numeral: Expression) -> int:
+        count = 0
+        body = numeral.expression.expression
+        while isinstance(body, Applique):
+            count += 1
+            body = body.right
+        return count
+
+    def steps(exp: Expression) -> int:
+        reducer = GraphReducer()
+        reducer.normalize(reducer.build(compile_expression(Applique(Applique(exp, Var("f")), Var("x")))))
+        return reducer.steps
+
+    print("Testing sharing of arguments")
+    thirty_six = "({0} {1} {1})".format(type_mul, numbers[6])
+    square = parse("(\\n.{0} n n) {1}".format(type_mul, thirty_six))
+    # the argument n of square is reduced once, not for every use
+    assert steps(square) < steps(parse("{0} {1} {1}".format(type_mul, thirty_six)))
+    assert value(evaluate(square)) == 36 * 36
+    print("Passed\n")
+
+    depth = 20000
+    print("Testing numeral {0}".format(depth))
+    body = Var("x")
+    for i in range(depth):
+        body = Applique(Var("f"), body)
+    numeral = Abstraction(Var("f"), Abstraction(Var("x"), body))
+    assert value(evaluate(Applique(Applique(parse(type_add), numeral), parse(numbers[1])))) == depth + 1
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
@@ -1,13 +1,35 @@
 from tools.tstructure import *
 from tools.equations import *
+from tools.persistent import PersistentMap
+from tools.schemes import TypeScheme
+from tools.traversal import walk, fold, traverse, run
+from tools.unification import TypeStore
 import time
 
 
-def copy(defined: list) -> list:
-    result = []
-    for type in defined:
-        result.append(type)
-    return result
+def __type_vars_union__(t: TImpl, values: list) -> set:
+    return values[0].union(values[1])
+
+
+def __type_vars_uni__(t: TUni, values: list) -> set:
+    s1 = values[0]
+    s1.discard(t.var)
+    return s1
+
+
+def __type_vars_sigma__(t: TSigma, values: list) -> set:
+    s1 = values[0]
+    for var in t.vars:
+        s1.discard(var)
+    return s1
+
+
+__GET_TYPE_VARS__ = {
+    TVar: lambda t, values: {t},
+    TImpl: __type_vars_union__,
+    TUni: __type_vars_uni__,
+    TSigma: __type_vars_sigma__,
+}
 
 
 class ConstraintResolver:
@@ -16,38 +38,47 @@ class ConstraintResolver:
         self.last_number = 0
         self.variable_map = {}
         self.inst = []
+        self.schemes = {}
 
     def generate_constraint(self, exp: Expression, t: TType) -> Constraint:
         """
         Generate constraint to the given expression with the given type
         """
-        if isinstance(exp, Var):
-            return CRelationL(TVar(exp.name), t)
-
-        elif isinstance(exp, Abstraction):
+        def enter_abstraction(exp: Abstraction, t: TType) -> (tuple, tuple):
             a1 = self.get_new_type()
             a2 = self.get_new_type()
-            left_def = CDef(TVar(exp.variable.name), TSigma([], None, a1), self.generate_constraint(exp.expression, a2))
+            return ((exp.expression, a2),), (a1, a2, t)
+
+        def leave_abstraction(exp: Abstraction, data: tuple, values: list) -> Constraint:
+            a1, a2, t = data
+            left_def = CDef(TVar(exp.variable.name), TSigma([], None, a1), values[0])
             right = CRelationEq(TImpl(a1, a2), t)
             return CExistence(a1, CExistence(a2, CAnd(left_def, right)))
 
-        elif isinstance(exp, Applique):
+        def enter_applique(exp: Applique, t: TType) -> (tuple, TVar):
             a = self.get_new_type()
-            left = self.generate_constraint(exp.left, TImpl(a, t))
-            right = self.generate_constraint(exp.right, a)
-            return CExistence(a, CAnd(left, right))
+            return ((exp.left, TImpl(a, t)), (exp.right, a)), a
 
-        elif isinstance(exp, Let):
+        def enter_let(exp: Let, t: TType) -> (tuple, TVar):
             a = self.get_new_type()
+            return ((exp.subst, a), (exp.expression, t)), a
+
+        def leave_let(exp: Let, a: TVar, values: list) -> Constraint:
             x = TVar(exp.variable.name)
-            sigma = TSigma([a, ], self.generate_constraint(exp.subst, a), a)
+            sigma = TSigma([a, ], values[0], a)
             right_and = CAnd(
                 CRelationL(x, a),
-                self.generate_constraint(exp.expression, t)
+                values[1]
             )
             return CDef(x, sigma, right_and)
-        else:
-            assert False
+
+        table = {
+            Var: lambda exp, t: CRelationL(TVar(exp.name), t),
+            Abstraction: (enter_abstraction, leave_abstraction),
+            Applique: (enter_applique, lambda exp, a, values: CExistence(a, CAnd(values[0], values[1]))),
+            Let: (enter_let, leave_let),
+        }
+        return traverse(exp, table, t)
 
     def get_new_type(self) -> TVar:
         """
@@ -62,56 +93,30 @@ class ConstraintResolver:
         Find (x < t) and remember them in self.variable_map
         :param const: constraint
         """
-        if isinstance(const, CRelationL) and isinstance(const.left, TVar):
-            self.variable_map[const.left] = const.right
-        elif isinstance(const, CAnd):
-            self.__remember_types__(const.left)
-            self.__remember_types__(const.right)
-        elif isinstance(const, CExistence):
-            self.__remember_types__(const.constraint)
-        elif isinstance(const, CDef):
-            self.__remember_types__(const.constraint)
+        for cur in walk(const):
+            if cur.__class__ is CRelationL and isinstance(cur.left, TVar):
+                self.variable_map[cur.left] = cur.right
 
     def __rename__(self, t: TType):
-        if isinstance(t, TVar):
+        def rename_var(t: TVar, values: list) -> TType:
             if t in self.variable_map:
                 return self.variable_map[t]
             else:
                 return t
-        elif isinstance(t, TImpl):
-            return TImpl(
-                self.__rename__(t.left),
-                self.__rename__(t.right)
-            )
-        elif isinstance(t, TUni):
-            return TUni(
-                t.var,
-                self.__rename__(t.expression)
-            )
-        else:
-            assert False
+
+        table = {
+            TVar: rename_var,
+            TImpl: lambda t, values: TImpl(values[0], values[1]),
+            TUni: lambda t, values: TUni(t.var, values[0]),
+        }
+        return fold(t, table)
 
     @staticmethod
     def __get_vars__(t: TType) -> set:
-        if isinstance(t, TVar):
-            return {t}
-        elif isinstance(t, TImpl):
-            s1 = ConstraintResolver.__get_vars__(t.left)
-            s2 = ConstraintResolver.__get_vars__(t.right)
-            return s1.union(s2)
-        elif isinstance(t, TUni):
-            s1 = ConstraintResolver.__get_vars__(t.expression)
-            s1.discard(t.var)
-            return s1
-        elif isinstance(t, TSigma):
-            s1 = ConstraintResolver.__get_vars__(t.type)
-            for var in t.vars:
-                s1.discard(var)
-        else:
-            assert False
+        return fold(t, __GET_TYPE_VARS__)
 
     @staticmethod
-    def __generalization__(t: TType, defined: list) -> TType:
+    def __generalization__(t: TType, defined: PersistentMap) -> TType:
         """
         Generate CSigma with variables that free in t but not in defined
         """
@@ -123,112 +128,107 @@ class ConstraintResolver:
 
         return TSigma(list(result), None, t)
 
-    def __substitution__(self, x: TVar, subst: TType, c: Constraint) -> Constraint:
-        """
-        Substitute all occurrences of x in c by subst
-        """
-        if isinstance(c, CRelationL):
-            if c.left == x:
-                return CRelationL(subst, c.right)
-            else:
-                return c
-        elif isinstance(c, CRelationEq):
-            return c
-        elif isinstance(c, CAnd):
-            left = self.__substitution__(x, subst, c.left)
-            right = self.__substitution__(x, subst, c.right)
-            return CAnd(left, right)
-        elif isinstance(c, CExistence):
-            return CExistence(c.var, self.__substitution__(x, subst, c.constraint))
-        elif isinstance(c, CDef):
-            return CDef(c.var, c.sigma, self.__substitution__(x, subst, c.constraint))
-        else:
-            assert False
-
     def __inst__(self, c: TSigma) -> TType:
         """
         Instantiate CSigma (@a.exp -> exp[a := b] where b is a new type)
+        Every sigma is compiled into TypeScheme once, on its first instantiation.
         """
-        exp = c.type
-        for var in c.vars:
-            exp = subst(exp, var, self.get_new_type())
+        compiled = self.schemes.get(id(c))
+        if compiled is None or compiled[0] is not c:
+            compiled = self.schemes[id(c)] = (c, TypeScheme(c.vars, c.type))
+        exp = compiled[1].instantiate(self.get_new_type)
 
         if c.subst is not None:
             self.inst.append(Equation(c.subst, exp))
 
         return exp
 
-    def __resolve__(self, const: Constraint, defined: list) -> dict:
-        """
-        Resolve given constraint.
-        """
-        if isinstance(const, CExistence):
-            # Just skip existence quantifier
-            return self.__resolve__(const.constraint, defined)
-
-        elif isinstance(const, CRelationEq):
-            # We latter will use it for unification
-            return {const.right: const.left}
-
-        elif isinstance(const, CRelationL):
-            if isinstance(const.left, TSigma) and (const.left.constraint is None):
-                return {const.right: self.__inst__(const.left)}
-            elif isinstance(const.left, TVar):
+    def __resolve_existence__(self, const: CExistence, defined: PersistentMap, env: PersistentMap):
+        # Just skip existence quantifier
+        return (yield const.constraint, defined, env)
+
+    def __resolve_equality__(self, const: CRelationEq, defined: PersistentMap, env: PersistentMap) -> dict:
+        # We latter will use it for unification
+        return {const.right: const.left}
+
+    def __resolve_instance__(self, const: CRelationL, defined: PersistentMap, env: PersistentMap) -> dict:
+        if isinstance(const.left, TSigma) and (const.left.constraint is None):
+            return {const.right: self.__inst__(const.left)}
+        elif isinstance(const.left, TVar):
+            bound = env.get(const.left.name)
+            if bound is None:
                 return {const.left: const.right}
+            elif isinstance(bound, TSigma):
+                return {const.right: self.__inst__(bound)}
+            else:
+                return {bound: const.right}
 
-        elif isinstance(const, CAnd):
-            phi1 = self.__resolve__(const.left, defined)
-            phi2 = self.__resolve__(const.right, defined)
+    def __resolve_and__(self, const: CAnd, defined: PersistentMap, env: PersistentMap):
+        phi1 = yield const.left, defined, env
+        phi2 = yield const.right, defined, env
 
-            eq = []
-            for key in phi1.keys():
-                eq.append(Equation(key, phi1[key]))
+        eq = []
+        for key in phi1.keys():
+            eq.append(Equation(key, phi1[key]))
 
-            for key in phi2.keys():
-                eq.append(Equation(key, phi2[key]))
+        for key in phi2.keys():
+            eq.append(Equation(key, phi2[key]))
 
-            temp = solve_set_of_equations(eq)
-            for equation in temp:
-                if isinstance(equation.left, TVar) and isinstance(equation.right, TVar):
-                    self.inst.append(equation)
-            result = {}
-            # all equation#left is different because system is right form
-            for equation in temp:
-                result[equation.left] = equation.right
+        temp = solve_set_of_equations(eq)
+        for equation in temp:
+            if isinstance(equation.left, TVar) and isinstance(equation.right, TVar):
+                self.inst.append(equation)
+        result = {}
+        # all equation#left is different because system is right form
+        for equation in temp:
+            result[equation.left] = equation.right
 
-            return result
+        return result
 
-        elif isinstance(const, CDef):
-            # Only two variants: def - len(vars) = 0, let - len(vars) = 1
-            assert (len(const.sigma.vars) <= 1)
+    def __resolve_def__(self, const: CDef, defined: PersistentMap, env: PersistentMap):
+        # Only two variants: def - len(vars) = 0, let - len(vars) = 1
+        assert (len(const.sigma.vars) <= 1)
 
-            temp = const.sigma.type
+        temp = const.sigma.type
 
-            if len(const.sigma.vars) == 1:  # def x : @a[C].exp in [] (let)
-                phi = self.__resolve__(const.sigma.constraint, defined)
+        if len(const.sigma.vars) == 1:  # def x : @a[C].exp in [] (let)
+            phi = yield const.sigma.constraint, defined, env
 
-                # phi[alpha]
-                if const.sigma.vars[0] in phi:
-                    temp = phi[const.sigma.vars[0]]
-                else:
-                    assert False
+            # phi[alpha]
+            if const.sigma.vars[0] in phi:
+                temp = phi[const.sigma.vars[0]]
+            else:
+                assert False
 
-                temp = self.__generalization__(temp, defined)  # ,phi)
-                if isinstance(temp, TSigma):
-                    temp.subst = const.var
+            temp = self.__generalization__(temp, defined)  # ,phi)
+            if isinstance(temp, TSigma):
+                temp.subst = const.var
 
-            new_def = copy(defined)
-            new_def.append(temp)
-            new_const = self.__substitution__(const.var, temp, const.constraint)
-            return self.__resolve__(new_const, new_def)
+        # only variables can be compared with the variables of generalized types, sigmas are not kept
+        if isinstance(temp, TVar):
+            defined = defined.set(temp, True)
+        return (yield const.constraint, defined, env.set(const.var.name, temp))
 
-        else:
-            assert False
+    def __resolve__(self, const: Constraint, defined: PersistentMap, env: PersistentMap) -> dict:
+        """
+        Resolve given constraint.
+        Variables of enclosing CDef scopes are looked up in env (name -> type or sigma),
+        defined holds their types that are variables (type -> True).
+        """
+        table = {
+            CExistence: self.__resolve_existence__,
+            CRelationEq: self.__resolve_equality__,
+            CRelationL: self.__resolve_instance__,
+            CAnd: self.__resolve_and__,
+            CDef: self.__resolve_def__,
+        }
+        return run(const, table, defined, env)
 
     def resolve(self, const: Constraint, exp_type : TType) -> TType:
         self.variable_map = {}
+        self.schemes = {}
         self.__remember_types__(const)
-        phi = self.__resolve__(const, [])
+        phi = self.__resolve__(const, PersistentMap(), PersistentMap())
 
         answer = None
         if exp_type in phi:
@@ -243,6 +243,125 @@ class ConstraintResolver:
         return answer
 
 
+class WorklistResolver(ConstraintResolver):
+    """
+        Resolver that keeps all equalities in one TypeStore and unifies each of them once,
+        instead of solving the whole system again at every CAnd.
+        Constraints are processed with an explicit worklist in the order of the tree.
+    """
+
+    __GENERALIZE__ = 0
+
+    def __init__(self):
+        ConstraintResolver.__init__(self)
+        self.store = TypeStore()
+        self.instances = []
+
+    def __generalize__(self, node: int, level: int) -> TSigma:
+        """
+        Generate TSigma with variables of the type of given node that were created deeper than given let level.
+        Types of lambda-bound and free variables of the expression are created (or lowered) at the level of
+        their scope, so their variables are never generalized and the context is not scanned.
+        """
+        store = self.store
+        vars = [TVar(store.names[var]) for var in store.generalize(node, level)]
+        return TSigma(vars, None, store.resolve(node))
+
+    def __instantiate__(self, c: TSigma) -> TType:
+        """
+        Instantiate CSigma with new types, remember instantiation of let-bound variable for self.inst
+        """
+        compiled = self.schemes.get(id(c))
+        if compiled is None or compiled[0] is not c:
+            compiled = self.schemes[id(c)] = (c, TypeScheme(c.vars, c.type))
+        exp = compiled[1].instantiate(self.get_new_type)
+
+        if c.subst is not None:
+            self.instances.append((c.subst, exp))
+
+        return exp
+
+    def resolve(self, const: Constraint, exp_type: TType) -> TType:
+        self.variable_map = {}
+        self.inst = []
+        self.schemes = {}
+        self.instances = []
+        self.store = TypeStore()
+        self.__remember_types__(const)
+
+        store = self.store
+        # (constraint, env, level): env maps names of enclosing CDef scopes to their types or sigmas,
+        # level is the let depth, new type variables are created at the level of their quantifier
+        stack = [(const, PersistentMap(), 0)]
+        while stack:
+            cur, env, level = stack.pop()
+            if cur is WorklistResolver.__GENERALIZE__:
+                # Constraint of let-bound expression is solved, env holds the CDef
+                cdef, env = env
+                temp = self.__generalize__(store.var(cdef.sigma.vars[0].name), level)
+                temp.subst = cdef.var
+                stack.append((cdef.constraint, env.set(cdef.var.name, temp), level))
+
+            elif isinstance(cur, CExistence):
+                store.var(cur.var.name, level)
+                stack.append((cur.constraint, env, level))
+
+            elif isinstance(cur, CAnd):
+                stack.append((cur.right, env, level))
+                stack.append((cur.left, env, level))
+
+            elif isinstance(cur, CRelationEq):
+                store.unify(store.from_type(cur.left, level), store.from_type(cur.right, level))
+
+            elif isinstance(cur, CRelationL):
+                if isinstance(cur.left, TSigma) and (cur.left.constraint is None):
+                    instance = self.__instantiate__(cur.left)
+                    store.unify(store.from_type(instance, level), store.from_type(cur.right, level))
+                else:
+                    assert isinstance(cur.left, TVar)
+                    bound = env.get(cur.left.name)
+                    if bound is None:
+                        # free variable of the expression, its type is the same in every scope
+                        store.unify(store.var(cur.left.name, 0), store.from_type(cur.right, level))
+                    elif isinstance(bound, TSigma):
+                        instance = self.__instantiate__(bound)
+                        store.unify(store.from_type(instance, level), store.from_type(cur.right, level))
+                    else:
+                        store.unify(store.from_type(bound, level), store.from_type(cur.right, level))
+
+            elif isinstance(cur, CDef):
+                # Only two variants: def - len(vars) = 0, let - len(vars) = 1
+                assert (len(cur.sigma.vars) <= 1)
+                if len(cur.sigma.vars) == 1:
+                    store.var(cur.sigma.vars[0].name, level + 1)
+                    stack.append((WorklistResolver.__GENERALIZE__, (cur, env), level))
+                    stack.append((cur.sigma.constraint, env, level + 1))
+                else:
+                    temp = cur.sigma.type
+                    store.from_type(temp, level)
+                    stack.append((cur.constraint, env.set(cur.var.name, temp), level))
+
+            else:
+                assert False
+
+        store.check()
+        # variables of exp_type are named by the caller and are not printed in types:
+        # a class represented by one of them gets a fresh name, and its type is reported in self.inst
+        caller_vars = sorted(ConstraintResolver.__get_vars__(exp_type), key=lambda var: var.name)
+        for var in caller_vars:
+            node = store.find(store.var(var.name))
+            if store.left[node] is None and store.names[node] == var.name:
+                store.rename(node, self.get_new_type().name)
+        for var in self.variable_map:
+            self.variable_map[var] = store.resolve(store.from_type(self.variable_map[var]))
+        for x, instance in self.instances:
+            self.inst.append(Equation(x, store.resolve(store.from_type(instance))))
+        for var in caller_vars:
+            self.inst.append(Equation(var, store.resolve(store.var(var.name))))
+
+        return store.resolve(store.from_type(exp_type))
+
+
 def run_test(exp: Expression):
     infer = ConstraintResolver()
     print("Testing expression: {0}".format(exp))
@@ -263,6 +382,9 @@ def run_test(exp: Expression):
 
 
 def test():
+    from tools.canonical import types_equivalent
+    from tools.jalgo import JAlgorithm
+
     infer = ConstraintResolver()
 
     abs1 = Abstraction(
@@ -309,6 +431,61 @@ def test():
     )
     run_test(good_test)
 
+    def test_same(exp: Expression):
+        print("Testing expression: {0}: worklist resolver must give the same type as W algorithm".format(exp))
+        resolver = WorklistResolver()
+        result_type = TVar("result")
+        temp = resolver.resolve(resolver.generate_constraint(exp, result_type), result_type)
+        expected = JAlgorithm().infer_type(exp)[1]
+        print("Result is {0}".format(temp))
+        assert types_equivalent(temp, expected)
+        print("Passed\n")
+
+    x = Var("x")
+    y = Var("y")
+    z = Var("z")
+    f = Var("f")
+    id = Abstraction(x, x)
+    fst = Abstraction(x, Abstraction(y, x))
+
+    test_same(abs1)
+    test_same(exp)
+    test_same(Abstraction(f, Abstraction(x, Applique(f, Applique(f, x)))))
+    test_same(pre_good_test)
+    test_same(good_test)
+    test_same(Abstraction(x, Let(y, x, y)))
+    test_same(Abstraction(x, Let(y, Abstraction(z, Applique(z, x)), Applique(y, id))))
+    test_same(Let(f, fst, Applique(Applique(f, Applique(f, id)), y)))
+    test_same(Let(f, id, Let(Var("g"), Applique(f, f), Applique(Var("g"), Var("g")))))
+    test_same(Abstraction(x, Abstraction(x, Applique(x, y))))
+    test_same(Let(x, id, Let(x, Abstraction(y, Applique(x, y)), x)))
+
+    print("Testing expression: {0}: result variable of the caller is not printed in types".format(good_test))
+    resolver = WorklistResolver()
+    result_type = TVar("result")
+    temp = resolver.resolve(resolver.generate_constraint(good_test, result_type), result_type)
+    assert "result" not in str(temp) and str(temp).startswith("t")
+    assert all("result" not in str(t) for t in resolver.variable_map.values())
+    assert all("result" not in str(eq.right) for eq in resolver.inst)
+    assert resolver.inst[-1] == Equation(result_type, temp)
+    print("Passed\n")
+
+    def test_untypable(exp: Expression):
+        print("Testing expression: {0}: expression cannot have a type".format(exp))
+        try:
+            resolver = WorklistResolver()
+            resolver.resolve(resolver.generate_constraint(exp, TVar("result")), TVar("result"))
+            assert False
+        except InconsistentSystemError:
+            print("Passed\n")
+
+    a = Var("a")
+    b = Var("b")
+    test_untypable(Abstraction(x, Applique(x, x)))
+    # type of a free variable is the same everywhere, let does not generalize it
+    test_untypable(Let(y, x, Applique(y, y)))
+    test_untypable(Let(y, x, Applique(Applique(y, Abstraction(a, a)), Applique(x, Abstraction(a, Abstraction(b, a))))))
+
 
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 from tools.terrors import InconsistentSystemError
+from tools.traversal import walk, traverse, CHILDREN
 from tools.tstructure import *
 
 
@@ -21,6 +22,10 @@ class Equation:
         return not self.__eq__(other)
 
 
+# TODO: check TSigma
+__VARS_CHILDREN__ = dict((cls, CHILDREN[cls]) for cls in (TVar, TImpl, TSigma))
+
+
 def __get_vars__(exp: TType) -> set:
     """
     Get all str(variables) of given expression.
@@ -28,15 +33,9 @@ def __get_vars__(exp: TType) -> set:
     :param exp: given expression
     :return: set of variables
     """
-    if isinstance(exp, TVar):
+    if exp.__class__ is TVar:
         return {exp.name}
-    elif isinstance(exp, TImpl):
-        return __get_vars__(exp.left).union(__get_vars__(exp.right))
-    elif isinstance(exp, TSigma):
-        # TODO: check
-        return __get_vars__(exp.type)
-    else:
-        raise Exception("get_vars exception: No such type {0}".format(exp))
+    return {node.name for node in walk(exp, __VARS_CHILDREN__) if node.__class__ is TVar}
 
 
 def subst(exp: TType, x: TVar, sub: TType) -> TType:
@@ -48,18 +47,21 @@ def subst(exp: TType, x: TVar, sub: TType) -> TType:
     :param sub: given substitution
     :return: substituted expression
     """
-    if isinstance(exp, TVar):
-        if exp == x:
-            return sub
-        else:
-            return exp
-    elif isinstance(exp, TImpl):
-        return TImpl(subst(exp.left, x, sub), subst(exp.right, x, sub))
-    elif isinstance(exp, TUni):
+    if exp.__class__ is TVar:
+        return sub if exp == x else exp
+
+    def enter_uni(exp: TUni, state) -> (tuple, None):
         if exp.var == x:
-            return exp
-        else:
-            return TUni(exp.var, subst(exp.expression, x, sub))
+            return (), None
+        return ((exp.expression, None),), None
+
+    table = {
+        TVar: lambda exp, state: sub if exp == x else exp,
+        TImpl: (lambda exp, state: (((exp.left, None), (exp.right, None)), None),
+                lambda exp, data, values: TImpl(values[0], values[1])),
+        TUni: (enter_uni, lambda exp, data, values: TUni(exp.var, values[0]) if values else exp),
+    }
+    return traverse(exp, table)
 
 
 def __apply_first__(equations: list) -> (bool, list):
@@ -91,11 +93,13 @@ def __apply_second__(equations: list) -> (bool, list):
 
     result = []
     for equation in equations:
+        if equation.left == equation.right:
+            continue
+
         if isinstance(equation.left, TVar) and equation.left.name in __get_vars__(equation.right):
             raise InconsistentSystemError("equation of type x=T and x in T")
 
-        if equation.left != equation.right:
-            result.append(equation)
+        result.append(equation)
 
     return len(result) != len(equations), result
 
@@ -128,11 +132,12 @@ def __apply_fourth__(equations: list) -> (bool, list):
     :return: tuple(True if at least one transformation applied, transformed set of equations)
     """
     applied = False
-    for i in range(len(equations)):
-        vars = []
-        for equation in equations:
-            vars.append((__get_vars__(equation.left), __get_vars__(equation.right)))
+    # variables of both sides of every equation, updated with the equation
+    vars = []
+    for equation in equations:
+        vars.append((__get_vars__(equation.left), __get_vars__(equation.right)))
 
+    for i in range(len(equations)):
         if isinstance(equations[i].left, TVar):
             x = equations[i].left
             for j in range(len(equations)):
@@ -143,6 +148,7 @@ def __apply_fourth__(equations: list) -> (bool, list):
                                 subst(equations[j].left, x, equations[i].right),
                                 subst(equations[j].right, x, equations[i].right)
                         )
+                        vars[j] = (__get_vars__(equations[j].left), __get_vars__(equations[j].right))
 
     return applied, equations
 
@@ -169,6 +175,92 @@ def solve_set_of_equations(equations: list) -> list:
     return temp_eq
 
 
+def split_into_components(equations: list) -> list:
+    """
+    Split given set of equations into independent groups.
+    Two equations belong to the same group if they (transitively) share a variable.
+
+    :param equations: given list
+    :return: list of groups, each group is a list of equations in their original order
+    """
+    parent = {}
+
+    def find(name: str) -> str:
+        root = name
+        while parent[root] != root:
+            root = parent[root]
+        while parent[name] != root:
+            parent[name], name = root, parent[name]
+        return root
+
+    first_vars = []
+    for equation in equations:
+        vars = __get_vars__(equation.left).union(__get_vars__(equation.right))
+        first = None
+        for var in vars:
+            if var not in parent:
+                parent[var] = var
+            if first is None:
+                first = find(var)
+            else:
+                root = find(var)
+                if root != first:
+                    parent[root] = first
+        first_vars.append(first)
+
+    groups = {}
+    for i in range(len(equations)):
+        root = find(first_vars[i])
+        if root not in groups:
+            groups[root] = []
+        groups[root].append(equations[i])
+
+    return list(groups.values())
+
+
+def __solve_component__(equations: list) -> (bool, list):
+    """
+    Solve one independent group of equations. Used by worker processes, so errors are returned, not raised.
+
+    :param equations: given list
+    :return: tuple(False if system is inconsistent, solved set of equations)
+    """
+    try:
+        return True, solve_set_of_equations(equations)
+    except InconsistentSystemError:
+        return False, []
+
+
+def solve_by_components(equations: list, processes: int = None, parallel_threshold: int = 1000) -> list:
+    """
+    Solve given set of equations splitting it into independent groups first.
+    The result is the union of solved groups, so it is in the same form as the result of solve_set_of_equations.
+
+    :param equations: given list
+    :param processes: number of worker processes, None or 1 to solve everything in the current process
+    :param parallel_threshold: minimal number of equations to start a process pool
+    :return: solved set of equations
+    """
+    components = split_into_components(equations)
+
+    if processes is not None and processes > 1 and len(components) > 1 and len(equations) >= parallel_threshold:
+        from multiprocessing import Pool
+        with Pool(processes) as pool:
+            # Big groups go first so that small ones fill the gaps
+            order = sorted(components, key=len, reverse=True)
+            solved = pool.map(__solve_component__, order, chunksize=max(1, len(order) // (4 * processes)))
+    else:
+        solved = [__solve_component__(component) for component in components]
+
+    result = []
+    for consistent, component in solved:
+        if not consistent:
+            raise InconsistentSystemError("equation of type x=T and x in T")
+        result.extend(component)
+
+    return result
+
+
 def apply_system(exp: TType, equations: list) -> TType:
     """
     Apply given set of equations to given expression.
@@ -223,9 +315,54 @@ def test():
     eq6 = Equation(t1, I(t3, e0))
 
     set1 = [eq1, eq2, eq3, eq4, eq5, eq6]
-    print(str(apply_system(I(t0, I(t1, e5)), solve_set_of_equations(set1))))
+    expected = I(
+            I(I(I(t3, I(t4, e2)), I(t3, I(t4, e3))), I(I(t5, I(t6, t6)), e5)),
+            I(I(t3, I(e2, e3)), e5)
+    )
+    print("Testing system of six equations applied to {0}".format(I(t0, I(t1, e5))))
+    result = apply_system(I(t0, I(t1, e5)), solve_set_of_equations(set1))
+    print("Result is {0}".format(result))
+    assert result == expected
+    print("Passed\n")
+
+    test_equations([Equation(I(t0, t1), I(t1, I(t2, t2)))],
+                   [Equation(t0, I(t2, t2)), Equation(t1, I(t2, t2))])
+
+    test_equations([Equation(t0, t1), Equation(t0, t1), Equation(I(t1, t2), I(t0, t2))],
+                   [Equation(t0, t1)])
+
+    print("Testing occurs check")
+    try:
+        solve_set_of_equations([Equation(t0, I(t1, t2)), Equation(t1, t0)])
+        assert False
+    except InconsistentSystemError:
+        print("Passed\n")
+
+    def test_components(equations: list, count: int):
+        print("Testing components of \n  {0} \nThere must be {1} of them".format(
+                [str(i) for i in equations], count))
+        components = split_into_components(equations)
+        assert len(components) == count
+        solved = solve_by_components(equations)
+        expected = solve_set_of_equations(list(equations))
+        assert set(solved) == set(expected)
+        print("Passed\n")
 
-    # TODO parser and tests
+    test_components([Equation(t0, I(t1, t2)), Equation(e0, e1), Equation(t2, t3), Equation(e1, I(e2, e2))], 2)
+    test_components([Equation(t0, t1), Equation(e0, e1), Equation(t4, t5)], 3)
+    test_components([Equation(t0, I(t1, e0)), Equation(e0, t1)], 1)
+
+    x = [TVar("x" + str(i)) for i in range(2000)]
+    big = [Equation(x[i], I(x[i + 1], x[i + 1])) for i in range(0, 2000, 2)]
+    print("Testing {0} equations solved in parallel".format(len(big)))
+    assert set(solve_by_components(big, processes=2)) == set(big)
+    print("Passed\n")
+
+    try:
+        solve_by_components([Equation(t0, t1), Equation(e0, I(e0, e1))])
+        assert False
+    except InconsistentSystemError:
+        pass
 
 
 if __name__ == "__main__":
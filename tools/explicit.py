@@ -0,0 +1,386 @@
+"""
+    Normal order reduction with explicit substitutions.
+
+    A substitution is not performed by copying the body of an abstraction: beta reduction of (\\x.M) N gives
+    the closure M[x := N], a term whose substitution is still pending. A substitution is a chain of bindings
+    (name, closure, next binding), the innermost first, and it is pushed through a node of its term
+    only when reduction looks at that node:
+        (M N)[s]     -> M[s] N[s]        - the argument N[s] is a new closure, nothing is copied,
+        x[s]         -> closure of x in s (or x itself if it is free),
+        (\\x.M)[s] N -> M[x := N, s],
+        (let x = N in M)[s] -> M[x := N[s], s].
+    An argument that is discarded is never visited, an argument that is duplicated is shared by all its
+    occurrences, and it is reduced (to weak head normal form and to normal form) once: a closure is overwritten
+    in place by its result.
+    Reduction under an abstraction binds its variable to a fresh variable that is never substituted,
+    so there is no capture and no renaming.
+
+    ExplicitReducer - weak head normal forms and normal forms of closures,
+    normal_form     - normal form of an expression, tools.utils.reduction(exp, engine="explicit"),
+    stream_normal_form - text of the normal form produced head first while the arguments are still reduced.
+"""
+from tools.terrors import ReductionLimitError
+from tools.tstructure import *
+
+
+class Closure(Expression):
+    """
+        Expression with a pending substitution.
+        In weak head normal form (done) it is either an abstraction with its substitution
+        or a variable that is never substituted applied to the closures of args.
+    """
+
+    __slots__ = ("expression", "substitution", "args", "done", "normal")
+
+    def __init__(self, expression: Expression, substitution: tuple = None):
+        """
+        :param substitution: tuple(name, closure, next tuple) or None for the empty substitution
+        """
+        self.expression = expression
+        self.substitution = substitution
+        self.args = ()
+        self.done = False
+        # normal form, known once it is read back
+        self.normal = None
+
+    def __str__(self):
+        return "{0}[...]".format(self.expression)
+
+
+def __head__(var: Var) -> Closure:
+    """
+    :return: closure of a variable that is never substituted, already in weak head normal form
+    """
+    closure = Closure(var)
+    closure.done = True
+    return closure
+
+
+def __lookup__(substitution: tuple, name: str):
+    """
+    :return: closure bound to name or None if name is free
+    """
+    while substitution is not None:
+        if substitution[0] == name:
+            return substitution[1]
+        substitution = substitution[2]
+    return None
+
+
+class ExplicitReducer:
+    """
+        Call-by-need reduction of closures: weak head normal forms by a Krivine machine
+        with update markers, normal forms by reduction of the head and then of the arguments.
+    """
+
+    def __init__(self, max_steps: int = None, reserved: set = frozenset()):
+        """
+        :param max_steps: maximal number of beta reductions, None means no limit
+        :param reserved: names variables of abstractions of the streamed text must not take
+        """
+        self.max_steps = max_steps
+        self.steps = 0
+        self.last_var = 0
+        self.reserved = reserved
+
+    def __beta__(self):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise ReductionLimitError(self.max_steps)
+
+    def whnf(self, closure: Closure) -> Closure:
+        """
+        Reduce closure in place to weak head normal form.
+
+        :return: closure
+        """
+        if closure.done:
+            return closure
+        expression = closure.expression
+        substitution = closure.substitution
+        # arguments (closures) and update markers (tuple(closure)) of the spine, the first argument on top
+        stack = [(closure,)]
+        append = stack.append
+        while True:
+            cls = expression.__class__
+            if cls is Applique:
+                right = expression.right
+                if right.__class__ is Var:
+                    # the closure of a variable is the closure bound to it, no indirection is made
+                    arg = __lookup__(substitution, right.name)
+                    append(arg if arg is not None else __head__(right))
+                else:
+                    append(Closure(right, substitution))
+                expression = expression.left
+            elif cls is Abstraction:
+                top = stack.pop()
+                if top.__class__ is tuple:
+                    top = top[0]
+                    top.expression = expression
+                    top.substitution = substitution
+                    top.done = True
+                    if not stack:
+                        return closure
+                else:
+                    self.__beta__()
+                    substitution = (expression.variable.name, top, substitution)
+                    expression = expression.expression
+            elif cls is Var:
+                bound = __lookup__(substitution, expression.name)
+                if bound is None:
+                    bound = __head__(expression)
+                if not bound.done:
+                    append((bound,))
+                    expression = bound.expression
+                    substitution = bound.substitution
+                elif bound.expression.__class__ is Abstraction:
+                    expression = bound.expression
+                    substitution = bound.substitution
+                else:
+                    # the head is a variable, the rest of the spine becomes its arguments
+                    args = list(bound.args)
+                    while stack:
+                        top = stack.pop()
+                        if top.__class__ is tuple:
+                            top = top[0]
+                            top.expression = bound.expression
+                            top.substitution = None
+                            top.args = tuple(args)
+                            top.done = True
+                        else:
+                            args.append(top)
+                    return closure
+            elif cls is Let:
+                substitution = (expression.variable.name, Closure(expression.subst, substitution), substitution)
+                expression = expression.expression
+            else:
+                raise Exception("Unknown type of " + str(expression))
+
+    def normalize(self, closure: Closure) -> Expression:
+        """
+        Normal form of closure: the head is reduced first, then the arguments left to right.
+        Normal forms of shared closures are shared subtrees of the result.
+
+        :return: expression without let, variables of abstractions are fresh (#1, #2, ...)
+        """
+        values = []
+        push = values.append
+        # closures to reduce, or tuple(closure, its variable or None) whose parts are already reduced
+        stack = [closure]
+        append = stack.append
+        while stack:
+            entry = stack.pop()
+            if entry.__class__ is tuple:
+                entry, var = entry
+                if var is not None:
+                    entry.normal = Abstraction(var, values.pop())
+                else:
+                    result = entry.expression
+                    count = len(entry.args)
+                    if count:
+                        for value in values[len(values) - count:]:
+                            result = Applique(result, value)
+                        del values[len(values) - count:]
+                    entry.normal = result
+                push(entry.normal)
+                continue
+            if entry.normal is not None:
+                push(entry.normal)
+                continue
+            self.whnf(entry)
+            abstraction = entry.expression
+            if abstraction.__class__ is Abstraction:
+                self.last_var += 1
+                var = Var("#" + str(self.last_var))
+                append((entry, var))
+                append(Closure(abstraction.expression,
+                               (abstraction.variable.name, __head__(var), entry.substitution)))
+            else:
+                append((entry, None))
+                stack.extend(reversed(entry.args))
+        return values.pop()
+
+    def stream(self, closure: Closure):
+        """
+        Text of the normal form of closure as str of the expression printed by tools.utils.reduction.
+        The head of a term (its abstractions, the opening brackets of its applications and the head variable)
+        is produced as soon as it is in weak head normal form, then the arguments are reduced and produced
+        left to right. Only the closures of the arguments not yet produced are kept, nothing is memoized,
+        so the normal form of a duplicated argument is reduced again for every its occurrence.
+
+        :return: generator of consecutive pieces of the text
+        """
+        # closures to produce, or number of closing brackets to produce
+        stack = [closure]
+        append = stack.append
+        first = True
+        while stack:
+            entry = stack.pop()
+            if entry.__class__ is int:
+                yield ")" * entry
+                continue
+            # every closure but the root is an argument of an application
+            pieces = [] if first else [" "]
+            first = False
+            closing = 0
+            self.whnf(entry)
+            while entry.expression.__class__ is Abstraction:
+                # variables of abstractions are numbered in the order of the text, as rename_all_abstractions does
+                self.last_var += 1
+                while "t" + str(self.last_var) in self.reserved:
+                    self.last_var += 1
+                var = Var("t" + str(self.last_var))
+                pieces.append("(\\" + var.name + ".")
+                closing += 1
+                abstraction = entry.expression
+                entry = self.whnf(Closure(abstraction.expression,
+                                          (abstraction.variable.name, __head__(var), entry.substitution)))
+            name = entry.expression.name
+            args = entry.args
+            pieces.append("(" * len(args) + ("t" + name if name[0].isdigit() else name))
+            yield "".join(pieces)
+            # brackets that close together are one entry, so the closing brackets of a spine take no room
+            if closing:
+                if stack and stack[-1].__class__ is int:
+                    stack[-1] += closing
+                else:
+                    append(closing)
+            for arg in reversed(args):
+                if stack and stack[-1].__class__ is int:
+                    stack[-1] += 1
+                else:
+                    append(1)
+                append(arg)
+
+
+def normal_form(exp: Expression, max_steps: int = None) -> Expression:
+    """
+    :param max_steps: maximal number of beta reductions, None means no limit
+    :return: normal form of exp with fresh variables of abstractions
+    """
+    return ExplicitReducer(max_steps).normalize(Closure(exp))
+
+
+def stream_normal_form(exp: Expression, max_steps: int = None):
+    """
+    Normal form of exp as text produced head first, see ExplicitReducer.stream.
+    Throws ReductionLimitError after the text produced before the limit is reached.
+
+    :param max_steps: maximal number of beta reductions, None means no limit
+    :return: generator of pieces of str(tools.utils.reduction(exp))
+    """
+    # tools.utils imports this module
+    from tools.utils import reserved_names
+    return ExplicitReducer(max_steps, reserved_names(exp)).stream(Closure(exp))
+
+
+def test():
+    import time
+    from tools.tparsing import BufferParser
+    from tools.types import numbers, type_true, type_false, type_add, type_mul, type_pow, type_pow2, type_minus
+    from tools.utils import reduction
+
+    parser_ = BufferParser()
+
+    def parse(raw: str) -> Expression:
+        return parser_.parse(raw.encode("ascii"))
+
+    def test_same(raw: str):
+        print("Testing normal form of '{0}' is the same as by substitution".format(raw))
+        exp = parse(raw)
+        result = str(reduction(exp))
+        assert str(reduction(exp, engine="explicit")) == result
+        assert "".join(stream_normal_form(exp)) == result
+        print("Passed\n")
+
+    test_same("(\\x.x) a")
+    test_same("(\\x.x x x) (a b)")
+    test_same("\\x.(\\y.\\x.y x) x")
+    test_same("(\\x.\\y.x y) (\\z.z y)")
+    test_same("\\a.(\\x.\\y.x) (\\z.a z)")
+    test_same("(\\x.\\t1.x) t2")
+    test_same("(\\x.\\y.x t1 t3) (\\z.z)")
+    test_same(type_minus + " {0} {1}".format(numbers[20], numbers[10]))
+    test_same(type_pow + " {0} {1}".format(numbers[3], numbers[3]))
+    test_same(type_pow2 + " {0} {1}".format(numbers[3], numbers[3]))
+    test_same("{0} {1} {2}".format(type_mul, numbers[7], numbers[9]))
+
+    print("Testing let is a substitution")
+    assert str(reduction(parse("let f = \\x.x in f f a"), engine="explicit")) == "a"
+    assert str(reduction(parse("let x = a in let y = x b in \\x.y x"), engine="explicit")) == "(\\t1.((a b) t1))"
+    print("Passed\n")
+
+    print("Testing step limit")
+    try:
+        reduction(parse("(\\x.x x) (\\x.x x)"), max_steps=100, engine="explicit")
+        assert False
+    except ReductionLimitError:
+        pass
+    print("Passed\n")
+
+    print("Testing discarded argument is not reduced")
+    # the argument of false has no normal form
+    exp = parse("{0} ((\\x.x x) (\\x.x x)) a".format(type_false))
+    assert str(reduction(exp, engine="explicit")) == "a"
+    reducer = ExplicitReducer()
+    reducer.normalize(Closure(parse("{0} a ({1} {2} {2})".format(type_true, type_mul, numbers[20]))))
+    assert reducer.steps == 2
+    print("Passed\n")
+
+    print("Testing duplicated argument is reduced once")
+    square = ExplicitReducer()
+    square.normalize(Closure(parse("(\\n.{0} n n) ({1} {2} {2})".format(type_mul, type_add, numbers[5]))))
+    twice = ExplicitReducer()
+    twice.normalize(Closure(parse("{0} ({1} {2} {2}) ({1} {2} {2})".format(type_mul, type_add, numbers[5]))))
+    assert square.steps < twice.steps
+    print("Passed\n")
+
+    depth = 20000
+    print("Testing numeral {0}".format(depth))
+    numeral = "(\\f.\\x." + "(f " * depth + "x" + ")" * depth + ")"
+    result = normal_form(parse("{0} {1} {2}".format(type_add, numeral, numbers[1])))
+    count = 0
+    result = result.expression.expression
+    while result.__class__ is Applique:
+        count += 1
+        result = result.right
+    assert count == depth + 1
+    print("Passed\n")
+
+    print("Testing stream produces the head before the arguments are reduced")
+    # the second argument has no normal form
+    pieces = stream_normal_form(parse("\\x.x (\\y.y) ((\\z.z z) (\\z.z z))"), max_steps=1000)
+    assert next(pieces) == "(\\t1.((t1" and next(pieces) == " (\\t2.t2"
+    try:
+        list(pieces)
+        assert False
+    except ReductionLimitError:
+        pass
+    assert "".join(stream_normal_form(parse("let x = a in let y = x b in \\x.y x"))) == "(\\t1.((a b) t1))"
+    print("Passed\n")
+
+    print("Testing stream of numeral {0}".format(depth))
+    text = "".join(stream_normal_form(parse("{0} {1} {2}".format(type_add, numeral, numbers[1]))))
+    assert text == "(\\t1.(\\t2." + "(t1 " * (depth + 1) + "t2" + ")" * (depth + 1) + "))"
+    print("Passed\n")
+
+    print("Testing explicit substitution is faster when arguments are discarded or duplicated")
+    exp = parse("(\\n.\\b.b n n) ({0} {1} {1}) {2}".format(type_mul, numbers[12], type_true))
+
+    def best(func) -> float:
+        times = []
+        for i in range(3):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    substitution = best(lambda: reduction(exp))
+    explicit = best(lambda: reduction(exp, engine="explicit"))
+    print("substitution {0:.4f}s, explicit {1:.4f}s".format(substitution, explicit))
+    assert explicit < substitution
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,267 @@
+"""
+    Constraint generation into a flat append-only store and its iterative solving.
+    Instead of a tree of CExistence/CAnd/CDef objects every constraint is one integer-indexed record,
+    types are nodes of a TypeStore and variables refer to their binders by index.
+"""
+from array import array
+
+from tools.equations import Equation
+from tools.tstructure import *
+from tools.unification import TypeStore
+
+EQUALITY = 0
+INSTANCE = 1
+GENERALIZE = 2
+
+BINDER_MONO = 0
+BINDER_LET = 1
+BINDER_FREE = 2
+
+
+class ConstraintStore:
+    """
+        Record i is (kinds[i], first[i], second[i]) generated at let depth levels[i]:
+            EQUALITY - type nodes first and second are equal,
+            INSTANCE - type node second is an instance of the type of binder first (x < t),
+            GENERALIZE - constraint of let-bound expression of binder first is complete.
+        Binder j is a variable of program: binder_names[j] is its name, binder_kinds[j] is
+        BINDER_MONO (abstraction) or BINDER_FREE (free variable) with type node binder_types[j], or
+        BINDER_LET with let-bound type node binder_types[j] generalized at level binder_levels[j].
+    """
+
+    def __init__(self):
+        self.types = TypeStore()
+        self.kinds = array('b')
+        self.first = array('l')
+        self.second = array('l')
+        self.levels = array('l')
+        self.binder_names = []
+        self.binder_kinds = array('b')
+        self.binder_types = array('l')
+        self.binder_levels = array('l')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def add(self, kind: int, first: int, second: int, level: int):
+        self.kinds.append(kind)
+        self.first.append(first)
+        self.second.append(second)
+        self.levels.append(level)
+
+    def add_binder(self, name: str, kind: int, type: int, level: int = 0) -> int:
+        self.binder_names.append(name)
+        self.binder_kinds.append(kind)
+        self.binder_types.append(type)
+        self.binder_levels.append(level)
+        return len(self.binder_names) - 1
+
+    def __str__(self):
+        names = ["=", "<", "gen"]
+        return "\n".join("{0} {1} {2}".format(names[self.kinds[i]], self.first[i], self.second[i])
+                         for i in range(len(self)))
+
+
+class FlatConstraintResolver:
+    """
+        Same interface as ConstraintResolver: generate_constraint and resolve,
+        results in self.inst (instantiations of let-bound variables) and
+        self.variable_map (lambda-bound or free variable -> type at its use).
+    """
+
+    def __init__(self):
+        self.last_number = 0
+        self.variable_map = {}
+        self.inst = []
+
+    def __new_type__(self, store: ConstraintStore, level: int) -> int:
+        self.last_number += 1
+        return store.types.new_var("t" + str(self.last_number), level)
+
+    def generate_constraint(self, exp: Expression, t: TType) -> ConstraintStore:
+        """
+        Generate constraints of the given expression with the given type.
+        Expression is traversed with an explicit stack, so its depth is not limited.
+        """
+        store = ConstraintStore()
+        types = store.types
+        scope = {}
+        free = {}
+        level = 0
+        # let binder -> (its body, node of the body type) until the let-bound expression is done
+        pending = {}
+        # (expression, node of its type) or (None, let expression) to close a scope
+        stack = [(exp, types.from_type(t))]
+        while stack:
+            cur, node = stack.pop()
+            if cur is None:
+                if isinstance(node, Let):
+                    scope[node.variable.name].pop()
+                elif isinstance(node, Abstraction):
+                    scope[node.variable.name].pop()
+                else:
+                    # End of let-bound expression: node is binder
+                    level -= 1
+                    store.add(GENERALIZE, node, 0, level)
+                    scope.setdefault(store.binder_names[node], []).append(node)
+                    stack.append(pending.pop(node))
+
+            elif isinstance(cur, Var):
+                bound = scope.get(cur.name)
+                if bound:
+                    binder = bound[-1]
+                else:
+                    binder = free.get(cur.name)
+                    if binder is None:
+                        binder = free[cur.name] = store.add_binder(cur.name, BINDER_FREE, types.var(cur.name))
+                store.add(INSTANCE, binder, node, level)
+
+            elif isinstance(cur, Abstraction):
+                a1 = self.__new_type__(store, level)
+                a2 = self.__new_type__(store, level)
+                store.add(EQUALITY, types.impl(a1, a2), node, level)
+                binder = store.add_binder(cur.variable.name, BINDER_MONO, a1)
+                scope.setdefault(cur.variable.name, []).append(binder)
+                stack.append((None, cur))
+                stack.append((cur.expression, a2))
+
+            elif isinstance(cur, Applique):
+                a = self.__new_type__(store, level)
+                stack.append((cur.right, a))
+                stack.append((cur.left, types.impl(a, node)))
+
+            elif isinstance(cur, Let):
+                level += 1
+                a = self.__new_type__(store, level)
+                binder = store.add_binder(cur.variable.name, BINDER_LET, a, level - 1)
+                pending[binder] = (cur.expression, node)
+                stack.append((None, cur))
+                stack.append((None, binder))
+                stack.append((cur.subst, a))
+
+            else:
+                raise Exception("Unknown type of" + str(cur))
+
+        return store
+
+    def resolve(self, const: ConstraintStore, exp_type: TType) -> TType:
+        """
+        Solve all records in order of generation and produce the type of exp_type.
+        Throws InconsistentSystemError if the constraint has no solution.
+        """
+        self.variable_map = {}
+        self.inst = []
+        types = const.types
+        schemes = {}
+        instances = []
+
+        for i in range(len(const)):
+            kind = const.kinds[i]
+            level = const.levels[i]
+            if kind == EQUALITY:
+                types.unify(const.first[i], const.second[i])
+
+            elif kind == INSTANCE:
+                binder = const.first[i]
+                name = const.binder_names[binder]
+                if const.binder_kinds[binder] == BINDER_LET:
+                    body = const.binder_types[binder]
+                    instance = types.instantiate(schemes[binder], body, const.binder_levels[binder],
+                                                 lambda: self.__new_type__(const, level))
+                    instances.append((name, instance))
+                    types.unify(instance, const.second[i])
+                else:
+                    self.variable_map[TVar(name)] = const.second[i]
+                    types.unify(const.binder_types[binder], const.second[i])
+
+            else:
+                binder = const.first[i]
+                schemes[binder] = types.generalize(const.binder_types[binder], const.binder_levels[binder])
+
+        types.check()
+        for var in self.variable_map:
+            self.variable_map[var] = types.resolve(self.variable_map[var])
+        for name, instance in instances:
+            self.inst.append(Equation(TVar(name), types.resolve(instance)))
+
+        return types.resolve(types.from_type(exp_type))
+
+
+def test():
+    from tools.canonical import types_equivalent
+    from tools.constraints import WorklistResolver
+    from tools.jalgo import JAlgorithm
+    from tools.terrors import InconsistentSystemError
+
+    def resolve(resolver, exp: Expression, free: tuple) -> TType:
+        """
+        :param free: names of free variables of exp
+        :return: type of exp with the types of its free variables in front, so that their relation is compared too
+        """
+        result_type = TVar("result")
+        t = resolver.resolve(resolver.generate_constraint(exp, result_type), result_type)
+        for name in reversed(free):
+            t = TImpl(resolver.variable_map[TVar(name)], t)
+        return t
+
+    def test_same(exp: Expression, free: tuple = ()):
+        print("Testing expression: {0}: flat resolver must give the same types as tree resolver".format(exp))
+        temp = resolve(FlatConstraintResolver(), exp, free)
+        print("Result is {0}".format(temp))
+        assert types_equivalent(temp, resolve(WorklistResolver(), exp, free))
+        print("Passed\n")
+
+    def test_closed(exp: Expression):
+        test_same(exp)
+        print("Testing expression: {0}: flat resolver must give the same type as algorithm J".format(exp))
+        assert types_equivalent(resolve(FlatConstraintResolver(), exp, ()), JAlgorithm().infer_type(exp)[1])
+        print("Passed\n")
+
+    x = Var("x")
+    y = Var("y")
+    z = Var("z")
+    f = Var("f")
+    g = Var("g")
+    id = Abstraction(x, x)
+    fst = Abstraction(x, Abstraction(y, x))
+
+    # open terms: types of free variables are compared with the tree resolver, J also types other variables
+    test_same(x, ("x",))
+    test_same(Applique(x, y), ("x", "y"))
+    test_same(Abstraction(x, y), ("y",))
+    test_same(Let(Var("id"), id, Let(Var("fst"), fst, Applique(
+            Applique(Var("fst"), Applique(Var("id"), x)),
+            Applique(Var("id"), y)))), ("x", "y"))
+
+    test_closed(id)
+    test_closed(Applique(fst, id))
+    test_closed(Abstraction(f, Abstraction(x, Applique(f, Applique(f, x)))))
+    test_closed(Abstraction(x, Let(y, x, y)))
+    test_closed(Abstraction(x, Let(y, Abstraction(z, Applique(z, x)), Applique(y, id))))
+    test_closed(Let(f, id, Let(g, Applique(f, f), Applique(g, g))))
+    test_closed(Let(x, id, Let(x, Abstraction(y, Applique(x, y)), x)))
+    test_closed(Abstraction(x, Abstraction(x, Applique(x, id))))
+
+    print("Testing expression: {0}: expression cannot have a type".format(Abstraction(x, Applique(x, x))))
+    try:
+        resolver = FlatConstraintResolver()
+        resolver.resolve(resolver.generate_constraint(Abstraction(x, Applique(x, x)), TVar("r")), TVar("r"))
+        assert False
+    except InconsistentSystemError:
+        print("Passed\n")
+
+    size = 100000
+    print("Testing expression of depth {0}".format(size))
+    deep = Abstraction(x, x)
+    for i in range(size):
+        v = Var("v" + str(i % 7))
+        deep = Let(v, Abstraction(x, Applique(Abstraction(y, y), x)), Applique(v, deep))
+    resolver = FlatConstraintResolver()
+    store = resolver.generate_constraint(deep, TVar("result"))
+    print("Records: {0}, type nodes: {1}".format(len(store), len(store.types)))
+    assert types_equivalent(resolver.resolve(store, TVar("result")), TImpl(TVar("a"), TVar("a")))
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,396 @@
+"""
+    Seeded generator of random expressions of controlled shape for benchmarks and stress tests.
+    Terms are built with an explicit stack, so neither size nor depth is limited by recursion,
+    and TermGenerator.stream produces any number of terms lazily.
+"""
+import random
+
+from tools.tstructure import *
+
+__BUILD__ = 0
+__ABSTRACTION__ = 1
+__APPLIQUE__ = 2
+__LET__ = 3
+__BIND__ = 4
+__UNBIND__ = 5
+
+# Base types of typed generation, arrow A->B is tuple(A, B)
+__BASES__ = ("a", "b")
+
+# Variables of the signature of typed terms: every base type is the result of some function,
+# so that a term of any type can be built of any size.
+__SIGNATURE__ = (
+    ("f", ("a", ("a", "a"))),
+    ("g", ("a", "b")),
+    ("h", ("b", "a")),
+    ("x", "a"),
+    ("y", "b")
+)
+
+
+def __arity__(t, goal) -> int:
+    """
+    :return: n such that t = A1->...->An->goal or -1
+    """
+    n = 0
+    while t != goal:
+        if not isinstance(t, tuple):
+            return -1
+        t = t[1]
+        n += 1
+    return n
+
+
+def __arguments__(t, n: int) -> list:
+    result = []
+    for i in range(n):
+        result.append(t[0])
+        t = t[1]
+    return result
+
+
+class TermGenerator:
+    """
+        Random expressions with about size nodes (Var, Abstraction, Applique and Let are one node each).
+
+        At every node binder_density is the probability of an abstraction, then let_density of a let
+        (at most max_let_nesting nested), then redex_density of a beta-redex (\\x.M) N.
+        Untyped terms: a closed term starts with an abstraction, applications other than the planted redexes
+        never have an abstraction on the left, so a term has exactly self.redexes redexes.
+
+        Typed terms (typable=True or normalising=True) are built by types over the signature
+        f : a->a->a, g : a->b, h : b->a, x : a, y : b, bound by abstractions around the term if it is closed
+        and free otherwise. Terms without let are typable by ClassicInferer, so they are strongly normalising.
+        With typable=True lets are allowed (the bound variable is used monomorphically,
+        the term is typable by WAlgorithm), normalising=True never produces let.
+    """
+
+    def __init__(self, seed: int = 0, size: int = 20, max_depth: int = None, closed: bool = True,
+                 binder_density: float = 0.3, let_density: float = 0.0, max_let_nesting: int = 3,
+                 redex_density: float = 0.1, typable: bool = False, normalising: bool = False):
+        """
+        :param seed: seed of the random generator, equal seeds give equal streams of terms
+        :param size: target number of nodes of a term
+        :param max_depth: maximal depth of a term, None means no limit;
+                          typed terms may exceed it by abstractions needed for the goal type
+        :param closed: if False, leaves may be free variables
+        """
+        self.random = random.Random(seed)
+        self.size = size
+        self.max_depth = max_depth
+        self.closed = closed
+        self.binder_density = binder_density
+        self.let_density = 0.0 if normalising else let_density
+        self.max_let_nesting = max_let_nesting
+        self.redex_density = redex_density
+        self.typed = typable or normalising
+        self.counter = 0
+        # number of redexes planted into the last term
+        self.redexes = 0
+
+    def __fresh__(self) -> str:
+        self.counter += 1
+        return "v" + str(self.counter)
+
+    def __split__(self, size: int, parts: int) -> list:
+        """
+        Split size into parts positive sizes at random.
+        """
+        if parts == 1:
+            return [max(size, 1)]
+        cuts = sorted(self.random.randint(0, max(size - parts, 0)) for _ in range(parts - 1))
+        result = []
+        last = 0
+        for cut in cuts:
+            result.append(cut - last + 1)
+            last = cut
+        result.append(max(size - parts, 0) - last + 1)
+        return result
+
+    def __fits__(self, depth: int, height: int) -> bool:
+        """
+        :return: True if a subterm of given height may start at given depth (counted from 0)
+        """
+        return self.max_depth is None or depth + height <= self.max_depth
+
+    def __random_type__(self):
+        if self.random.random() < 0.3:
+            return self.random.choice(__BASES__), self.random.choice(__BASES__)
+        return self.random.choice(__BASES__)
+
+    def term(self, size: int = None) -> Expression:
+        """
+        :param size: target number of nodes instead of self.size
+        :return: random expression
+        """
+        size = size or self.size
+        self.counter = 0
+        self.redexes = 0
+        scope = []
+        results = []
+
+        if self.typed:
+            goal = self.random.choice(__BASES__)
+            if self.closed:
+                for name, t in reversed(__SIGNATURE__):
+                    goal = (t, goal)
+            else:
+                scope.extend(__SIGNATURE__)
+            stack = [(__BUILD__, size, 0, 0, goal, False)]
+        else:
+            stack = [(__BUILD__, size, 0, 0, None, False)]
+
+        while stack:
+            task = stack.pop()
+            kind = task[0]
+            if kind == __BUILD__:
+                if self.typed:
+                    self.__build_typed__(task, scope, stack, results)
+                else:
+                    self.__build__(task, scope, stack, results)
+            elif kind == __ABSTRACTION__:
+                results.append(Abstraction(Var(task[1]), results.pop()))
+            elif kind == __APPLIQUE__:
+                right = results.pop()
+                results.append(Applique(results.pop(), right))
+            elif kind == __LET__:
+                body = results.pop()
+                results.append(Let(Var(task[1]), results.pop(), body))
+            elif kind == __BIND__:
+                scope.append((task[1], task[2]))
+            else:
+                scope.pop()
+
+        return results.pop()
+
+    def __leaf__(self, scope: list, results: list):
+        if scope and (self.closed or self.random.random() < 0.8):
+            results.append(Var(self.random.choice(scope)[0]))
+        elif not self.closed:
+            results.append(Var(self.random.choice(("a", "b", "c", "d"))))
+        else:
+            name = self.__fresh__()
+            results.append(Abstraction(Var(name), Var(name)))
+
+    def __build__(self, task: tuple, scope: list, stack: list, results: list):
+        """
+        Untyped node: task is (__BUILD__, size, depth, let nesting, None, neutral),
+        neutral terms are not abstractions (left side of an application that is not a redex).
+        """
+        _, size, depth, lets, _, neutral = task
+        if size <= 1 or (self.max_depth is not None and depth + 1 >= self.max_depth):
+            self.__leaf__(scope, results)
+            return
+
+        rand = self.random.random
+        if not neutral and (self.closed and not scope or rand() < self.binder_density):
+            name = self.__fresh__()
+            stack.append((__ABSTRACTION__, name))
+            stack.append((__UNBIND__,))
+            stack.append((__BUILD__, size - 1, depth + 1, lets, None, False))
+            stack.append((__BIND__, name, None))
+            return
+        if not neutral and lets < self.max_let_nesting and size >= 3 and rand() < self.let_density:
+            name = self.__fresh__()
+            bound, body = self.__split__(size - 1, 2)
+            stack.append((__LET__, name))
+            stack.append((__UNBIND__,))
+            stack.append((__BUILD__, body, depth + 1, lets + 1, None, False))
+            stack.append((__BIND__, name, None))
+            stack.append((__BUILD__, bound, depth + 1, lets + 1, None, False))
+            return
+        if size >= 4 and self.__fits__(depth, 3) and rand() < self.redex_density:
+            # (\x.body) argument
+            self.redexes += 1
+            name = self.__fresh__()
+            body, argument = self.__split__(size - 2, 2)
+            stack.append((__APPLIQUE__,))
+            stack.append((__BUILD__, argument, depth + 1, lets, None, False))
+            stack.append((__ABSTRACTION__, name))
+            stack.append((__UNBIND__,))
+            stack.append((__BUILD__, body, depth + 2, lets, None, False))
+            stack.append((__BIND__, name, None))
+            return
+
+        left, right = self.__split__(size - 1, 2)
+        stack.append((__APPLIQUE__,))
+        stack.append((__BUILD__, right, depth + 1, lets, None, False))
+        stack.append((__BUILD__, left, depth + 1, lets, None, True))
+
+    def __build_typed__(self, task: tuple, scope: list, stack: list, results: list):
+        """
+        Typed node: task is (__BUILD__, size, depth, let nesting, goal type, False).
+        """
+        _, size, depth, lets, goal, _ = task
+        small = size <= 1 or (self.max_depth is not None and depth + 1 >= self.max_depth)
+        rand = self.random.random
+
+        candidates = [(name, t) for name, t in scope if __arity__(t, goal) >= 0]
+        variables = [name for name, t in candidates if t == goal]
+        signature = self.closed and depth < len(__SIGNATURE__)
+        if isinstance(goal, tuple) and (small or signature or not candidates or rand() < self.binder_density):
+            if signature:
+                # abstractions of the signature around a closed term
+                name = __SIGNATURE__[depth][0]
+            else:
+                name = self.__fresh__()
+            stack.append((__ABSTRACTION__, name))
+            stack.append((__UNBIND__,))
+            stack.append((__BUILD__, size - 1, depth + 1, lets, goal[1], False))
+            stack.append((__BIND__, name, goal[0]))
+            return
+
+        if small and variables:
+            results.append(Var(self.random.choice(variables)))
+            return
+        if lets < self.max_let_nesting and size >= 3 and rand() < self.let_density:
+            name = self.__fresh__()
+            t = self.__random_type__()
+            bound, body = self.__split__(size - 1, 2)
+            stack.append((__LET__, name))
+            stack.append((__UNBIND__,))
+            stack.append((__BUILD__, body, depth + 1, lets + 1, goal, False))
+            stack.append((__BIND__, name, t))
+            stack.append((__BUILD__, bound, depth + 1, lets + 1, t, False))
+            return
+        if size >= 4 and self.__fits__(depth, 3) and rand() < self.redex_density:
+            self.redexes += 1
+            name = self.__fresh__()
+            t = self.__random_type__()
+            body, argument = self.__split__(size - 2, 2)
+            stack.append((__APPLIQUE__,))
+            stack.append((__BUILD__, argument, depth + 1, lets, t, False))
+            stack.append((__ABSTRACTION__, name))
+            stack.append((__UNBIND__,))
+            stack.append((__BUILD__, body, depth + 2, lets, goal, False))
+            stack.append((__BIND__, name, t))
+            return
+
+        # application of a variable to arguments: v M1 ... Mn
+        functions = [(name, t) for name, t in candidates if __arity__(t, goal) > 0 and
+                     self.__fits__(depth, __arity__(t, goal) + 1)]
+        if not functions:
+            if variables:
+                results.append(Var(self.random.choice(variables)))
+            else:
+                # arrow goal: only a function of greater arity could produce it, but it is too deep
+                stack.append((__BUILD__, 1, depth, lets, goal, False))
+            return
+        name, t = self.random.choice(functions)
+        arguments = __arguments__(t, __arity__(t, goal))
+        results.append(Var(name))
+        sizes = self.__split__(size - len(arguments) - 1, len(arguments))
+        # arguments are built in order, every one is applied right after it is built
+        for i in reversed(range(len(arguments))):
+            stack.append((__APPLIQUE__,))
+            stack.append((__BUILD__, sizes[i], depth + len(arguments) - i, lets, arguments[i], False))
+
+    def stream(self, count: int = None, size: int = None):
+        """
+        :param count: number of terms, None means infinite stream
+        :return: generator of random expressions
+        """
+        produced = 0
+        while count is None or produced < count:
+            yield self.term(size)
+            produced += 1
+
+
+def statistics(exp: Expression) -> dict:
+    """
+    :return: dict with number of nodes, depth, abstractions, lets, beta-redexes and free variables of exp
+    """
+    result = {"size": 0, "depth": 0, "abstractions": 0, "lets": 0, "redexes": 0}
+    free = set()
+    bound = {}
+    # (expression, depth) or (__BIND__ or __UNBIND__, name)
+    stack = [(exp, 1)]
+    while stack:
+        cur, depth = stack.pop()
+        if cur is __BIND__:
+            bound[depth] = bound.get(depth, 0) + 1
+            continue
+        elif cur is __UNBIND__:
+            bound[depth] -= 1
+            continue
+
+        result["size"] += 1
+        result["depth"] = max(result["depth"], depth)
+        if isinstance(cur, Var):
+            if bound.get(cur.name, 0) == 0:
+                free.add(cur.name)
+        elif isinstance(cur, Abstraction):
+            result["abstractions"] += 1
+            stack.append((__UNBIND__, cur.variable.name))
+            stack.append((cur.expression, depth + 1))
+            stack.append((__BIND__, cur.variable.name))
+        elif isinstance(cur, Applique):
+            if isinstance(cur.left, Abstraction):
+                result["redexes"] += 1
+            stack.append((cur.right, depth + 1))
+            stack.append((cur.left, depth + 1))
+        elif isinstance(cur, Let):
+            result["lets"] += 1
+            stack.append((__UNBIND__, cur.variable.name))
+            stack.append((cur.expression, depth + 1))
+            stack.append((__BIND__, cur.variable.name))
+            stack.append((cur.subst, depth + 1))
+        else:
+            raise Exception("Unknown type of" + str(cur))
+    result["free"] = sorted(free)
+    return result
+
+
+def test():
+    from tools.inference import ClassicInferer
+    from tools.utils import reduction
+    from tools.walgo import WAlgorithm
+
+    def check(name: str, generator: TermGenerator, count: int, condition):
+        print("Testing {0}: {1} terms".format(name, count))
+        for exp in generator.stream(count):
+            assert condition(exp, statistics(exp)), str(exp)
+        print("Passed\n")
+
+    print("Testing same seed gives same terms")
+    first = [str(exp) for exp in TermGenerator(seed=7, size=40, let_density=0.2).stream(20)]
+    second = [str(exp) for exp in TermGenerator(seed=7, size=40, let_density=0.2).stream(20)]
+    assert first == second
+    assert first != [str(exp) for exp in TermGenerator(seed=8, size=40, let_density=0.2).stream(20)]
+    print("Passed\n")
+
+    untyped = TermGenerator(seed=1, size=60, redex_density=0.2)
+    check("closed untyped terms have planted redexes only", untyped, 200,
+          lambda exp, stats: stats["free"] == [] and stats["redexes"] == untyped.redexes and
+          30 <= stats["size"] <= 90)
+
+    check("open terms with lets", TermGenerator(seed=2, size=60, closed=False, let_density=0.3, max_let_nesting=2),
+          200, lambda exp, stats: stats["lets"] <= 60)
+
+    check("depth limit", TermGenerator(seed=3, size=500, max_depth=8), 50,
+          lambda exp, stats: stats["depth"] <= 8)
+
+    check("no redexes", TermGenerator(seed=4, size=80, redex_density=0), 100,
+          lambda exp, stats: stats["redexes"] == 0)
+
+    check("typable terms", TermGenerator(seed=5, size=80, typable=True, redex_density=0.2), 100,
+          lambda exp, stats: stats["free"] == [] and ClassicInferer().get_type(exp) is not None)
+
+    check("open typable terms", TermGenerator(seed=6, size=80, closed=False, typable=True), 100,
+          lambda exp, stats: ClassicInferer().get_type(exp) is not None)
+
+    check("typable terms with let", TermGenerator(seed=7, size=60, typable=True, let_density=0.2), 50,
+          lambda exp, stats: WAlgorithm().infer_type(exp)[1] is not None)
+
+    check("normalising terms", TermGenerator(seed=8, size=40, normalising=True, redex_density=0.3), 50,
+          lambda exp, stats: stats["lets"] == 0 and reduction(exp, max_steps=100000) is not None)
+
+    size = 200000
+    print("Testing term of {0} nodes".format(size))
+    stats = statistics(TermGenerator(seed=9, size=size, binder_density=0.99, redex_density=0).term())
+    assert stats["depth"] > 1000 and stats["size"] >= size
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
@@ -1,112 +1,98 @@
-from tools.equations import Equation, solve_set_of_equations, apply_system
+from tools.canonical import types_equivalent
 from tools.terrors import InconsistentSystemError
 from tools.tstructure import *
-from tools.utils import rename_all_abstractions, get_free_vars
+from tools.unification import TypeStore
 
 
 class ClassicInferer:
     def __init__(self):
         self.defined_vars = {}
 
-    def __get_type__(self, exp: Expression, last_var: int) -> (int, list, TType):
+    @staticmethod
+    def __collect__(exp: Expression, store: TypeStore, free: dict) -> int:
         """
-        Get list of equations and type corresponding to given expression.
-        Assumed that all variables is already renamed.
+        Build type of given expression in given store unifying equations while traversing.
+        Variables are resolved through the scope of abstractions, so expression need not be renamed.
 
         :param exp: given expression
-        :param last_var: next free variable
-        :return: tuple(next free variable, list of equations, type)
+        :param store: store of types
+        :param free: dictionary for nodes of free variables (Var -> node), filled in order of first occurrence
+        :return: node of the type of given expression
         """
-        if isinstance(exp, Var):
-            self.defined_vars[exp] = TVar("t" + exp.name)
-            return last_var, [], TVar("t" + exp.name)
-        elif isinstance(exp, Abstraction):
-            resort = None
-            if exp.variable in self.defined_vars:
-                resort = self.defined_vars[exp.variable]
-
-            temp = self.__get_type__(exp.expression, last_var)
-
-            if resort is None:
-                if exp.variable in self.defined_vars:
-                    del self.defined_vars[exp.variable]
+        # names of types are those of the equations of rename_all_abstractions(exp): variable of the i-th
+        # abstraction in pre-order is tti, result of the i-th application in post-order is ti (from 0),
+        # free variable x is tx
+        abstractions = 0
+        applications = 0
+        scope = {}
+        results = []
+        stack = [(exp, None)]
+        while stack:
+            cur, node = stack.pop()
+            if isinstance(cur, Var):
+                bound = scope.get(cur.name)
+                if bound:
+                    results.append(bound[-1])
+                else:
+                    if cur not in free:
+                        free[cur] = store.var("t" + cur.name)
+                    results.append(free[cur])
+            elif isinstance(cur, Abstraction):
+                if node is None:
+                    abstractions += 1
+                    node = store.new_var("tt" + str(abstractions))
+                    if cur.variable.name not in scope:
+                        scope[cur.variable.name] = []
+                    scope[cur.variable.name].append(node)
+                    stack.append((cur, node))
+                    stack.append((cur.expression, None))
+                else:
+                    scope[cur.variable.name].pop()
+                    results.append(store.impl(node, results.pop()))
+            elif isinstance(cur, Applique):
+                if node is None:
+                    stack.append((cur, -1))
+                    stack.append((cur.right, None))
+                    stack.append((cur.left, None))
+                else:
+                    right = results.pop()
+                    left = results.pop()
+                    new_var = store.new_var("t" + str(applications))
+                    applications += 1
+                    store.unify(left, store.impl(right, new_var))
+                    results.append(new_var)
             else:
-                self.defined_vars[exp.variable] = resort
+                raise Exception("Unknown type of" + str(cur))
 
-            return last_var, temp[1], TImpl(TVar("t" + exp.variable.name), temp[2])
-        elif isinstance(exp, Applique):
-            left = self.__get_type__(exp.left, last_var)
-            right = self.__get_type__(exp.right, left[0])
-            new_var = TVar("t" + str(right[0]))
-
-            result_list = left[1] + right[1]
-            result_list.append(Equation(left[2], TImpl(right[2], new_var)))
-            return right[0] + 1, result_list, new_var
-        else:
-            raise Exception("Unknown type of" + str(exp))
+        return results[0]
 
     def get_type(self, exp: Expression) -> TType:
         """
-        Get type of given expression
+        Get type of given expression.
+        Types of free variables are stored in self.defined_vars.
 
         :param exp: given expression
-        :return: tuple(context, resulting type)
+        :return: resulting type or None if expression has no type
         """
-        temp = self.__get_type__(rename_all_abstractions(exp), 0)
+        store = TypeStore()
+        free = {}
+        self.defined_vars = {}
+        node = ClassicInferer.__collect__(exp, store, free)
         try:
-            eq_set = solve_set_of_equations(temp[1])
-            for var in self.defined_vars:
-                self.defined_vars[var] = apply_system(self.defined_vars[var], eq_set)
-            return apply_system(temp[2], eq_set)
+            store.check()
+            for var in free:
+                self.defined_vars[var] = store.resolve(free[var])
+            return store.resolve(node)
         except InconsistentSystemError:
+            self.defined_vars = {}
             return None
 
     def get_type_with_context(self, exp: Expression) -> (dict, TType):
         """
         Get type of given expression and context of defined variables
         """
-        self.defined_vars = {}
-        # free_vars = get_free_vars(exp)
-        # context = {}
-        # for var in free_vars:
-        #     context[var] = self.defined_vars[var]
-        #
-        return self.defined_vars, self.get_type(exp)
-
-
-def __rename__(exp: TType, last_var: int, used: dict) -> (TType, int, dict):
-    """
-    Rename all variables in given expression in the same order every time.
-    Variables get such names: t1, t2, t3 ...
-
-    :param exp: given expression
-    :param last_var: next free variable
-    :param used: dictionary of renamed variables
-    :return: renamed type
-    """
-    if isinstance(exp, TVar):
-        if exp.name in used:
-            return TVar(used[exp.name]), last_var, used
-        else:
-            used[exp.name] = "t" + str(last_var)
-            return TVar(used[exp.name]), last_var + 1, used
-    elif isinstance(exp, TImpl):
-        left = __rename__(exp.left, last_var, used)
-        right = __rename__(exp.right, left[1], left[2])
-        return TImpl(left[0], right[0]), right[1], right[2]
-    else:
-        return None
-
-
-def __is_eq__(exp1: TType, exp2: TType) -> bool:
-    """
-    Check if twp types is equivalent.
-
-    :param exp1: first type
-    :param exp2: second type
-    :return: True is types is equivalent
-    """
-    return __rename__(exp1, 0, {})[0] == __rename__(exp2, 0, {})[0]
+        t = self.get_type(exp)
+        return self.defined_vars, t
 
 
 def test():
@@ -121,7 +107,7 @@ def test():
         print("Testing expression '{0}': expression must have type '{1}'".format(exp, result))
         res = ClassicInferer().get_type(exp)
         print("Result is {0}".format(res))
-        assert __is_eq__(res, result)
+        assert types_equivalent(res, result)
         print("Passed\n")
 
     t = TVar("t")
@@ -145,6 +131,31 @@ def test():
     test_if_same(e2, TImpl(TImpl(t, t), TImpl(t, t)))
 
     e3 = Abstraction(x, Applique(x, y))
+    test_if_same(e3, TImpl(TImpl(TVar("a"), t), t))
+
+    print("Testing context of expression '{0}'".format(e3))
+    context, res = ClassicInferer().get_type_with_context(e3)
+    assert list(context.keys()) == [y]
+    # names are those of the equations of the renamed expression
+    assert str(res) == "((ty->t0)->t0)" and str(context[y]) == "ty"
+    assert types_equivalent(TImpl(TImpl(context[y], t), t), TImpl(TImpl(TVar("a"), TVar("b")), TVar("b")))
+    print("Passed\n")
+
+    assert str(ClassicInferer().get_type(Abstraction(x, Abstraction(y, x)))) == "(tt1->(tt2->tt1))"
+
+    e4 = Abstraction(x, Abstraction(x, Applique(x, Abstraction(x, x))))
+    test_if_same(e4, TImpl(TVar("a"), TImpl(TImpl(TImpl(t, t), TVar("b")), TVar("b"))))
+
+    size = 100000
+    print("Testing application of size {0}".format(size))
+    # (\x.x) ((\x.x) (... y))
+    wide = y
+    for i in range(size):
+        wide = Applique(Abstraction(x, x), wide)
+    context, res = ClassicInferer().get_type_with_context(wide)
+    assert res == context[y]
+    print("Passed\n")
+
 
 if __name__ == "__main__":
     test()
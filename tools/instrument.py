@@ -0,0 +1,231 @@
+"""
+    Counters of calls, time and processed items of the hot functions of tools.
+    Functions are wrapped only while instrumentation is enabled (with instrumented() as report: ...),
+    so there is no overhead at all when it is disabled.
+    Nested and repeated instrumented() blocks are allowed: every active report receives every event.
+    Functions are replaced in their modules and in every module that imported them by name,
+    references held elsewhere (e.g. in local variables) keep calling the original functions.
+"""
+import importlib
+import json
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+def __first_len__(args, kwargs) -> int:
+    return len(args[0])
+
+
+def __one__(args, kwargs) -> int:
+    return 1
+
+
+# (module, function or Class.method, items of a call or None)
+TARGETS = (
+    ("tools.utils", "substitution", None),
+    ("tools.utils", "__subst__", None),
+    ("tools.utils", "__reduction__", None),
+    ("tools.utils", "reduction", None),
+    ("tools.utils", "rename_all_abstractions", None),
+    ("tools.utils", "get_free_vars", None),
+    ("tools.explicit", "ExplicitReducer.whnf", None),
+    ("tools.explicit", "ExplicitReducer.normalize", None),
+    ("tools.equations", "subst", None),
+    ("tools.equations", "solve_set_of_equations", __first_len__),
+    ("tools.equations", "__apply_first__", __first_len__),
+    ("tools.equations", "__apply_second__", __first_len__),
+    ("tools.equations", "__apply_third__", __first_len__),
+    ("tools.equations", "__apply_fourth__", __first_len__),
+    ("tools.walgo", "WAlgorithm.infer_type", None),
+    ("tools.walgo", "WAlgorithm.__infer_type__", None),
+    ("tools.walgo", "WAlgorithm.__resolve__", None),
+    ("tools.walgo", "WAlgorithm.__lookup__", None),
+    ("tools.walgo", "WAlgorithm.locking", None),
+    ("tools.walgo", "WAlgorithm.get_new_type", None),
+    ("tools.constraints", "ConstraintResolver.generate_constraint", None),
+    ("tools.constraints", "ConstraintResolver.resolve", None),
+    ("tools.constraints", "ConstraintResolver.__resolve__", None),
+    ("tools.constraints", "ConstraintResolver.__inst__", None),
+    ("tools.constraints", "WorklistResolver.resolve", None),
+    ("tools.constraints", "WorklistResolver.__generalize__", None),
+    ("tools.constraints", "WorklistResolver.__instantiate__", None),
+    ("tools.unification", "TypeStore.unify", None),
+)
+
+# Constructors counted as allocated nodes
+ALLOCATIONS = (
+    ("tools.tstructure", "Var.__init__", __one__),
+    ("tools.tstructure", "Abstraction.__init__", __one__),
+    ("tools.tstructure", "Applique.__init__", __one__),
+    ("tools.tstructure", "Let.__init__", __one__),
+    ("tools.tstructure", "TVar.__init__", __one__),
+    ("tools.tstructure", "TImpl.__init__", __one__),
+)
+
+
+class Report:
+    """
+        Counters by name of instrumented function: calls, seconds and items.
+        Time of a function is counted only for its outermost call, so recursion is not counted twice.
+    """
+
+    def __init__(self):
+        self.counters = {}
+
+    def add(self, name: str, seconds: float, items: int):
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = [0, 0.0, 0]
+        counter[0] += 1
+        counter[1] += seconds
+        counter[2] += items
+
+    def merge(self, other):
+        """
+        Add counters of other report (Report or result of to_dict) to this one.
+        """
+        if isinstance(other, Report):
+            other = other.to_dict()
+        for name, counter in other.items():
+            mine = self.counters.get(name)
+            if mine is None:
+                mine = self.counters[name] = [0, 0.0, 0]
+            mine[0] += counter["calls"]
+            mine[1] += counter["seconds"]
+            mine[2] += counter["items"]
+        return self
+
+    def to_dict(self) -> dict:
+        return dict((name, {"calls": calls, "seconds": seconds, "items": items})
+                    for name, (calls, seconds, items) in self.counters.items())
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def to_text(self) -> str:
+        lines = ["{0:55} {1:>10} {2:>12} {3:>10}".format("function", "calls", "seconds", "items")]
+        for name, (calls, seconds, items) in sorted(self.counters.items(), key=lambda item: -item[1][1]):
+            lines.append("{0:55} {1:10d} {2:12.6f} {3:10d}".format(name, calls, seconds, items))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.to_text()
+
+
+__reports__ = []
+# list of tuple(owner (module or class), attribute, original value) of patched attributes
+__patched__ = []
+
+
+def __wrap__(name: str, func, items):
+    depth = [0]
+    clock = time.perf_counter
+    reports = __reports__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        depth[0] += 1
+        start = clock() if depth[0] == 1 else None
+        try:
+            return func(*args, **kwargs)
+        finally:
+            depth[0] -= 1
+            seconds = clock() - start if start is not None else 0.0
+            count = items(args, kwargs) if items is not None else 0
+            for report in reports:
+                report.add(name, seconds, count)
+
+    return wrapper
+
+
+def __patch__(targets):
+    for module_name, path, items in targets:
+        module = importlib.import_module(module_name)
+        name = module_name.split(".")[-1] + "." + path
+        if "." in path:
+            class_name, attribute = path.split(".")
+            owner = getattr(module, class_name)
+            original = owner.__dict__[attribute]
+            if isinstance(original, staticmethod):
+                wrapped = staticmethod(__wrap__(name, original.__func__, items))
+            else:
+                wrapped = __wrap__(name, original, items)
+            __patched__.append((owner, attribute, original))
+            setattr(owner, attribute, wrapped)
+        else:
+            original = getattr(module, path)
+            wrapped = __wrap__(name, original, items)
+            # modules that imported the function by name call it through their own globals
+            for other in list(sys.modules.values()):
+                if other is not None and getattr(other, "__dict__", {}).get(path) is original:
+                    __patched__.append((other, path, original))
+                    setattr(other, path, wrapped)
+
+
+def __unpatch__():
+    while __patched__:
+        owner, attribute, original = __patched__.pop()
+        setattr(owner, attribute, original)
+
+
+@contextmanager
+def instrumented(allocations: bool = False):
+    """
+    Count calls of TARGETS (and constructors of ALLOCATIONS if allocations) inside the block.
+
+    :return: Report filled while the block runs
+    """
+    report = Report()
+    if not __reports__:
+        __patch__(TARGETS + (ALLOCATIONS if allocations else ()))
+    __reports__.append(report)
+    try:
+        yield report
+    finally:
+        __reports__.remove(report)
+        if not __reports__:
+            __unpatch__()
+
+
+def test():
+    from tools.tparsing import BaseParser
+    from tools.types import type_add, numbers
+    from tools.walgo import WAlgorithm
+    import tools.utils
+
+    parser_ = BaseParser()
+    exp = parser_.parse("{0} {1} {1}".format(type_add, numbers[3]))
+
+    print("Testing reduction is counted")
+    original = tools.utils.substitution
+    with instrumented(allocations=True) as report:
+        # a function must be looked up at the call, a reference taken before the block is not instrumented
+        tools.utils.reduction(exp)
+    print(report)
+    counters = report.to_dict()
+    assert counters["utils.reduction"]["calls"] == 1
+    assert counters["utils.__reduction__"]["calls"] > 1
+    assert counters["utils.substitution"]["calls"] > 0
+    assert counters["tstructure.Var.__init__"]["items"] > 0
+    assert counters["utils.__reduction__"]["seconds"] <= counters["utils.reduction"]["seconds"]
+    assert tools.utils.substitution is original
+    print("Passed\n")
+
+    print("Testing nested reports and merging")
+    with instrumented() as outer:
+        WAlgorithm().infer_type(parser_.parse("let id = \\x.x in id id"))
+        with instrumented() as inner:
+            WAlgorithm().infer_type(parser_.parse("\\x.x"))
+    assert outer.to_dict()["walgo.WAlgorithm.infer_type"]["calls"] == 2
+    assert inner.to_dict()["walgo.WAlgorithm.infer_type"]["calls"] == 1
+    assert "tstructure.Var.__init__" not in outer.to_dict()
+    total = Report().merge(outer).merge(inner.to_dict())
+    assert total.to_dict()["walgo.WAlgorithm.infer_type"]["calls"] == 3
+    assert json.loads(total.to_json()) == total.to_dict()
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
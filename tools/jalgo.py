@@ -0,0 +1,213 @@
+"""
+    Algorithm J: Hindley-Milner inference with one mutable solution store.
+    Unification updates the store in place, so there are no substitutions to compose.
+    Results have the same form as the results of WAlgorithm.
+"""
+from tools.equations import Equation
+from tools.tstructure import *
+from tools.unification import TypeStore
+
+__VISIT__ = 0
+__BUILD__ = 1
+__BODY__ = 2
+
+
+class Scheme:
+    """
+        Type scheme of let-bound variable: body node with quantified root nodes.
+        Quantified variables are deeper than level, so any subtype with level <= level has none of them.
+    """
+
+    def __init__(self, vars: list, body: int, level: int):
+        self.vars = vars
+        self.body = body
+        self.level = level
+
+
+class JAlgorithm:
+    def __init__(self):
+        self.last_number = 0
+        self.defined_variables = {}
+        self.inst = []
+        self.level = 0
+        self.store = TypeStore()
+        self.type_nodes = []
+        self.instances = []
+
+    def get_new_type(self) -> int:
+        """
+        Produce new type as a variable that do not satisfy grammar.
+        :return: node of new type
+        """
+        self.last_number += 1
+        node = self.store.new_var("type" + str(self.last_number), self.level)
+        self.type_nodes.append(node)
+        return node
+
+    def __generalize__(self, node: int) -> Scheme:
+        """
+        Quantify all variables of given type created deeper than the current let.
+        """
+        return Scheme(self.store.generalize(node, self.level), node, self.level)
+
+    def __instantiate__(self, scheme: Scheme) -> int:
+        """
+        Copy body of given scheme replacing quantified variables with new types.
+        """
+        return self.store.instantiate(scheme.vars, scheme.body, scheme.level, self.get_new_type)
+
+    def __infer_type__(self, exp: Expression) -> int:
+        """
+        Infer the type of given expression, unifying in self.store while traversing.
+        :param exp: given expression
+        :return: node of inferred type
+        """
+        store = self.store
+        scope = {}
+        results = []
+        stack = [(__VISIT__, exp, None)]
+        while stack:
+            task, cur, extra = stack.pop()
+            if task == __VISIT__:
+                if isinstance(cur, Var):
+                    bound = scope.get(cur.name)
+                    if bound:
+                        if isinstance(bound[-1], Scheme):
+                            node = self.__instantiate__(bound[-1])
+                            if len(bound[-1].vars) > 0:
+                                self.instances.append((cur.name, node))
+                            results.append(node)
+                        else:
+                            results.append(bound[-1])
+                    else:
+                        new_type = self.get_new_type()
+                        self.defined_variables[TVar(cur.name)] = new_type
+                        results.append(new_type)
+
+                elif isinstance(cur, Applique):
+                    stack.append((__BUILD__, cur, None))
+                    stack.append((__VISIT__, cur.right, None))
+                    stack.append((__VISIT__, cur.left, None))
+
+                elif isinstance(cur, Abstraction):
+                    betta = self.get_new_type()
+                    self.defined_variables[TVar(cur.variable.name)] = betta
+                    scope.setdefault(cur.variable.name, []).append(betta)
+                    stack.append((__BUILD__, cur, betta))
+                    stack.append((__VISIT__, cur.expression, None))
+
+                else:
+                    assert isinstance(cur, Let)
+                    self.level += 1
+                    stack.append((__BODY__, cur, None))
+                    stack.append((__VISIT__, cur.subst, None))
+
+            elif task == __BODY__:
+                self.level -= 1
+                scope.setdefault(cur.variable.name, []).append(self.__generalize__(results.pop()))
+                stack.append((__BUILD__, cur, None))
+                stack.append((__VISIT__, cur.expression, None))
+
+            elif isinstance(cur, Applique):
+                right = results.pop()
+                left = results.pop()
+                betta = self.get_new_type()
+                store.unify(left, store.impl(right, betta))
+                results.append(betta)
+
+            elif isinstance(cur, Abstraction):
+                scope[cur.variable.name].pop()
+                results.append(store.impl(extra, results.pop()))
+
+            else:
+                scope[cur.variable.name].pop()
+
+        return results[0]
+
+    def infer_type(self, exp: Expression) -> (dict, TType):
+        """
+        Infer the type of given expression.
+        Throws InconsistentSystemError if expression has no type.
+        :param exp: given expression
+        :return: tuple(context, inferred type) in the same form as WAlgorithm.infer_type
+        """
+        self.last_number = 0
+        self.defined_variables = {}
+        self.inst = []
+        self.level = 0
+        self.store = TypeStore()
+        self.type_nodes = []
+        self.instances = []
+
+        store = self.store
+        node = self.__infer_type__(exp)
+        store.check()
+
+        context = {}
+        for var in self.type_nodes:
+            if store.find(var) != var:
+                context[TVar(store.names[var])] = store.resolve(var)
+        for var in self.defined_variables:
+            context[var] = store.resolve(self.defined_variables[var])
+            self.defined_variables[var] = TVar(store.names[self.defined_variables[var]])
+
+        for name, instance in self.instances:
+            self.inst.append(Equation(TVar(name), store.resolve(instance)))
+
+        return context, store.resolve(node)
+
+
+def test():
+    from tools.canonical import types_equivalent
+    from tools.walgo import WAlgorithm
+    from tools.terrors import InconsistentSystemError
+
+    def test_same(exp: Expression):
+        print("Testing expression: {0}: result must be the same as of W algorithm".format(exp))
+        w_context, w_type = WAlgorithm().infer_type(exp)
+        j_context, j_type = JAlgorithm().infer_type(exp)
+        print("Result is {0}, W algorithm gives {1}".format(j_type, w_type))
+
+        # Compare the result together with types of program variables, so that variables are renamed consistently
+        names = [var for var in w_context if not var.name.startswith("type")]
+        assert names == [var for var in j_context if not var.name.startswith("type")]
+        w_all = w_type
+        j_all = j_type
+        for var in names:
+            w_all = TImpl(w_context[var], w_all)
+            j_all = TImpl(j_context[var], j_all)
+        assert types_equivalent(w_all, j_all)
+        assert len(w_context) == len(j_context)
+        print("Passed\n")
+
+    x = Var("x")
+    y = Var("y")
+    z = Var("z")
+    f = Var("f")
+
+    id = Abstraction(x, x)
+    fst = Abstraction(x, Abstraction(y, x))
+
+    test_same(x)
+    test_same(id)
+    test_same(Applique(x, y))
+    test_same(Applique(fst, id))
+    test_same(Abstraction(f, Abstraction(x, Applique(f, Applique(f, x)))))
+    test_same(Let(Var("id"), id, Applique(Var("id"), y)))
+    test_same(Let(Var("id"), id, Let(Var("fst"), fst, Applique(
+            Applique(Var("fst"), Applique(Var("id"), x)),
+            Applique(Var("id"), y)))))
+    test_same(Abstraction(x, Let(y, x, y)))
+    test_same(Abstraction(x, Let(y, Abstraction(z, Applique(z, x)), Applique(y, id))))
+    test_same(Let(f, fst, Applique(Applique(f, Applique(f, id)), y)))
+
+    print("Testing expression: {0}: expression cannot have a type".format(Abstraction(x, Applique(x, x))))
+    try:
+        JAlgorithm().infer_type(Abstraction(x, Applique(x, x)))
+        assert False
+    except InconsistentSystemError:
+        print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,345 @@
+"""
+    Persistent (immutable) map based on a hash array mapped trie.
+    Every update returns a new map sharing all untouched nodes with the old one,
+    so extending a context costs O(log n) instead of copying it.
+"""
+
+__BITS__ = 5
+__MASK__ = (1 << __BITS__) - 1
+__HASH_BITS__ = 64
+
+
+class __Node__:
+    """
+        Node of the trie. Entries are ordered by bit in bitmap, each entry is
+        a leaf tuple(hash, key, value), another __Node__ or a __Collision__.
+    """
+    __slots__ = ("bitmap", "entries")
+
+    def __init__(self, bitmap: int, entries: tuple):
+        self.bitmap = bitmap
+        self.entries = entries
+
+
+class __Collision__:
+    """
+        Leaves with equal hashes: tuple of tuple(hash, key, value).
+    """
+    __slots__ = ("hash", "leaves")
+
+    def __init__(self, hash: int, leaves: tuple):
+        self.hash = hash
+        self.leaves = leaves
+
+
+def __key_hash__(key) -> int:
+    return hash(key) & ((1 << __HASH_BITS__) - 1)
+
+
+def __position__(bitmap: int, bit: int) -> int:
+    return bin(bitmap & (bit - 1)).count("1")
+
+
+def __merge__(shift: int, leaf1: tuple, leaf2: tuple):
+    """
+    Produce node containing two leaves with different keys.
+    """
+    if shift >= __HASH_BITS__:
+        return __Collision__(leaf1[0], (leaf1, leaf2))
+
+    bit1 = 1 << ((leaf1[0] >> shift) & __MASK__)
+    bit2 = 1 << ((leaf2[0] >> shift) & __MASK__)
+    if bit1 == bit2:
+        return __Node__(bit1, (__merge__(shift + __BITS__, leaf1, leaf2),))
+    elif bit1 < bit2:
+        return __Node__(bit1 | bit2, (leaf1, leaf2))
+    else:
+        return __Node__(bit1 | bit2, (leaf2, leaf1))
+
+
+def __insert__(node, shift: int, leaf: tuple) -> (object, bool):
+    """
+    Insert leaf into given node.
+
+    :return: tuple(new node, True if the key was not in the node)
+    """
+    if isinstance(node, __Collision__):
+        for i in range(len(node.leaves)):
+            if node.leaves[i][1] == leaf[1]:
+                return __Collision__(node.hash, node.leaves[:i] + (leaf,) + node.leaves[i + 1:]), False
+        return __Collision__(node.hash, node.leaves + (leaf,)), True
+
+    bit = 1 << ((leaf[0] >> shift) & __MASK__)
+    index = __position__(node.bitmap, bit)
+    entries = node.entries
+    if not node.bitmap & bit:
+        return __Node__(node.bitmap | bit, entries[:index] + (leaf,) + entries[index:]), True
+
+    entry = entries[index]
+    if isinstance(entry, tuple):
+        if entry[1] == leaf[1]:
+            if entry[2] is leaf[2]:
+                return node, False
+            new_entry, added = leaf, False
+        else:
+            new_entry, added = __merge__(shift + __BITS__, entry, leaf), True
+    else:
+        new_entry, added = __insert__(entry, shift + __BITS__, leaf)
+        if new_entry is entry:
+            return node, False
+
+    return __Node__(node.bitmap, entries[:index] + (new_entry,) + entries[index + 1:]), added
+
+
+def __remove__(node, shift: int, hash: int, key) -> (object, bool):
+    """
+    Remove key from given node.
+
+    :return: tuple(new node or None if the node became empty or a leaf if only one leaf left, True if removed)
+    """
+    if isinstance(node, __Collision__):
+        for i in range(len(node.leaves)):
+            if node.leaves[i][1] == key:
+                leaves = node.leaves[:i] + node.leaves[i + 1:]
+                if len(leaves) == 1:
+                    return leaves[0], True
+                return __Collision__(node.hash, leaves), True
+        return node, False
+
+    bit = 1 << ((hash >> shift) & __MASK__)
+    if not node.bitmap & bit:
+        return node, False
+
+    index = __position__(node.bitmap, bit)
+    entries = node.entries
+    entry = entries[index]
+    if isinstance(entry, tuple):
+        if entry[1] != key:
+            return node, False
+        new_entry = None
+    else:
+        new_entry, removed = __remove__(entry, shift + __BITS__, hash, key)
+        if not removed:
+            return node, False
+
+    if new_entry is None:
+        if len(entries) == 1:
+            return None, True
+        if len(entries) == 2 and shift > 0 and isinstance(entries[1 - index], tuple):
+            return entries[1 - index], True
+        return __Node__(node.bitmap & ~bit, entries[:index] + entries[index + 1:]), True
+
+    if isinstance(new_entry, tuple) and len(entries) == 1 and shift > 0:
+        return new_entry, True
+    return __Node__(node.bitmap, entries[:index] + (new_entry,) + entries[index + 1:]), True
+
+
+def __leaves__(node):
+    """
+    Iterate over all leaves of given node.
+    """
+    stack = [node]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, __Collision__):
+            yield from cur.leaves
+        else:
+            for entry in reversed(cur.entries):
+                if isinstance(entry, tuple):
+                    yield entry
+                else:
+                    stack.append(entry)
+
+
+def __map__(node, func):
+    """
+    Apply func to all values of given node. Subtrees with unchanged values are shared.
+    """
+    if isinstance(node, __Collision__):
+        leaves = tuple((leaf[0], leaf[1], func(leaf[2])) for leaf in node.leaves)
+        if all(new[2] is old[2] for new, old in zip(leaves, node.leaves)):
+            return node
+        return __Collision__(node.hash, leaves)
+
+    changed = False
+    entries = []
+    for entry in node.entries:
+        if isinstance(entry, tuple):
+            value = func(entry[2])
+            if value is not entry[2]:
+                entry = (entry[0], entry[1], value)
+                changed = True
+        else:
+            new_entry = __map__(entry, func)
+            if new_entry is not entry:
+                entry = new_entry
+                changed = True
+        entries.append(entry)
+
+    return __Node__(node.bitmap, tuple(entries)) if changed else node
+
+
+class PersistentMap:
+    """
+        Immutable dictionary. set, remove and map_values return new maps.
+    """
+    __slots__ = ("root", "size")
+
+    def __init__(self, items: dict = None):
+        self.root = __Node__(0, ())
+        self.size = 0
+        if items is not None:
+            for key in items:
+                self.root, added = __insert__(self.root, 0, (__key_hash__(key), key, items[key]))
+                self.size += added
+
+    @staticmethod
+    def __make__(root, size: int) -> 'PersistentMap':
+        result = PersistentMap()
+        result.root = root
+        result.size = size
+        return result
+
+    def get(self, key, default=None):
+        h = __key_hash__(key)
+        node = self.root
+        shift = 0
+        while True:
+            if isinstance(node, __Collision__):
+                for leaf in node.leaves:
+                    if leaf[1] == key:
+                        return leaf[2]
+                return default
+
+            bit = 1 << ((h >> shift) & __MASK__)
+            if not node.bitmap & bit:
+                return default
+            entry = node.entries[__position__(node.bitmap, bit)]
+            if isinstance(entry, tuple):
+                return entry[2] if entry[1] == key else default
+            node = entry
+            shift += __BITS__
+
+    def __getitem__(self, key):
+        result = self.get(key, __Node__)
+        if result is __Node__:
+            raise KeyError(key)
+        return result
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, __Node__) is not __Node__
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for leaf in __leaves__(self.root):
+            yield leaf[1]
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for leaf in __leaves__(self.root):
+            yield leaf[2]
+
+    def items(self):
+        for leaf in __leaves__(self.root):
+            yield leaf[1], leaf[2]
+
+    def set(self, key, value) -> 'PersistentMap':
+        """
+        Produce map where key is bound to value (shadowing the old value).
+        """
+        root, added = __insert__(self.root, 0, (__key_hash__(key), key, value))
+        if root is self.root:
+            return self
+        return PersistentMap.__make__(root, self.size + added)
+
+    def remove(self, key) -> 'PersistentMap':
+        """
+        Produce map without given key.
+        """
+        root, removed = __remove__(self.root, 0, __key_hash__(key), key)
+        if not removed:
+            return self
+        if root is None:
+            root = __Node__(0, ())
+        return PersistentMap.__make__(root, self.size - 1)
+
+    def map_values(self, func) -> 'PersistentMap':
+        """
+        Produce map with func applied to every value. Values for which func returns the same object are shared.
+        """
+        root = __map__(self.root, func)
+        if root is self.root:
+            return self
+        return PersistentMap.__make__(root, self.size)
+
+    def __eq__(self, other):
+        if not isinstance(other, PersistentMap) or len(self) != len(other):
+            return False
+        for key, value in self.items():
+            if key not in other or other[key] != value:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return "{" + ", ".join("{0}: {1}".format(key, value) for key, value in self.items()) + "}"
+
+
+def test():
+    import random
+
+    print("!!!Testing persistent map...\n")
+
+    class BadHash:
+        """
+            Key with a lot of collisions
+        """
+
+        def __init__(self, value: int):
+            self.value = value
+
+        def __hash__(self):
+            return self.value % 3
+
+        def __eq__(self, other):
+            return isinstance(other, BadHash) and self.value == other.value
+
+    for make_key in (lambda i: i, lambda i: "x" + str(i), BadHash):
+        rnd = random.Random(0)
+        model = {}
+        current = PersistentMap()
+        versions = []
+        for step in range(2000):
+            key = make_key(rnd.randrange(300))
+            if rnd.random() < 0.7:
+                model[key] = step
+                current = current.set(key, step)
+            else:
+                model.pop(key, None)
+                current = current.remove(key)
+            if step % 100 == 0:
+                versions.append((dict(model), current))
+
+        for expected, version in versions:
+            assert len(version) == len(expected)
+            assert dict(version.items()) == expected
+            for key in expected:
+                assert version[key] == expected[key]
+            assert make_key(1000) not in version
+
+    print("Testing sharing of unchanged values")
+    base = PersistentMap({"a": 1, "b": 2})
+    assert base.map_values(lambda x: x) is base
+    assert dict(base.map_values(lambda x: x * 10).items()) == {"a": 10, "b": 20}
+    assert dict(base.set("a", 3).items()) == {"a": 3, "b": 2} and base["a"] == 1
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,147 @@
+"""
+    Type schemes compiled into instantiation templates.
+    A scheme @a1...an.T is compiled once into a postfix program over T where quantified variables
+    are indexed by position and subtypes without them are kept as constants,
+    so every instantiation is a single copy of the quantified part of T.
+"""
+from tools.tstructure import *
+
+
+class TypeScheme:
+    """
+        Scheme @vars.type where type has no quantifiers.
+        free is the set of names of free variables of the scheme.
+    """
+
+    def __init__(self, vars: list, type: TType):
+        self.vars = vars
+        self.type = type
+        self.free = set()
+        self.template = TypeScheme.__compile__(vars, type, self.free)
+
+    @staticmethod
+    def __compile__(vars: list, type: TType, free: set) -> list:
+        """
+        Produce postfix program building type: int i - i-th new variable,
+        None - implication of two topmost types, TType - constant subtype.
+
+        :param vars: quantified variables
+        :param type: body of the scheme
+        :param free: set to fill with names of free variables
+        :return: program
+        """
+        index = {}
+        for i in range(len(vars)):
+            index[vars[i].name] = i
+
+        # code[id(t)] is the program of t or None if t has no quantified variables
+        code = {}
+        stack = [type]
+        while stack:
+            cur = stack[-1]
+            if id(cur) in code:
+                stack.pop()
+            elif isinstance(cur, TVar):
+                stack.pop()
+                if cur.name in index:
+                    code[id(cur)] = [index[cur.name]]
+                else:
+                    free.add(cur.name)
+                    code[id(cur)] = None
+            elif isinstance(cur, TImpl):
+                if id(cur.left) in code and id(cur.right) in code:
+                    stack.pop()
+                    left = code[id(cur.left)]
+                    right = code[id(cur.right)]
+                    if left is None and right is None:
+                        code[id(cur)] = None
+                    else:
+                        code[id(cur)] = (left or [cur.left]) + (right or [cur.right]) + [None]
+                else:
+                    stack.append(cur.right)
+                    stack.append(cur.left)
+            else:
+                raise Exception("TypeScheme exception: No such type {0}".format(cur))
+
+        return code[id(type)] or [type]
+
+    def instantiate(self, new_type) -> TType:
+        """
+        Produce type of the scheme with quantified variables replaced by new variables.
+
+        :param new_type: function without arguments producing new variable
+        :return: instantiated type
+        """
+        fresh = [new_type() for _ in self.vars]
+        stack = []
+        for op in self.template:
+            if op is None:
+                right = stack.pop()
+                stack[-1] = TImpl(stack[-1], right)
+            elif op.__class__ is int:
+                stack.append(fresh[op])
+            else:
+                stack.append(op)
+        return stack[0]
+
+    def to_type(self) -> TType:
+        """
+        Produce the scheme in the form @a1.@a2...type
+        """
+        result = self.type
+        for var in reversed(self.vars):
+            result = TUni(var, result)
+        return result
+
+    def __eq__(self, other):
+        return isinstance(other, TypeScheme) and self.vars == other.vars and self.type == other.type
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return str(self.to_type())
+
+
+def test():
+    from tools.equations import subst
+
+    def I(t1: TType, t2: TType) -> TImpl:
+        return TImpl(t1, t2)
+
+    a = TVar("a")
+    b = TVar("b")
+    c = TVar("c")
+    counter = [0]
+
+    def new_type() -> TVar:
+        counter[0] += 1
+        return TVar("n" + str(counter[0]))
+
+    def test_instantiate(scheme: TypeScheme):
+        print("Testing instantiation of {0}".format(scheme))
+        counter[0] = 0
+        temp = scheme.instantiate(new_type)
+        expected = scheme.type
+        for i in range(len(scheme.vars)):
+            expected = subst(expected, scheme.vars[i], TVar("n" + str(i + 1)))
+        print("Result is {0}".format(temp))
+        assert temp == expected
+        print("Passed\n")
+
+    constant = I(c, c)
+    test_instantiate(TypeScheme([a], I(a, a)))
+    test_instantiate(TypeScheme([a, b], I(a, I(constant, b))))
+    test_instantiate(TypeScheme([], I(a, b)))
+    test_instantiate(TypeScheme([b], I(a, b)))
+    test_instantiate(TypeScheme([a], b))
+
+    print("Testing sharing of subtypes without quantified variables")
+    scheme = TypeScheme([a], I(a, constant))
+    assert scheme.instantiate(new_type).right is constant
+    assert scheme.free == {"c"}
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
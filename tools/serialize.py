@@ -0,0 +1,415 @@
+"""
+    Compact binary form of expressions (Var, Applique, Abstraction, Let) and types (TVar, TImpl, TUni),
+    much faster to load than parsing of the text and not limited by the recursion limit.
+
+    A stream is MAGIC followed by records, a record is the varint length of its payload and the payload:
+    a flags byte and nodes in post-order, every node is a tag byte, variable nodes and binders are followed
+    by the varint id of the name. A name gets the next id when it first appears in the stream
+    (NAME tag with the varint length and UTF-8 bytes), so the name table is shared by all records of a stream.
+    With sharing on, a subtree that is the same object as an already written one is written as a REF tag
+    with the varint number of that node in the record, variables are written by name instead.
+    A decoded tree has one Var (and one TVar) object for all occurrences of a name in the stream.
+"""
+import gc
+import io
+from itertools import islice
+
+from tools.tstructure import *
+
+MAGIC = b"LTB\x01"
+
+__VAR__ = 0
+__APP__ = 1
+__ABS__ = 2
+__LET__ = 3
+__TVAR__ = 4
+__TIMPL__ = 5
+__TUNI__ = 6
+__NAME__ = 7
+__REF__ = 8
+__NONE__ = 9
+
+# flags of a record
+__SHARED__ = 1
+
+
+def __write_varint__(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def __next_varint__(it, first: int) -> int:
+    """
+    :param it: iterator over bytes of the record
+    :param first: the first byte of the varint, already taken from it
+    :return: value of the varint
+    """
+    result = first & 0x7f
+    shift = 7
+    while True:
+        byte = next(it)
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result
+        shift += 7
+
+
+class Encoder:
+    """
+        Writes records to a binary stream, one record per call of write.
+    """
+
+    def __init__(self, stream, share: bool = False):
+        """
+        :param stream: binary file-like object
+        :param share: write repeated subtrees (the same objects) once
+        """
+        self.stream = stream
+        self.share = share
+        self.names = {}
+        self.stream.write(MAGIC)
+
+    def __name_id__(self, out: bytearray, name: str) -> int:
+        id = self.names.get(name)
+        if id is None:
+            id = self.names[name] = len(self.names)
+            raw = name.encode("utf-8")
+            out.append(__NAME__)
+            __write_varint__(out, len(raw))
+            out += raw
+        return id
+
+    def encode(self, obj) -> bytearray:
+        """
+        :param obj: expression, type or None
+        :return: payload of the record of obj
+        """
+        out = bytearray([__SHARED__ if self.share else 0])
+        # number of written node by id of its object, variables are cheaper to write again than to refer to
+        written = {} if self.share else None
+        count = 0
+        # tuple(node, True if its children are already written)
+        stack = [(obj, False)]
+        while stack:
+            node, ready = stack.pop()
+            if written is not None and not ready and id(node) in written:
+                out.append(__REF__)
+                __write_varint__(out, written[id(node)])
+                continue
+            if node is None:
+                out.append(__NONE__)
+                continue
+            cls = node.__class__
+            if cls is Var or cls is TVar:
+                id_ = self.__name_id__(out, node.name)
+                out.append(__VAR__ if cls is Var else __TVAR__)
+                __write_varint__(out, id_)
+            elif not ready:
+                stack.append((node, True))
+                if cls is Applique or cls is TImpl:
+                    stack.append((node.right, False))
+                    stack.append((node.left, False))
+                elif cls is Abstraction or cls is TUni:
+                    stack.append((node.expression, False))
+                elif cls is Let:
+                    stack.append((node.expression, False))
+                    stack.append((node.subst, False))
+                else:
+                    raise ValueError("Cannot serialize " + str(node))
+                continue
+            elif cls is Applique:
+                out.append(__APP__)
+            elif cls is TImpl:
+                out.append(__TIMPL__)
+            else:
+                variable = node.var if cls is TUni else node.variable
+                id_ = self.__name_id__(out, variable.name)
+                out.append(__ABS__ if cls is Abstraction else __LET__ if cls is Let else __TUNI__)
+                __write_varint__(out, id_)
+            if written is not None:
+                if cls is not Var and cls is not TVar:
+                    written[id(node)] = count
+                count += 1
+        return out
+
+    def write(self, obj):
+        payload = self.encode(obj)
+        length = bytearray()
+        __write_varint__(length, len(payload))
+        self.stream.write(length)
+        self.stream.write(payload)
+
+
+class Decoder:
+    """
+        Reads records of a binary stream written by Encoder.
+    """
+
+    def __init__(self, stream):
+        """
+        :param stream: binary file-like object
+        """
+        self.stream = stream
+        self.names = []
+        # Var and TVar of every name, all occurrences of a variable in decoded trees are the same object
+        self.variables = []
+        self.type_variables = []
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a stream of serialized terms")
+
+    def decode(self, payload: bytes):
+        """
+        :return: expression, type or None of the record with given payload
+        """
+        # trees have no cycles, while collector passes over millions of new nodes take most of the time
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.__decode__(payload)
+        except StopIteration:
+            raise ValueError("Truncated record")
+        finally:
+            if enabled:
+                gc.enable()
+
+    def __decode__(self, payload: bytes):
+        variables = self.variables
+        type_variables = self.type_variables
+        values = []
+        push = values.append
+        pop = values.pop
+        nodes = [] if payload[0] & __SHARED__ else None
+        it = iter(payload)
+        next(it)
+        # tags are checked in order of their frequency in terms
+        for tag in it:
+            if tag == __VAR__:
+                value = next(it)
+                if value >= 0x80:
+                    value = __next_varint__(it, value)
+                node = variables[value]
+            elif tag == __APP__:
+                right = pop()
+                node = Applique(pop(), right)
+            elif tag == __ABS__:
+                value = next(it)
+                if value >= 0x80:
+                    value = __next_varint__(it, value)
+                node = Abstraction(variables[value], pop())
+            elif tag == __TVAR__:
+                value = next(it)
+                if value >= 0x80:
+                    value = __next_varint__(it, value)
+                node = type_variables[value]
+            elif tag == __TIMPL__:
+                right = pop()
+                node = TImpl(pop(), right)
+            elif tag == __LET__:
+                value = next(it)
+                if value >= 0x80:
+                    value = __next_varint__(it, value)
+                expression = pop()
+                node = Let(variables[value], pop(), expression)
+            elif tag == __TUNI__:
+                value = next(it)
+                if value >= 0x80:
+                    value = __next_varint__(it, value)
+                node = TUni(type_variables[value], pop())
+            elif tag == __NAME__:
+                length = next(it)
+                if length >= 0x80:
+                    length = __next_varint__(it, length)
+                raw = bytes(islice(it, length))
+                if len(raw) != length:
+                    raise ValueError("Truncated record")
+                name = raw.decode("utf-8")
+                self.names.append(name)
+                variables.append(Var(name))
+                type_variables.append(TVar(name))
+                continue
+            elif tag == __REF__:
+                value = next(it)
+                if value >= 0x80:
+                    value = __next_varint__(it, value)
+                push(nodes[value])
+                continue
+            elif tag == __NONE__:
+                push(None)
+                continue
+            else:
+                raise ValueError("Unknown tag {0}".format(tag))
+            push(node)
+            if nodes is not None:
+                nodes.append(node)
+        if len(values) != 1:
+            raise ValueError("Invalid record")
+        return values[0]
+
+    def read(self):
+        """
+        :return: object of the next record
+        :raise EOFError: at end of stream
+        """
+        length = 0
+        shift = 0
+        while True:
+            byte = self.stream.read(1)
+            if not byte:
+                if shift == 0:
+                    raise EOFError()
+                raise ValueError("Truncated record")
+            length |= (byte[0] & 0x7f) << shift
+            if byte[0] < 0x80:
+                break
+            shift += 7
+        payload = self.stream.read(length)
+        if len(payload) != length:
+            raise ValueError("Truncated record")
+        return self.decode(payload)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read()
+            except EOFError:
+                return
+
+
+def dumps(obj, share: bool = False) -> bytes:
+    return dumps_all([obj], share)
+
+
+def loads(data: bytes):
+    return Decoder(io.BytesIO(data)).read()
+
+
+def dumps_all(objs, share: bool = False) -> bytes:
+    """
+    :return: stream with one record for each of objs
+    """
+    stream = io.BytesIO()
+    encoder = Encoder(stream, share)
+    for obj in objs:
+        encoder.write(obj)
+    return stream.getvalue()
+
+
+def loads_all(data: bytes) -> list:
+    return list(Decoder(io.BytesIO(data)))
+
+
+def test():
+    import time
+    from collections import Counter
+    from tools.canonical import canonical_expression, canonical_type
+    from tools.instrument import instrumented
+    from tools.traversal import walk
+    from tools.tparsing import BaseParser, BufferParser
+    from tools.types import type_add, type_pow2, numbers
+
+    parser_ = BaseParser()
+
+    def test_round_trip(raw: str):
+        print("Testing round trip of '{0}'".format(raw))
+        exp = parser_.parse(raw)
+        data = dumps(exp)
+        assert str(loads(data)) == str(exp)
+        assert str(loads(dumps(exp, share=True))) == str(exp)
+        print("Passed\n")
+
+    test_round_trip("x")
+    test_round_trip("\\x.\\y.x y z")
+    test_round_trip("let f = \\x.x in f f")
+    test_round_trip(type_pow2)
+
+    print("Testing types")
+    a = TVar("a")
+    t = TUni(a, TImpl(a, TImpl(TVar("b"), a)))
+    assert loads(dumps(t)) == t
+    assert loads(dumps(None)) is None
+    print("Passed\n")
+
+    print("Testing truncated records")
+    for payload in (bytes([0, __NAME__, 5]) + b"ab", bytes([0, __VAR__])):
+        try:
+            Decoder(io.BytesIO(MAGIC)).decode(payload)
+            assert False
+        except ValueError:
+            pass
+    print("Passed\n")
+
+    print("Testing stream of records with common names")
+    stream = io.BytesIO()
+    encoder = Encoder(stream)
+    expressions = [parser_.parse(raw) for raw in ("\\x.x", "\\x.x y", "y")]
+    for exp in expressions:
+        encoder.write(exp)
+    size = len(stream.getvalue())
+    encoder.write(expressions[1])
+    # names are defined once, the second record of "\\x.x y" has only tags and ids
+    assert len(stream.getvalue()) - size == 1 + 1 + 2 + 2 + 1 + 2
+    stream.seek(0)
+    assert [str(exp) for exp in Decoder(stream)] == [str(exp) for exp in expressions + expressions[1:2]]
+    print("Passed\n")
+
+    print("Testing shared subtrees")
+    shared = parser_.parse(type_add)
+    exp = Applique(shared, Applique(shared, shared))
+    # shared subtree is written once, the other two occurrences are references
+    assert len(dumps(exp, share=True)) < len(dumps(shared)) + 8 < len(dumps(exp))
+    decoded = loads(dumps(exp, share=True))
+    assert decoded.left is decoded.right.left and str(decoded) == str(exp)
+    print("Passed\n")
+
+    depth = 100000
+    print("Testing expression of depth {0}".format(depth))
+    deep = Var("y")
+    for i in range(depth):
+        deep = Abstraction(Var("x" + str(i % 7)), Applique(deep, Var("x" + str(i % 5))))
+    assert canonical_expression(loads(dumps(deep))) == canonical_expression(deep)
+    deep_type = a
+    for i in range(depth):
+        deep_type = TImpl(TVar("b"), deep_type)
+    assert canonical_type(loads(dumps(deep_type))) == canonical_type(deep_type)
+    print("Passed\n")
+
+    print("Testing loading is faster than parsing")
+    text = " ".join("({0} {1} {1})".format(type_add, numbers[i % 30]) for i in range(500))
+    exp = BufferParser().parse(text.encode("ascii"))
+    data = dumps(exp)
+
+    def best(func) -> float:
+        times = []
+        for i in range(3):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    base = best(lambda: BaseParser().parse(text))
+    buffer = best(lambda: BufferParser().parse(text.encode("ascii")))
+    load = best(lambda: loads(data))
+    print("text {0} bytes, binary {1} bytes".format(len(text), len(data)))
+    print("BaseParser {0:.4f}s, BufferParser {1:.4f}s, loads {2:.4f}s ({3:.1f} times faster than BaseParser)"
+          .format(base, buffer, load, base / load))
+    assert canonical_expression(loads(data)) == canonical_expression(exp)
+
+    # time depends on the machine, the work does not: one object for every application and abstraction
+    # and one variable for every name, the parser makes a variable for every occurrence too
+    with instrumented(allocations=True) as report:
+        decoded = loads(data)
+    counters = report.to_dict()
+    nodes = Counter(node.__class__ for node in walk(exp))
+    assert counters["tstructure.Applique.__init__"]["calls"] == nodes[Applique]
+    assert counters["tstructure.Abstraction.__init__"]["calls"] == nodes[Abstraction]
+    names = {node.name for node in walk(exp) if isinstance(node, Var)}
+    names |= {node.variable.name for node in walk(exp) if isinstance(node, Abstraction)}
+    assert counters["tstructure.Var.__init__"]["calls"] == len(names)
+    assert nodes[Var] > 10 * counters["tstructure.Var.__init__"]["calls"]
+    assert len(dumps(decoded, share=True)) == len(data)
+    print("Passed\n")
+
+if __name__ == "__main__":
+    test()
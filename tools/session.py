@@ -0,0 +1,118 @@
+"""
+    Incremental type inference for repeatedly checked variants of the same program.
+    Schemes of let-bound expressions are remembered between runs, so after an edit
+    only bindings that changed (and the body) are inferred again.
+"""
+from tools.canonical import canonical_expression, canonical_type
+from tools.persistent import PersistentMap
+from tools.schemes import TypeScheme
+from tools.tstructure import *
+from tools.walgo import WAlgorithm
+
+
+class InferenceSession(WAlgorithm):
+    """
+        WAlgorithm that caches generalized types of let bindings.
+        The key of a binding is the alpha-invariant key of the bound expression together with
+        canonical schemes of its free variables, so a binding is reused only in the same relevant context.
+        Only closed schemes are cached. On a cache hit variables bound inside the binding
+        do not appear in the resulting context and their instantiations are not added to self.inst.
+    """
+
+    def __init__(self):
+        WAlgorithm.__init__(self)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    def __binding_key__(self, gamma: PersistentMap, exp: Expression):
+        """
+        Produce key of the binding or None if it depends on something that is not a closed scheme.
+        """
+        canonical = canonical_expression(exp)
+        context = []
+        for name in sorted(canonical.free):
+            bound = self.__lookup__(gamma, name)
+            if not isinstance(bound, TypeScheme) or len(bound.free) > 0:
+                return None
+            context.append((name, canonical_type(bound.to_type())))
+        return canonical, tuple(context)
+
+    def __infer_binding__(self, gamma: PersistentMap, exp: Expression):
+        key = self.__binding_key__(gamma, exp)
+        if key is None:
+            self.uncacheable += 1
+            return (yield from WAlgorithm.__infer_binding__(self, gamma, exp))
+
+        scheme = self.cache.get(key)
+        if scheme is not None:
+            self.hits += 1
+            return (), scheme
+
+        self.misses += 1
+        s1, scheme = yield from WAlgorithm.__infer_binding__(self, gamma, exp)
+        if len(scheme.free) == 0:
+            self.cache[key] = scheme
+        return s1, scheme
+
+    def stats(self) -> dict:
+        """
+        Statistics of the cache since the session was created.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "entries": len(self.cache)
+        }
+
+    def clear(self):
+        """
+        Forget all cached bindings and statistics.
+        """
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+
+def test():
+    from tools.canonical import types_equivalent
+
+    def program(body: Expression) -> Expression:
+        # let id = \x.x in let fst = \x.\y.x in let k = fst id in body
+        return Let(Var("id"), Abstraction(Var("x"), Var("x")),
+                   Let(Var("fst"), Abstraction(Var("x"), Abstraction(Var("y"), Var("x"))),
+                       Let(Var("k"), Applique(Var("fst"), Var("id")), body)))
+
+    bodies = [
+        Applique(Var("id"), Var("id")),
+        Applique(Applique(Var("k"), Var("z")), Var("z")),
+        Applique(Var("fst"), Var("k")),
+        Abstraction(Var("a"), Let(Var("b"), Var("a"), Applique(Var("id"), Var("b"))))
+    ]
+
+    session = InferenceSession()
+    for body in bodies:
+        exp = program(body)
+        print("Testing expression: {0}: result must be the same as without session".format(exp))
+        context, t = session.infer_type(exp)
+        expected_context, expected = WAlgorithm().infer_type(exp)
+        print("Result is {0}".format(t))
+        assert types_equivalent(t, expected)
+        print("Passed\n")
+
+    print("Testing statistics {0}".format(session.stats()))
+    # Prelude of three bindings is inferred once, b depends on a monotype and is never cached
+    assert session.stats() == {"hits": 9, "misses": 3, "uncacheable": 1, "entries": 3}
+    print("Passed\n")
+
+    print("Testing alpha-equivalent prelude")
+    session.infer_type(Let(Var("f"), Abstraction(Var("q"), Var("q")), Applique(Var("f"), Var("f"))))
+    assert session.stats()["hits"] == 10
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
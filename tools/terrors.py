@@ -11,3 +11,8 @@ class VariableIsNotFreeError(Exception):
 class InconsistentSystemError(Exception):
     def __init__(self, message: str):
         Exception.__init__(self, "Inconsistent system of equations. Error occurred: {0}".format(message))
+
+
+class ReductionLimitError(Exception):
+    def __init__(self, steps: int):
+        Exception.__init__(self, "Normal form is not reached in {0} steps of reduction".format(steps))
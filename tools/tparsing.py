@@ -1,6 +1,12 @@
 """
     Parser that match grammar of first homework
 """
+import io
+import mmap
+import os
+import re
+import stat
+
 from tools.terrors import *
 from tools.tstructure import *
 from tools.types import *
@@ -184,6 +190,152 @@ class BaseParser:
             print(err)
 
 
+# kinds of frames of BufferParser: the expression ends at end of buffer, at ")",
+# is a body of abstraction, a let-bound expression (ends at "in") or a body of let
+__TOP__ = 0
+__PAREN__ = 1
+__ABS__ = 2
+__LET_BOUND__ = 3
+__LET_BODY__ = 4
+
+__SPACE__ = rb"[ \t\r\n\f\v]*"
+# optional whitespaces and then a name (group 1) or any other symbol (group 2)
+__TOKEN__ = re.compile(__SPACE__ + rb"(?:([a-z][a-z0-9']*)|([^ \t\r\n\f\v]))")
+__KEYWORDS__ = (b"let", b"in")
+
+
+class BufferParser:
+    """
+        Parser of the grammar of BaseParser that reads a bytes-like buffer (bytes, bytearray, mmap) by offsets,
+        so an expression may span any number of lines and is never copied into a str.
+        It is iterative, depth of expression is not limited by the recursion limit.
+        "let" and "in" are keywords, so a let-bound expression may contain let too.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        # names of variables by their bytes, equal names share one str
+        self.names = {}
+
+    def __invalid_expression_error__(self, id: int) -> InvalidExpressionError:
+        chunk = bytes(self.buffer[id: min(id + 5, len(self.buffer))]).decode("utf-8", "replace")
+        return InvalidExpressionError("Starting from index: {0}".format(id) + ", Chunk is: '" + chunk + "'")
+
+    def __intern__(self, raw: bytes) -> str:
+        name = self.names.get(raw)
+        if name is None:
+            name = self.names[raw] = raw.decode("ascii")
+        return name
+
+    def __variable__(self, index: int) -> (Var, int):
+        """
+        :return: tuple(variable starting from index (after whitespaces), index after it)
+        """
+        token = __TOKEN__.match(self.buffer, index)
+        if token is None or token.group(1) is None or token.group(1) in __KEYWORDS__:
+            raise self.__invalid_expression_error__(index)
+        return Var(self.__intern__(token.group(1))), token.end()
+
+    def __expect__(self, index: int, symbol: bytes) -> int:
+        """
+        :return: index after symbol starting from index (after whitespaces)
+        """
+        token = __TOKEN__.match(self.buffer, index)
+        if token is None or token.group(2) != symbol:
+            raise self.__invalid_expression_error__(index)
+        return token.end()
+
+    def parse(self, buffer) -> Expression:
+        """
+        Parse the whole buffer as one expression.
+
+        :param buffer: bytes-like object with expression in ASCII
+        :return: parsed expression
+        :raise InvalidExpressionError: if buffer does not hold an expression
+        """
+        self.buffer = buffer
+        match = __TOKEN__.match
+        index = 0
+        # frames [kind, application parsed so far or None, variable, let-bound expression]
+        stack = [[__TOP__, None, None, None]]
+        try:
+            while True:
+                token = match(buffer, index)
+                frame = stack[-1]
+                name = symbol = None
+                if token is not None:
+                    name, symbol = token.groups()
+
+                if name is not None and name != b"in":
+                    index = token.end()
+                    if name == b"let":
+                        variable, index = self.__variable__(index)
+                        index = self.__expect__(index, b"=")
+                        stack.append([__LET_BOUND__, None, variable, None])
+                    else:
+                        var = Var(self.__intern__(name))
+                        frame[1] = var if frame[1] is None else Applique(frame[1], var)
+                    continue
+                if symbol == b"(":
+                    index = token.end()
+                    stack.append([__PAREN__, None, None, None])
+                    continue
+                if symbol == b"\\":
+                    variable, index = self.__variable__(token.end())
+                    index = self.__expect__(index, b".")
+                    stack.append([__ABS__, None, variable, None])
+                    continue
+
+                # end of the current expression: ")", "in" or end of buffer
+                position = len(buffer) if token is None else token.end() - len(name or symbol)
+                if (symbol is not None and symbol != b")") or frame[1] is None:
+                    raise self.__invalid_expression_error__(position)
+                kind = frame[0]
+                if kind == __ABS__:
+                    # body of abstraction is as long as possible, the terminator also ends the enclosing frame
+                    value = Abstraction(frame[2], frame[1])
+                elif kind == __LET_BODY__:
+                    value = Let(frame[2], frame[3], frame[1])
+                elif kind == __PAREN__ and symbol is not None:
+                    index = token.end()
+                    value = frame[1]
+                elif kind == __LET_BOUND__ and name is not None:
+                    index = token.end()
+                    frame[:] = [__LET_BODY__, None, frame[2], frame[1]]
+                    continue
+                elif kind == __TOP__ and token is None:
+                    return frame[1]
+                else:
+                    raise self.__invalid_expression_error__(position)
+
+                stack.pop()
+                parent = stack[-1]
+                parent[1] = value if parent[1] is None else Applique(parent[1], value)
+        finally:
+            self.buffer = b""
+
+
+def parse_file(input_file) -> Expression:
+    """
+    Parse the whole input_file (text or binary, any number of lines) as one expression by BufferParser.
+    A regular file is memory-mapped instead of being read.
+
+    :raise InvalidExpressionError: if the file does not hold an expression
+    """
+    try:
+        info = os.fstat(input_file.fileno())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        info = None
+    if info is not None and stat.S_ISREG(info.st_mode) and info.st_size > 0:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return BufferParser().parse(buffer)
+
+    data = input_file.buffer.read() if hasattr(input_file, "buffer") else input_file.read()
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return BufferParser().parse(data)
+
+
 def test():
     parser_ = BaseParser()
 
@@ -242,6 +394,62 @@ def test():
 
     test_stability(type_minus, "Minus")
 
+    print("!!!Testing buffer parser...\n")
+    buffer_parser = BufferParser()
+
+    def test_buffer(raw: str, result: str = None):
+        print("Testing buffer '{0}'".format(raw))
+        parsed_ = str(buffer_parser.parse(raw.encode("ascii")))
+        expected = result if result is not None else str(parser_.parse(raw))
+        print("Result of work is: '{0}'".format(parsed_))
+        assert parsed_ == expected
+        print("Passed\n")
+
+    def test_invalid(raw: str):
+        print("Testing buffer '{0}' is invalid".format(raw))
+        try:
+            buffer_parser.parse(raw.encode("ascii"))
+            assert False
+        except InvalidExpressionError as err:
+            print(err)
+        print("Passed\n")
+
+    test_buffer("x \\x.x")
+    test_buffer("\\a.\\b.a b c (\\d.e \\f.g) h")
+    test_buffer("\\ a  . \\b  .   ( (   ( a  ) )   ) (  b )  c     (  \\ d . e   \\ f .  g )   h")
+    test_buffer("let a=(\\a.(a b)) in (let a=a in b)")
+    for standard in (type_true, type_not, numbers[3], type_is_even, type_add, type_pow2, type_minus):
+        test_buffer(standard)
+    test_buffer("let f = let g = \\x.x in g g in\n  f\r\n\tf", "(let f=(let g=(\\x.x) in (g g)) in (f f))")
+    test_buffer("a \\x.x let y = x in y", "(a (\\x.(x (let y=x in y))))")
+    test_buffer("inx letter", "(inx letter)")
+    test_invalid("")
+    test_invalid("(a b")
+    test_invalid("a b)")
+    test_invalid("\\in.in")
+    test_invalid("let x = a b")
+    test_invalid("a in b")
+
+    depth = 100000
+    print("Testing memory-mapped file with expression of depth {0} on {0} lines".format(depth))
+    import tempfile
+    from tools.canonical import canonical_expression
+    with tempfile.TemporaryFile() as file:
+        file.write(b"\\x.\n" * depth + b"(x\n" * depth + b"y" + b")" * depth)
+        file.seek(0)
+        parsed = parse_file(file)
+    expected = Var("y")
+    for i in range(depth):
+        expected = Applique(Var("x"), expected)
+    for i in range(depth):
+        expected = Abstraction(Var("x"), expected)
+    assert canonical_expression(parsed) == canonical_expression(expected)
+    print("Passed\n")
+
+    print("Testing text stream")
+    assert str(parse_file(io.StringIO("(\\x.\nx)\n y\n"))) == "((\\x.x) y)"
+    print("Passed\n")
+
 
 if __name__ == "__main__":
     test()
@@ -0,0 +1,384 @@
+"""
+    Iterative traversals of expressions, types and constraints with handlers chosen by class of node.
+    Nothing here recurses, so trees of any depth are walked without hitting the recursion limit.
+
+    walk         - nodes in pre-order,
+    fold         - bottom-up: value of a node is computed from values of its children,
+    traverse     - as fold, but a node also decides which children (and with which inherited state)
+                   are visited, handlers run in pre-order on the way down and in post-order on the way up,
+    replace_first - find the first node in post-order that a function rewrites and rebuild its ancestors,
+    run          - handlers are generators that ask for values of children one by one,
+                   for walkers whose next child depends on the value of the previous one.
+"""
+from types import GeneratorType
+
+from tools.tstructure import *
+
+# children of every kind of node, left to right
+CHILDREN = {
+    Var: lambda node: (),
+    Applique: lambda node: (node.left, node.right),
+    Abstraction: lambda node: (node.expression,),
+    Let: lambda node: (node.subst, node.expression),
+    TVar: lambda node: (),
+    TImpl: lambda node: (node.left, node.right),
+    TUni: lambda node: (node.expression,),
+    TSigma: lambda node: (node.type,),
+    CRelationL: lambda node: (),
+    CRelationEq: lambda node: (),
+    CAnd: lambda node: (node.left, node.right),
+    CExistence: lambda node: (node.constraint,),
+    CDef: lambda node: (node.constraint,),
+}
+
+# copy of node with other children (in order of CHILDREN)
+REBUILD = {
+    Applique: lambda node, children: Applique(children[0], children[1]),
+    Abstraction: lambda node, children: Abstraction(node.variable, children[0]),
+    Let: lambda node, children: Let(node.variable, children[0], children[1]),
+    TImpl: lambda node, children: TImpl(children[0], children[1]),
+    TUni: lambda node, children: TUni(node.var, children[0]),
+}
+
+
+def __unknown__(node) -> Exception:
+    return Exception("Unknown type of " + str(node))
+
+
+def __handler__(table: dict, node):
+    handler = table.get(node.__class__)
+    if handler is None:
+        raise __unknown__(node)
+    return handler
+
+
+def __pop_values__(values: list, count: int):
+    """
+    :return: the last count values, removed from values
+    """
+    if count == 1:
+        return values.pop(),
+    if count == 2:
+        right = values.pop()
+        return values.pop(), right
+    result = values[len(values) - count:]
+    del values[len(values) - count:]
+    return result
+
+
+def walk(root, children: dict = CHILDREN):
+    """
+    :param children: table class -> function(node) returning children of node
+    :return: generator of nodes of root in pre-order, left to right
+    """
+    stack = [root]
+    pop = stack.pop
+    append = stack.append
+    while stack:
+        node = pop()
+        yield node
+        kids = children.get(node.__class__)
+        if kids is None:
+            raise __unknown__(node)
+        kids = kids(node)
+        count = len(kids)
+        if count == 1:
+            append(kids[0])
+        elif count == 2:
+            append(kids[1])
+            append(kids[0])
+        elif count:
+            stack.extend(reversed(kids))
+
+
+def fold(root, table: dict, children: dict = CHILDREN):
+    """
+    Bottom-up computation over root.
+
+    :param table: table class -> function(node, values of children) returning value of node
+    :param children: table class -> function(node) returning children of node
+    :return: value of root
+    """
+    values = []
+    push = values.append
+    pop = values.pop
+    # nodes to visit, or tuple(node, its function, number of children) whose children are already computed
+    stack = [root]
+    append = stack.append
+    while stack:
+        entry = stack.pop()
+        cls = entry.__class__
+        if cls is tuple:
+            node, function, count = entry
+            if count == 1:
+                push(function(node, (pop(),)))
+            elif count == 2:
+                right = pop()
+                push(function(node, (pop(), right)))
+            else:
+                push(function(node, __pop_values__(values, count)))
+            continue
+        function = table.get(cls)
+        kids = children.get(cls)
+        if function is None or kids is None:
+            raise __unknown__(entry)
+        kids = kids(entry)
+        count = len(kids)
+        if count == 0:
+            push(function(entry, ()))
+        elif count == 1:
+            append((entry, function, 1))
+            append(kids[0])
+        elif count == 2:
+            append((entry, function, 2))
+            append(kids[1])
+            append(kids[0])
+        else:
+            append((entry, function, count))
+            stack.extend(reversed(kids))
+    return pop()
+
+
+def traverse(root, table: dict, state=None):
+    """
+    Walk over root where every node chooses its children.
+
+    :param table: table class -> tuple(enter, leave) or leaf,
+                  enter(node, state) -> tuple(sequence of tuple(child, state of child), data),
+                  leave(node, data, values of the chosen children) -> value of node,
+                  leaf(node, state) -> value of node whose children are never visited.
+                  enter is called in pre-order, so its side effects (e.g. fresh names) happen in pre-order.
+    :param state: state of root
+    :return: value of root
+    """
+    values = []
+    push = values.append
+    pop = values.pop
+    # tuple(node, state) to enter, or list [leave, node, data, number of children] to leave
+    stack = [(root, state)]
+    append = stack.append
+    while stack:
+        entry = stack.pop()
+        if entry.__class__ is list:
+            leave, node, data, count = entry
+            if count == 1:
+                push(leave(node, data, (pop(),)))
+            elif count == 2:
+                right = pop()
+                push(leave(node, data, (pop(), right)))
+            else:
+                push(leave(node, data, __pop_values__(values, count)))
+            continue
+        node, state = entry
+        handlers = table.get(node.__class__)
+        if handlers is None:
+            raise __unknown__(node)
+        if handlers.__class__ is not tuple:
+            push(handlers(node, state))
+            continue
+        enter, leave = handlers
+        kids, data = enter(node, state)
+        count = len(kids)
+        if count == 0:
+            push(leave(node, data, ()))
+        elif count == 1:
+            append([leave, node, data, 1])
+            append(kids[0])
+        elif count == 2:
+            append([leave, node, data, 2])
+            append(kids[1])
+            append(kids[0])
+        else:
+            append([leave, node, data, count])
+            stack.extend(reversed(kids))
+    return pop()
+
+
+def __rebuild__(path: list, result, rebuild: dict):
+    """
+    :param path: frames [node, children, index of the next child] of ancestors, the last child visited
+                 by each of them is replaced
+    :return: copy of the root of path with result in place of the replaced node
+    """
+    while path:
+        parent, kids, index = path.pop()
+        kids = list(kids)
+        kids[index - 1] = result
+        result = __handler__(rebuild, parent)(parent, kids)
+    return result
+
+
+def replace_first(root, rewrite: dict, children: dict = CHILDREN, rebuild: dict = REBUILD,
+                  done: dict = None) -> (bool, object):
+    """
+    Find the first node in post-order (children left to right, then the node) that rewrite changes.
+    Only the ancestors of the rewritten node are copied, the rest of the tree is shared.
+
+    :param rewrite: table class -> function(node) returning new node or None if node is not rewritten,
+                    nodes of other classes are not rewritten
+    :param done: id of node -> node for subtrees where rewrite changes nothing, they are skipped and
+                 the walked ones are added; pass the same dict to repeated calls on the results,
+                 whose shared subtrees are then not walked again (the dict keeps them alive, so ids are not reused)
+    :return: tuple(True if a node was rewritten, resulting tree)
+    """
+    path = []
+    frame = [root, __handler__(children, root)(root), 0]
+    while True:
+        node, kids, index = frame
+        if index < len(kids):
+            frame[2] = index + 1
+            child = kids[index]
+            if done is not None and id(child) in done:
+                continue
+            grandchildren = children.get(child.__class__)
+            if grandchildren is None:
+                raise __unknown__(child)
+            grandchildren = grandchildren(child)
+            if grandchildren:
+                path.append(frame)
+                frame = [child, grandchildren, 0]
+                continue
+            # a leaf is checked without a frame of its own
+            function = rewrite.get(child.__class__)
+            if function is not None:
+                result = function(child)
+                if result is not None:
+                    path.append(frame)
+                    return True, __rebuild__(path, result, rebuild)
+            continue
+        function = rewrite.get(node.__class__)
+        if function is not None:
+            result = function(node)
+            if result is not None:
+                return True, __rebuild__(path, result, rebuild)
+        if done is not None:
+            done[id(node)] = node
+        if not path:
+            return False, root
+        frame = path.pop()
+
+
+def run(root, table: dict, *args):
+    """
+    Walk over root with handlers written as generators: handler(node, *args) yields tuple(child, *args of child)
+    to get the value of the child and returns the value of node (a handler may also be a plain function).
+    Exceptions of a child are thrown into the handler of its parent.
+
+    :param table: table class -> handler
+    :return: value of root
+    """
+    # suspended handlers of ancestors
+    stack = []
+    current = __handler__(table, root)(root, *args)
+    value = None
+    error = None
+    while True:
+        if current.__class__ is GeneratorType:
+            try:
+                if error is not None:
+                    exception, error = error, None
+                    request = current.throw(exception)
+                else:
+                    request = current.send(value)
+                stack.append(current)
+                current = __handler__(table, request[0])(*request)
+                value = None
+                continue
+            except StopIteration as stop:
+                value = stop.value
+            except Exception as exception:
+                if not stack:
+                    raise
+                error = exception
+        else:
+            value = current
+        if not stack:
+            return value
+        current = stack.pop()
+
+
+def test():
+    from tools.tparsing import BufferParser
+
+    parser_ = BufferParser()
+    exp = parser_.parse(b"\\x.x (\\y.y z) w")
+
+    print("Testing walk and fold")
+    assert [str(node) for node in walk(exp) if isinstance(node, Var)] == ["x", "y", "z", "w"]
+    size = fold(exp, dict((cls, lambda node, values: 1 + sum(values)) for cls in (Var, Applique, Abstraction)))
+    assert size == 9
+    print("Passed\n")
+
+    print("Testing traverse with inherited state")
+    # depth of every variable, the subtree of y is not visited
+    depths = []
+    table = {
+        Var: lambda node, depth: depths.append((node.name, depth)),
+        Applique: (lambda node, depth: (((node.left, depth + 1), (node.right, depth + 1)), None),
+                   lambda node, data, values: None),
+        Abstraction: (lambda node, depth: (() if node.variable.name == "y" else ((node.expression, depth + 1),), None),
+                      lambda node, data, values: None),
+    }
+    traverse(exp, table, 0)
+    assert depths == [("x", 3), ("w", 2)]
+    print("Passed\n")
+
+    print("Testing replace_first")
+    changed, result = replace_first(exp, {Var: lambda node: Var("v") if node.name == "z" else None})
+    assert changed and str(result) == "(\\x.((x (\\y.(y v))) w))"
+    assert result.expression.right is exp.expression.right
+    assert replace_first(exp, {Applique: lambda node: None}) == (False, exp)
+    done = {}
+    changed, result = replace_first(exp, {Var: lambda node: Var("v") if node.name == "w" else None}, done=done)
+    # the left part of the body is not changed and is known to have no w
+    assert changed and id(exp.expression.left) in done and id(exp) not in done
+    assert replace_first(result, {Var: lambda node: Var("u") if node.name == "x" else None}, done=done) \
+        == (False, result)
+    changed, result = replace_first(exp, {Abstraction: lambda node: node.expression})
+    assert changed and str(result) == "(\\x.((x (y z)) w))"
+    changed, result = replace_first(Var("z"), {Var: lambda node: Var("v")})
+    assert changed and str(result) == "v"
+    print("Passed\n")
+
+    print("Testing run")
+
+    def size_of_applique(node):
+        left = yield (node.left,)
+        try:
+            right = yield (node.right,)
+        except ValueError:
+            right = 100
+        return 1 + left + right
+
+    def size_of_var(node):
+        if node.name == "w":
+            raise ValueError()
+        return 1
+
+    sizes = {Var: size_of_var, Applique: size_of_applique, Abstraction: lambda node: 1}
+    assert run(parser_.parse(b"a (b c)"), sizes) == 5
+    assert run(parser_.parse(b"a (\\b.c)"), sizes) == 3
+    assert run(parser_.parse(b"a w"), sizes) == 102
+    print("Passed\n")
+
+    depth = 100000
+    print("Testing depth {0}".format(depth))
+    deep = Var("x")
+    for i in range(depth):
+        deep = Abstraction(Var("x"), Applique(deep, Var("y")))
+    assert sum(1 for node in walk(deep)) == 3 * depth + 1
+    assert fold(deep, dict((cls, lambda node, values: 1 + sum(values)) for cls in (Var, Applique, Abstraction))) \
+        == 3 * depth + 1
+
+    def depth_of_abstraction(node):
+        return 1 + (yield (node.expression,))
+
+    def depth_of_applique(node):
+        return max((yield (node.left,)), (yield (node.right,)))
+
+    assert run(deep, {Var: lambda node: 0, Abstraction: depth_of_abstraction, Applique: depth_of_applique}) == depth
+    print("Passed\n")
+
+
+if __name__ == "__main__":
+    test()
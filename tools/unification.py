@@ -0,0 +1,327 @@
+"""
+    Mutable store of types with union-find unification.
+    Types live in the store as integer nodes, unification merges classes of nodes instead of substituting.
+"""
+from tools.terrors import InconsistentSystemError
+from tools.tstructure import *
+
+
+class TypeStore:
+    """
+        Node i is a variable (left[i] is None, names[i] is its name) or an implication left[i] -> right[i].
+        Variables are unified lazily: occurs check happens in check() or when a type is resolved.
+        levels[i] is the let depth a variable was created at (for generalization),
+        for an implication it is an upper bound of levels of its variables.
+    """
+
+    def __init__(self):
+        self.parent = []
+        self.left = []
+        self.right = []
+        self.names = []
+        self.levels = []
+        self.var_nodes = {}
+        self.resolved = {}
+
+    def __len__(self):
+        return len(self.parent)
+
+    def var(self, name: str, level: int = 0) -> int:
+        """
+        Get node of variable with given name, create it at given level if there is no such variable yet.
+        """
+        node = self.var_nodes.get(name)
+        if node is None:
+            node = self.var_nodes[name] = self.new_var(name, level)
+        return node
+
+    def new_var(self, name: str, level: int = 0) -> int:
+        """
+        Create new variable node. It is not registered by name, so names of such variables may repeat.
+        """
+        node = len(self.parent)
+        self.parent.append(node)
+        self.left.append(None)
+        self.right.append(None)
+        self.names.append(name)
+        self.levels.append(level)
+        return node
+
+    def impl(self, left: int, right: int) -> int:
+        """
+        Create node of implication left -> right.
+        """
+        node = len(self.parent)
+        self.parent.append(node)
+        self.left.append(left)
+        self.right.append(right)
+        self.names.append(None)
+        self.levels.append(max(self.levels[self.find(left)], self.levels[self.find(right)]))
+        return node
+
+    def from_type(self, t: TType, level: int = 0) -> int:
+        """
+        Put given type into the store. Variables are shared with other types by name,
+        new ones are created at given level.
+        """
+        encoded = {}
+        stack = [t]
+        while stack:
+            cur = stack[-1]
+            if id(cur) in encoded:
+                stack.pop()
+            elif isinstance(cur, TVar):
+                encoded[id(cur)] = self.var(cur.name, level)
+                stack.pop()
+            elif isinstance(cur, TImpl):
+                if id(cur.left) in encoded and id(cur.right) in encoded:
+                    encoded[id(cur)] = self.impl(encoded[id(cur.left)], encoded[id(cur.right)])
+                    stack.pop()
+                else:
+                    stack.append(cur.left)
+                    stack.append(cur.right)
+            else:
+                raise Exception("from_type exception: No such type {0}".format(cur))
+        return encoded[id(t)]
+
+    def find(self, node: int) -> int:
+        """
+        Representative of the class of given node.
+        """
+        parent = self.parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    def __lower__(self, node: int, level: int):
+        """
+        Lower levels of all variables of given node to the given level.
+        """
+        levels = self.levels
+        stack = [node]
+        while stack:
+            cur = self.find(stack.pop())
+            if levels[cur] > level:
+                levels[cur] = level
+                if self.left[cur] is not None:
+                    stack.append(self.left[cur])
+                    stack.append(self.right[cur])
+
+    def unify(self, a: int, b: int):
+        """
+        Make two nodes equal. An implication is always preferred as representative over a variable.
+        """
+        parent = self.parent
+        left = self.left
+        right = self.right
+        levels = self.levels
+        find = self.find
+        stack = [(a, b)]
+        while stack:
+            a, b = stack.pop()
+            a = find(a)
+            b = find(b)
+            if a == b:
+                continue
+            self.resolved.clear()
+            if left[a] is None:
+                parent[a] = b
+                self.__lower__(b, levels[a])
+            elif left[b] is None:
+                parent[b] = a
+                self.__lower__(a, levels[b])
+            else:
+                # Merge before unifying children, so cyclic types terminate
+                parent[a] = b
+                stack.append((right[a], right[b]))
+                stack.append((left[a], left[b]))
+
+    def generalize(self, node: int, level: int) -> list:
+        """
+        Find variables of given type created deeper than given let level.
+
+        :return: list of quantified variable nodes in order of first occurrence
+        """
+        find = self.find
+        vars = []
+        seen = set()
+        stack = [node]
+        while stack:
+            cur = find(stack.pop())
+            if cur in seen or self.levels[cur] <= level:
+                continue
+            seen.add(cur)
+            if self.left[cur] is None:
+                vars.append(cur)
+            else:
+                stack.append(self.right[cur])
+                stack.append(self.left[cur])
+        return vars
+
+    def instantiate(self, vars: list, body: int, level: int, new_var) -> int:
+        """
+        Copy given type replacing variables from vars (generalized at given level) with new variables.
+        Subtypes without quantified variables are shared, not copied.
+        Throws InconsistentSystemError if the type contains itself.
+
+        :param vars: quantified variable nodes
+        :param body: type node
+        :param level: level the type was generalized at
+        :param new_var: function without arguments producing new variable node
+        :return: node of instantiated type
+        """
+        if len(vars) == 0:
+            return body
+
+        find = self.find
+        copied = {}
+        for var in vars:
+            copied[var] = new_var()
+
+        expanding = set()
+        stack = [find(body)]
+        while stack:
+            cur = stack[-1]
+            if cur in copied:
+                stack.pop()
+            elif self.left[cur] is None or self.levels[cur] <= level:
+                copied[cur] = cur
+                stack.pop()
+            else:
+                left = find(self.left[cur])
+                right = find(self.right[cur])
+                if left in copied and right in copied:
+                    if copied[left] == left and copied[right] == right:
+                        copied[cur] = cur
+                    else:
+                        copied[cur] = self.impl(copied[left], copied[right])
+                    stack.pop()
+                elif cur in expanding:
+                    raise InconsistentSystemError("equation of type x=T and x in T")
+                else:
+                    expanding.add(cur)
+                    stack.append(right)
+                    stack.append(left)
+        return copied[find(body)]
+
+    def rename(self, node: int, name: str):
+        """
+        Give a new name to the variable representing the class of given node,
+        the old name still finds the node through var.
+        """
+        node = self.find(node)
+        assert self.left[node] is None
+        self.names[node] = name
+        self.resolved.clear()
+
+    def check(self):
+        """
+        Occurs check for the whole store.
+        Throws InconsistentSystemError if some type contains itself.
+        """
+        left = self.left
+        right = self.right
+        find = self.find
+        # 0 - not visited, 1 - on stack, 2 - done
+        color = bytearray(len(self.parent))
+        for start in range(len(self.parent)):
+            if color[start] != 0 or find(start) != start:
+                continue
+            color[start] = 1
+            stack = [(start, 0)]
+            while stack:
+                node, child = stack[-1]
+                if left[node] is None or child == 2:
+                    color[node] = 2
+                    stack.pop()
+                    continue
+                stack[-1] = (node, child + 1)
+                next = find(left[node] if child == 0 else right[node])
+                if color[next] == 0:
+                    color[next] = 1
+                    stack.append((next, 0))
+                elif color[next] == 1:
+                    raise InconsistentSystemError("equation of type x=T and x in T")
+
+    def resolve(self, node: int) -> TType:
+        """
+        Build type of given node with all unifications applied. Equal subtypes are shared between results.
+        Throws InconsistentSystemError if the type contains itself.
+        """
+        left = self.left
+        right = self.right
+        names = self.names
+        find = self.find
+        resolved = self.resolved
+        on_stack = set()
+
+        root = find(node)
+        stack = [root]
+        while stack:
+            cur = stack[-1]
+            if cur in resolved:
+                stack.pop()
+            elif left[cur] is None:
+                resolved[cur] = TVar(names[cur])
+                stack.pop()
+            else:
+                l = find(left[cur])
+                r = find(right[cur])
+                if l in resolved and r in resolved:
+                    resolved[cur] = TImpl(resolved[l], resolved[r])
+                    on_stack.discard(cur)
+                    stack.pop()
+                elif cur in on_stack:
+                    raise InconsistentSystemError("equation of type x=T and x in T")
+                else:
+                    on_stack.add(cur)
+                    stack.append(l)
+                    stack.append(r)
+        return resolved[root]
+
+
+def test():
+    def test_unify(pairs: list, t: TType, result: TType):
+        print("Testing unification of {0}: {1} must be {2}".format(
+                ["{0}={1}".format(a, b) for a, b in pairs], t, result))
+        store = TypeStore()
+        for a, b in pairs:
+            store.unify(store.from_type(a), store.from_type(b))
+        store.check()
+        temp = store.resolve(store.from_type(t))
+        print("Result is {0}".format(temp))
+        assert temp == result
+        print("Passed\n")
+
+    def test_inconsistent(pairs: list):
+        print("Testing unification of {0}: system must be inconsistent".format(
+                ["{0}={1}".format(a, b) for a, b in pairs]))
+        store = TypeStore()
+        for a, b in pairs:
+            store.unify(store.from_type(a), store.from_type(b))
+        try:
+            store.check()
+            assert False
+        except InconsistentSystemError:
+            print("Passed\n")
+
+    def I(t1: TType, t2: TType) -> TImpl:
+        return TImpl(t1, t2)
+
+    t0 = TVar("t0")
+    t1 = TVar("t1")
+    t2 = TVar("t2")
+    t3 = TVar("t3")
+
+    test_unify([(I(t0, t1), I(t1, I(t2, t2)))], I(t0, t1), I(I(t2, t2), I(t2, t2)))
+    test_unify([(t0, t1), (t1, t2), (t2, I(t3, t3))], t0, I(t3, t3))
+    test_unify([(t0, t0)], t0, t0)
+    test_inconsistent([(t0, I(t1, t2)), (t1, t0)])
+    test_inconsistent([(I(t0, t0), I(I(t1, t2), t1))])
+
+
+if __name__ == "__main__":
+    test()
@@ -1,7 +1,26 @@
+from tools.explicit import normal_form
 from tools.tparsing import *
+from tools.traversal import fold, traverse, replace_first, CHILDREN
 from tools.types import *
 
 
+def __free_abstraction__(exp: Abstraction, values: list) -> set:
+    answer = values[0]
+    answer.discard(exp.variable.name)
+    return answer
+
+
+def __free_applique__(exp: Applique, values: list) -> set:
+    return values[0].union(values[1])
+
+
+__FREE_VARS__ = {
+    Var: lambda exp, values: {exp.name},
+    Abstraction: __free_abstraction__,
+    Applique: __free_applique__,
+}
+
+
 def get_free_vars(exp: Expression) -> set:
     """
     Method for getting set of free variables from Expression
@@ -9,19 +28,7 @@ def get_free_vars(exp: Expression) -> set:
     :param exp: expression for retrieving free variables
     :return: set of free variables
     """
-    if isinstance(exp, Var):
-        return {exp.name}
-    elif isinstance(exp, Abstraction):
-        answer = get_free_vars(exp.expression)
-        if (exp.variable.name in answer):
-            answer.remove(exp.variable.name)
-        return answer
-    elif isinstance(exp, Applique):
-        left = get_free_vars(exp.left)
-        right = get_free_vars(exp.right)
-        return left.union(right)
-    else:
-        raise Exception("Unknown type of" + str(exp))
+    return fold(exp, __FREE_VARS__)
 
 
 def __subst__(exp: Expression, var_name: str, sub: Expression, free_vars: set, allowed: bool):
@@ -36,7 +43,7 @@ def __subst__(exp: Expression, var_name: str, sub: Expression, free_vars: set, a
     :param allowed: true is substitution allowed
     :return:
     """
-    if isinstance(exp, Var):
+    def leave_var(exp: Var, allowed: bool) -> Expression:
         if exp.name == var_name:
             if allowed:
                 return sub
@@ -44,23 +51,27 @@ def __subst__(exp: Expression, var_name: str, sub: Expression, free_vars: set, a
                 raise VariableIsNotFreeError(var_name + " not free")
         else:
             return exp
-    elif isinstance(exp, Abstraction):
-        if (exp.variable.name == var_name):
+
+    def enter_abstraction(exp: Abstraction, allowed: bool) -> (tuple, None):
+        if exp.variable.name == var_name:
+            return (), None
+        return ((exp.expression, allowed and exp.variable.name not in free_vars),), None
+
+    def leave_abstraction(exp: Abstraction, data, values: list) -> Expression:
+        return Abstraction(exp.variable, values[0]) if values and values[0] is not exp.expression else exp
+
+    def leave_applique(exp: Applique, data, values: list) -> Expression:
+        # unchanged subtrees are shared instead of copied
+        if values[0] is exp.left and values[1] is exp.right:
             return exp
-        else:
-            if exp.variable.name in free_vars:
-                allowed_ = False
-            else:
-                allowed_ = allowed
-
-            return Abstraction(exp.variable, __subst__(exp.expression, var_name, sub, free_vars, allowed_))
-    elif isinstance(exp, Applique):
-        return Applique(
-                __subst__(exp.left, var_name, sub, free_vars, allowed),
-                __subst__(exp.right, var_name, sub, free_vars, allowed)
-        )
-    else:
-        raise Exception("Unknown type of" + str(exp))
+        return Applique(values[0], values[1])
+
+    table = {
+        Var: leave_var,
+        Abstraction: (enter_abstraction, leave_abstraction),
+        Applique: (lambda exp, allowed: (((exp.left, allowed), (exp.right, allowed)), None), leave_applique),
+    }
+    return traverse(exp, table, allowed)
 
 
 def substitution(exp: Expression, var_name: str, sub: Expression) -> Expression:
@@ -77,84 +88,188 @@ def substitution(exp: Expression, var_name: str, sub: Expression) -> Expression:
     return __subst__(exp, var_name, sub, free_vars, True)
 
 
-def __reduction__(exp: Expression) -> (bool, Expression):
+def __beta__(exp: Applique):
+    """
+    :return: result of beta reduction of exp if it is a redex, None otherwise
+    """
+    if exp.left.__class__ is Abstraction:
+        try:
+            return substitution(exp.left.expression, exp.left.variable.name, exp.right)
+        except VariableIsNotFreeError:
+            return None
+    return None
+
+
+# let is not reduced
+__LAMBDA_CHILDREN__ = dict((cls, CHILDREN[cls]) for cls in (Var, Abstraction, Applique))
+__REDEXES__ = {Applique: __beta__}
+
+
+# size of memo of normal subtrees of reduction when it is cleared
+__NORMAL_MEMO_LIMIT__ = 1 << 20
+
+
+def __reduction__(exp: Expression, normal: dict = None) -> (bool, Expression):
     """
     Apply beta reduction in normalized order(left-most) once to given expression
 
     :param exp: given Expression
+    :param normal: subtrees known to be in normal form by id, see replace_first
     :return: tuple(True is reduction occurred,  resulting expression)
     """
-    if isinstance(exp, Var):
-        return False, exp
-    elif isinstance(exp, Abstraction):
-        result = __reduction__(exp.expression)
-        return result[0], Abstraction(exp.variable, result[1])
-    elif isinstance(exp, Applique):
-        left = __reduction__(exp.left)
-        if left[0]:
-            return True, Applique(left[1], exp.right)
-
-        right = __reduction__(exp.right)
-        if right[0]:
-            return True, Applique(exp.left, right[1])
-
-        cur = exp.left
-        if isinstance(cur, Abstraction):
-            try:
-                result = substitution(cur.expression, cur.variable.name, exp.right)
-                return True, result
-            except VariableIsNotFreeError:
-                return False, exp
-        else:
-            return False, exp
+    return replace_first(exp, __REDEXES__, __LAMBDA_CHILDREN__, done=normal)
+
+
+def __substitution_normal_form__(expression: Expression, max_steps: int = None) -> Expression:
+    """
+    Normal form by repeated beta reduction with substitution, see reduction.
+    """
+    expression = rename_all_abstractions(expression)
+    # a step copies only the ancestors of the redex, the shared normal subtrees are not searched again
+    normal = {}
+    temp = __reduction__(expression, normal)
+    steps = 0
+    while temp[0]:
+        steps += 1
+        if max_steps is not None and steps > max_steps:
+            raise ReductionLimitError(max_steps)
+        if len(normal) > __NORMAL_MEMO_LIMIT__:
+            normal.clear()
+        temp = __reduction__(temp[1], normal)
+    return temp[1]
 
 
-def reduction(exp: Expression) -> Expression:
+# engine -> function(expression, max_steps) returning normal form
+REDUCTION_ENGINES = {
+    # every beta reduction copies the body of the abstraction with the argument substituted
+    "substitution": __substitution_normal_form__,
+    # substitutions are pushed down only as far as reduction needs them (tools.explicit), supports let
+    "explicit": normal_form,
+}
+
+
+def reduction(exp: Expression, max_steps: int = None, engine: str = "substitution") -> Expression:
     """
     Produce normalized form of given expression.
     If given expression doesn't have normalized form behavior is unspecified.
+    Throws ReductionLimitError if normal form is not reached in max_steps steps.
 
     :param exp: given Expression
+    :param max_steps: maximal number of beta reductions, None means no limit
+    :param engine: key of REDUCTION_ENGINES
     :return: normalized form of given expression
     """
-    expression = rename_all_abstractions(exp)
-    temp = __reduction__(expression)
-    while temp[0]:
-        temp = __reduction__(temp[1])
+    if engine not in REDUCTION_ENGINES:
+        raise ValueError("Unknown reduction engine " + engine)
+    # free variables of the normal form are among those of exp, so the names are known before reduction
+    return rename_all_abstractions(REDUCTION_ENGINES[engine](exp, max_steps), reserved_names(exp))
+
+
+class __Scope__:
+    """
+        Visited between the bound expression and the body of let: the variable of let is bound in the body only.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
 
-    return rename_all_abstractions(temp[1])
+
+__RESERVED_NAMES__ = {
+    Var: lambda exp, values: {exp.name},
+    Abstraction: __free_abstraction__,
+    Applique: __free_applique__,
+    Let: lambda exp, values: values[0].union(values[1], (exp.variable.name,)),
+}
+
+
+def reserved_names(exp: Expression) -> set:
+    """
+    Names that renaming leaves as they are (free variables and variables of let),
+    so new variables of abstractions must not take them.
+
+    :param exp: given expression
+    :return: set of names in the form they get from __grammar_rename__
+    """
+    return {"t" + name if name[0].isdigit() else name for name in fold(exp, __RESERVED_NAMES__)}
 
 
-def __rename__(exp: Expression, last_var: int = 0) -> (int, Expression):
+def __rename__(exp: Expression, last_var: int = 0, reserved: set = None) -> (int, Expression):
     """
     Rename all variables in given Expression, so that all Abstractions have different variables.
+    New variables skip reserved names, so no free variable is captured.
 
     :param exp: given expression
     :param last_var: last used variable
+    :param reserved: names new variables must not take, reserved_names(exp) if None
     :return: renamed expression
     """
-
-    if isinstance(exp, Var):
+    last = [last_var]
+    if reserved is None:
+        reserved = reserved_names(exp)
+    # new variables of enclosing binders by their old names
+    scope = {}
+
+    def bind(name: str, new_var: Var) -> tuple:
+        previous = scope.get(name)
+        scope[name] = new_var
+        return name, previous
+
+    def unbind(binding: tuple):
+        name, previous = binding
+        if previous is None:
+            del scope[name]
+        else:
+            scope[name] = previous
+
+    def enter_abstraction(exp: Abstraction, state) -> (tuple, tuple):
+        # abstractions are numbered in pre-order
+        last[0] += 1
+        while "t" + str(last[0]) in reserved:
+            last[0] += 1
+        new_var = Var("t" + str(last[0]))
+        return ((exp.expression, None),), (new_var, bind(exp.variable.name, new_var))
+
+    def leave_abstraction(exp: Abstraction, data: tuple, values: list) -> Expression:
+        new_var, binding = data
+        unbind(binding)
+        return Abstraction(new_var, values[0])
+
+    def leave_let(exp: Let, data, values: list) -> Expression:
+        unbind(values[1])
+        return Let(Var(exp.variable.name), values[0], values[2])
+
+    table = {
         # TODO rename to  "t" + exp.name in release version
-        return last_var, Var(exp.name)
-    elif isinstance(exp, Abstraction):
-        new_var = Var("t" + str(last_var + 1))
-        result = __rename__(
-                substitution(exp.expression, exp.variable.name, new_var),
-                last_var + 1
-        )
-
-        return result[0], Abstraction(new_var, result[1])
-    elif isinstance(exp, Applique):
-        left = __rename__(exp.left, last_var)
-        right = __rename__(exp.right, left[0])
+        Var: lambda exp, state: Var(scope.get(exp.name, exp).name),
+        Abstraction: (enter_abstraction, leave_abstraction),
+        Applique: (lambda exp, state: (((exp.left, None), (exp.right, None)), None),
+                   lambda exp, data, values: Applique(values[0], values[1])),
+        Let: (lambda exp, state: (((exp.subst, None), (__Scope__(exp.variable.name), None), (exp.expression, None)),
+                                  None),
+              leave_let),
+        __Scope__: lambda node, state: bind(node.name, Var(node.name)),
+    }
+    result = traverse(exp, table)
+    return last[0], result
+
+
+def __grammar_var__(exp: Var) -> Var:
+    if exp.name[0].isdigit():
+        return Var("t" + exp.name)
+    else:
+        return exp
 
-        return right[0], Applique(left[1], right[1])
 
-    elif isinstance(exp, Let):
-        last, first = __rename__(exp.subst, last_var)
-        last, second = __rename__(exp.expression, last)
-        return last, Let(Var(exp.variable.name), first, second)
+__GRAMMAR_RENAME__ = {
+    Var: lambda exp, state: __grammar_var__(exp),
+    Abstraction: (lambda exp, state: (((exp.expression, None),), None),
+                  lambda exp, data, values: Abstraction(__grammar_var__(exp.variable), values[0])),
+    Applique: (lambda exp, state: (((exp.left, None), (exp.right, None)), None),
+               lambda exp, data, values: Applique(values[0], values[1])),
+    # only the body of let is renamed
+    Let: (lambda exp, state: (((exp.expression, None),), None),
+          lambda exp, data, values: Let(exp.variable, exp.subst, values[0])),
+}
 
 
 # noinspection PyTypeChecker
@@ -165,28 +280,19 @@ def __grammar_rename__(exp: Expression) -> Expression:
     :param exp: given expression
     :return: renamed expression
     """
-    if isinstance(exp, Var):
-        if exp.name[0].isdigit():
-            return Var("t" + exp.name)
-        else:
-            return exp
-    elif isinstance(exp, Abstraction):
-        return Abstraction(__grammar_rename__(exp.variable), __grammar_rename__(exp.expression))
-    elif isinstance(exp, Applique):
-        return Applique(__grammar_rename__(exp.left), __grammar_rename__(exp.right))
-    elif isinstance(exp, Let):
-        return Let(exp.variable, exp.subst, __grammar_rename__(exp.expression))
+    return traverse(exp, __GRAMMAR_RENAME__)
 
 
-def rename_all_abstractions(exp: Expression) -> Expression:
+def rename_all_abstractions(exp: Expression, reserved: set = None) -> Expression:
     """
     Rename all variables in given Expression, so that all Abstractions have different variables.
-    Renamed variables get such names: t1, t2, t3 ...
+    Renamed variables get such names: t1, t2, t3 ... except reserved ones.
 
     :param exp: given expression
+    :param reserved: names renamed variables must not take, reserved_names(exp) if None
     :return: renamed expression
     """
-    return __grammar_rename__(__rename__(exp)[1])
+    return __grammar_rename__(__rename__(exp, reserved=reserved)[1])
 
 
 def test_free_vars():
@@ -377,6 +483,25 @@ def test_reduction():
             parser_.parse(numbers[27])
     )
 
+    print("!!!Testing free variables named as new ones...\n")
+    test_reduction(
+            parser_.parse("(\\x.\\t1.x) t2"),
+            Abstraction(Var("t1"), Var("t2"))
+    )
+
+    print("!!!Testing step limit...\n")
+    print("Test reduction of '(\\x.x x) (\\x.x x)': must stop after 100 steps")
+    try:
+        reduction(parser_.parse("(\\x.x x) (\\x.x x)"), max_steps=100)
+        assert False
+    except ReductionLimitError:
+        print("Passed\n")
+
+    test_reduction(
+            parser_.parse("(\\x.x x x) (a b)"),
+            reduction(parser_.parse("(\\x.x x x) (a b)"), max_steps=1)
+    )
+
 
 def test():
     # test_free_vars()
@@ -1,28 +1,12 @@
+from tools.canonical import types_equivalent
+from tools.persistent import PersistentMap
+from tools.schemes import TypeScheme
+from tools.traversal import walk, run
 from tools.tstructure import *
 from tools.utils import rename_all_abstractions
-from tools.equations import subst, solve_set_of_equations, Equation
+from tools.equations import solve_set_of_equations, Equation
 import time
 
-def __remove_quantifiers__(exp: TType) -> (TType, list):
-    """
-    Produce expression without quantifiers from given expression
-    :param exp: given expression
-    :return: tuple(expression without quantifiers, list of connected variables)
-    """
-    if isinstance(exp, TUni):
-        result = __remove_quantifiers__(exp.expression)
-        result[1].append(exp.var)
-        return result[0], result[1]
-    else:
-        return exp, []
-
-
-def copy(gamma: dict) -> dict:
-    result = {}
-    for key in gamma:
-        result[key] = gamma[key]
-    return result
-
 def __get_free_vars__(t: TType, connected_vars: set) -> set:
     """
     Produce set of all free variables of given type.
@@ -30,18 +14,15 @@ def __get_free_vars__(t: TType, connected_vars: set) -> set:
     :param connected_vars: already connected variables
     :return: set of connected variables
     """
-    if isinstance(t, TVar):
-        if t.name in connected_vars:
-            return set()
-        else:
-            return {t.name}
-    elif isinstance(t, TImpl):
-        s1 = __get_free_vars__(t.left, connected_vars)
-        s2 = __get_free_vars__(t.right, connected_vars)
-        return s1.union(s2)
-    elif isinstance(t, TUni):
-        connected_vars.add(t.var.name)
-        return __get_free_vars__(t.expression, connected_vars)
+    result = set()
+    for cur in walk(t):
+        if cur.__class__ is TVar:
+            if cur.name not in connected_vars:
+                result.add(cur.name)
+        elif cur.__class__ is TUni:
+            # a variable bound once is connected in the rest of the walk
+            connected_vars.add(cur.var.name)
+    return result
 
 
 def get_free_vars(t: TType) -> set:
@@ -58,144 +39,228 @@ class WAlgorithm:
         self.last_number = 0
         self.defined_variables = {}
         self.inst = []
+        self.level = 0
+        self.levels = {}
+        # variable name -> type, applied to types of the context when they are looked up
+        self.substitution = {}
+        # id(scheme of the context) -> tuple(scheme, scheme with the substitution applied)
+        self.schemes = {}
 
     def get_new_type(self) -> TVar:
         """
         Produce new type as a variable that do not satisfy grammar.
+        The variable remembers depth of let it was created at.
         :return: new type
         """
         self.last_number += 1
-        return TVar("type" + str(self.last_number))
+        name = "type" + str(self.last_number)
+        self.levels[name] = self.level
+        return TVar(name)
 
-    @staticmethod
-    def __context_substitution__(s1: dict, s2: dict) -> dict:
+    def __adjust_levels__(self, sub: dict):
         """
-        Produce applying of s1 to gamma
-        :param s1: context
-        :param gamma: context
-        :return: applying of two contexts
+        Variables of a type that replaces x can not be generalized earlier than x.
+        So lower their levels to the level of x.
+        :param sub: substitution produced by unification
         """
-        new_context = copy(s2)
-        for var in new_context.keys():
-            for sub in s1.keys():
-                assert isinstance(sub, TVar)
-                new_context[var] = subst(new_context[var], sub, s1[sub])
-        return new_context
+        for var in sub:
+            level = self.levels.get(var.name, 0)
+            for name in get_free_vars(sub[var]):
+                if self.levels.get(name, 0) > level:
+                    self.levels[name] = level
 
-    @staticmethod
-    def __merge_substitutions__(s1: dict, s2: dict) -> dict:
+    def __resolve__(self, t: TType) -> TType:
         """
-        Merge two contexts (subst and merge)
+        Apply the substitution found so far to the given type.
+        A resolved binding is stored back, so a chain of bindings is followed only once.
+        Shared subtypes are resolved once per call.
+        :param t: given type
+        :return: substituted type
         """
-        new_context = WAlgorithm.__context_substitution__(s1, s2)
-        for var in s1.keys():
-            assert isinstance(var, TVar)
-            new_context[var] = s1[var]
-
-        return new_context
+        substitution = self.substitution
+        if not substitution:
+            return t
+
+        done = {}
+        stack = [t]
+        while stack:
+            cur = stack[-1]
+            if id(cur) in done:
+                stack.pop()
+            elif cur.__class__ is TVar:
+                bound = substitution.get(cur.name)
+                if bound is None:
+                    stack.pop()
+                    done[id(cur)] = cur
+                elif id(bound) in done:
+                    stack.pop()
+                    done[id(cur)] = substitution[cur.name] = done[id(bound)]
+                else:
+                    stack.append(bound)
+            elif cur.__class__ is TImpl:
+                left = done.get(id(cur.left))
+                right = done.get(id(cur.right))
+                if left is not None and right is not None:
+                    stack.pop()
+                    if left is cur.left and right is cur.right:
+                        done[id(cur)] = cur
+                    else:
+                        done[id(cur)] = TImpl(left, right)
+                else:
+                    if right is None:
+                        stack.append(cur.right)
+                    if left is None:
+                        stack.append(cur.left)
+            else:
+                raise Exception("WAlgorithm exception: No such type {0}".format(cur))
+        return done[id(t)]
 
-    @staticmethod
-    def __apply_substitution(s1: dict, t: TType):
+    def __lookup__(self, gamma: PersistentMap, name: str):
         """
-        Apply substitution to the given type
-        :param s1: substitution (context)
-        :param t: given tyoe
-        :return: substituted type
+        Produce the type or scheme of the variable in gamma with the substitution found so far applied.
+        Gamma keeps types as they were when bound, so extending it never touches other entries.
+        :param gamma: context
+        :param name: name of the variable
+        :return: type, scheme or None if the variable is not bound
         """
-        for var in s1:
-            assert isinstance(var, TVar)
-            t = subst(t, var, s1[var])
-        return t
+        bound = gamma.get(TVar(name))
+        if bound is None:
+            return None
+        if not isinstance(bound, TypeScheme):
+            return self.__resolve__(bound)
+
+        # the last resolved version of the scheme, together with the scheme to keep its id
+        scheme = self.schemes.get(id(bound), (bound, bound))[1]
+        for var in scheme.free:
+            if var in self.substitution:
+                scheme = TypeScheme(scheme.vars, self.__resolve__(scheme.type))
+                self.schemes[id(bound)] = (bound, scheme)
+                break
+        return scheme
 
     @staticmethod
-    def locking(s1: dict, t: TType) -> TType:
+    def __flatten__(keys: tuple) -> list:
         """
-        Produce @a1.@a2.@a3...t where ai in free(t) and not in free(s1)
-        :param s1: context
-        :param t: given type
-        :return: locked type
+        Produce names of substituted variables in the order of the context.
+        :param keys: () or tuple(first keys, second keys, list of names)
+        :return: list of names
         """
-        context_free_vars = set()
-        for exp in s1.values():
-            context_free_vars.union(get_free_vars(exp))
-
-        exp_free_vars = get_free_vars(t)
-        need_connect = exp_free_vars - context_free_vars
-
-        result = t
-        for var in need_connect:
-            result = TUni(TVar(var), result)
+        result = []
+        stack = [keys]
+        while stack:
+            cur = stack.pop()
+            if cur.__class__ is list:
+                result.extend(cur)
+            elif cur:
+                stack.append(cur[2])
+                stack.append(cur[1])
+                stack.append(cur[0])
         return result
 
-    def __infer_type__(self, gamma: dict, exp: Expression) -> (dict, TType):
+    def locking(self, t: TType) -> TypeScheme:
+        """
+        Produce scheme @a1.@a2.@a3...t where ai in free(t) and ai was created deeper than the current let.
+        Such variables can not be free in the context, so the context is not scanned.
+        :param t: given type
+        :return: locked type compiled for instantiation
+        """
+        need_connect = []
+        seen = set()
+        stack = [t]
+        while stack:
+            cur = stack.pop()
+            if isinstance(cur, TVar):
+                if cur.name not in seen:
+                    seen.add(cur.name)
+                    if self.levels.get(cur.name, 0) > self.level:
+                        need_connect.append(cur.name)
+            elif isinstance(cur, TImpl):
+                stack.append(cur.right)
+                stack.append(cur.left)
+
+        return TypeScheme([TVar(var) for var in need_connect], t)
+
+    def __infer_binding__(self, gamma: PersistentMap, exp: Expression):
+        """
+        Infer the scheme of expression bound by let in given context.
+        A generator for tools.traversal.run: it asks for the type of exp.
+        :param gamma: given context
+        :param exp: bound expression
+        :return: tuple(substituted variables, generalized type)
+        """
+        self.level += 1
+        s1, t1 = yield exp, gamma
+        self.level -= 1
+        return s1, self.locking(t1)
+
+    def __infer_var__(self, exp: Var, gamma: PersistentMap) -> (tuple, TType):
+        bound = self.__lookup__(gamma, exp.name)
+        if bound is not None:
+            if not isinstance(bound, TypeScheme):
+                return (), bound
+            cur_type = bound.instantiate(self.get_new_type)
+            if len(bound.vars) > 0:
+                self.inst.append(Equation(TVar(exp.name), cur_type))
+            return (), cur_type
+
+        new_type = self.get_new_type()
+        self.defined_variables[TVar(exp.name)] = new_type
+        return (), new_type
+
+    def __infer_applique__(self, exp: Applique, gamma: PersistentMap):
+        s1, t1 = yield exp.left, gamma
+        s2, t2 = yield exp.right, gamma
+
+        t3 = self.__resolve__(t1)
+        betta = self.get_new_type()
+        v = solve_set_of_equations([Equation(t3, TImpl(t2, betta)), ])
+        sub_v = {}
+        for equation in v:
+            assert isinstance(equation.left, TVar)
+            sub_v[TVar(equation.left.name)] = equation.right
+        self.__adjust_levels__(sub_v)
+        for var in sub_v:
+            self.substitution[var.name] = sub_v[var]
+
+        # variables of s2, then of s1, then of sub_v: the order of the context
+        s = (s2, s1, [var.name for var in sub_v])
+        return s, self.__resolve__(betta)
+
+    def __infer_abstraction__(self, exp: Abstraction, gamma: PersistentMap):
+        betta = self.get_new_type()
+        self.defined_variables[TVar(exp.variable.name)] = betta
+
+        new_gamma = gamma.set(TVar(exp.variable.name), betta)
+        s1, t1 = yield exp.expression, new_gamma
+        return s1, TImpl(self.__resolve__(betta), t1)
+
+    def __infer_let__(self, exp: Let, gamma: PersistentMap):
+        s1, x_type = yield from self.__infer_binding__(gamma, exp.subst)
+
+        new_gamma = gamma.set(TVar(exp.variable.name), x_type)
+
+        s2, t2 = yield exp.expression, new_gamma
+
+        s = (s1, s2, [])
+        return s, t2
+
+    def __infer_type__(self, gamma: PersistentMap, exp: Expression) -> (tuple, TType):
         """
         Infer the type of given expression in given context.
         So that Subst(gamma)|- exp : type
+        Every substitution is added to self.substitution instead of being applied to gamma,
+        types of gamma are substituted when they are looked up.
         :param gamma: given context
         :param exp: given expression
-        :return: tuple(substitution, inferred type)
+        :return: tuple(substituted variables (see __flatten__), inferred type)
         """
-        if isinstance(exp, Var):
-            if TVar(exp.name) in gamma:
-                cur_type, vars = __remove_quantifiers__(gamma[TVar(exp.name)])
-                for variable in vars:
-                    cur_type = subst(cur_type, variable, self.get_new_type())
-                if len(vars) > 0:
-                    self.inst.append(Equation(TVar(exp.name), cur_type))
-                return {}, cur_type
-
-            new_type = self.get_new_type()
-            self.defined_variables[TVar(exp.name)] = new_type
-            return {}, new_type
-
-        elif isinstance(exp, Applique):
-            s1, t1 = self.__infer_type__(gamma, exp.left)
-            new_gamma = WAlgorithm.__merge_substitutions__(s1, copy(gamma))
-            s2, t2 = self.__infer_type__(new_gamma, exp.right)
-
-            t3 = WAlgorithm.__apply_substitution(s2, t1)
-            betta = self.get_new_type()
-            v = solve_set_of_equations([Equation(t3, TImpl(t2, betta)), ])
-            sub_v = {}
-            for equation in v:
-                assert isinstance(equation.left, TVar)
-                sub_v[TVar(equation.left.name)] = equation.right
-
-            s = WAlgorithm.__merge_substitutions__(
-                sub_v,
-                WAlgorithm.__merge_substitutions__(s1, s2)
-            )
-            return s, WAlgorithm.__apply_substitution(s, betta)
-
-        elif isinstance(exp, Abstraction):
-            new_gamma = copy(gamma)
-            if TVar(exp.variable.name) in new_gamma:
-                del new_gamma[TVar(exp.variable.name)]
-            betta = self.get_new_type()
-            self.defined_variables[TVar(exp.variable.name)] = betta
-
-            new_gamma[TVar(exp.variable.name)] = betta
-            s1, t1 = self.__infer_type__(new_gamma, exp.expression)
-            return s1, TImpl(WAlgorithm.__apply_substitution(s1, betta), t1)
-
-        else:
-            assert isinstance(exp, Let)
-            new_gamma = copy(gamma)
-            s1, t1 = self.__infer_type__(new_gamma, exp.subst)
-
-            x_type = WAlgorithm.locking(WAlgorithm.__merge_substitutions__(s1, new_gamma), t1)
-
-            if TVar(exp.variable.name) in new_gamma:
-                del new_gamma[TVar(exp.variable.name)]
-
-            new_gamma = WAlgorithm.__merge_substitutions__(s1, new_gamma)
-            new_gamma[TVar(exp.variable.name)] = x_type
-
-            s2, t2 = self.__infer_type__(new_gamma, exp.expression)
-
-            s = WAlgorithm.__merge_substitutions__(s2, s1)
-            # s[TVar(exp.variable.name)] = x_type
-            return s, t2
+        table = {
+            Var: self.__infer_var__,
+            Applique: self.__infer_applique__,
+            Abstraction: self.__infer_abstraction__,
+            Let: self.__infer_let__,
+        }
+        return run(exp, table, gamma)
 
     def infer_type(self, exp: Expression) -> (dict, TType):
         """
@@ -208,25 +273,17 @@ class WAlgorithm:
         self.last_number = 0
         self.defined_variables = {}
         self.inst = []
-        context, result = self.__infer_type__({}, exp)
-        for sub in self.defined_variables.keys():
-            context[sub] = self.defined_variables[sub]
-
-        # for beauty in output
-        eq = []
-        eq_temp = []
-        for key in context.keys():
-            if not isinstance(context[key], TUni):
-                eq.append(Equation(key, context[key]))
-            else:
-                eq_temp.append(Equation(key, context[key]))
-
-        eq_solve = solve_set_of_equations(eq)
+        self.level = 0
+        self.levels = {}
+        self.substitution = {}
+        self.schemes = {}
+        keys, result = self.__infer_type__(PersistentMap(), exp)
         context = {}
-        for equation in eq_solve:
-            context[equation.left] = equation.right
-        for equation in eq_temp:
-            context[equation.left] = equation.right
+        for name in WAlgorithm.__flatten__(keys):
+            context[TVar(name)] = self.__resolve__(TVar(name))
+        # the substitution is idempotent after resolving, so this is the solution of the context
+        for sub in self.defined_variables.keys():
+            context[sub] = self.__resolve__(self.defined_variables[sub])
 
         return context, result
 
@@ -301,6 +358,32 @@ def test():
     )
     run_test(good_test)
 
+    def test_type(exp: Expression, result: TType):
+        print("Testing expression: {0}: type must be {1}".format(exp, result))
+        context, t = WAlgorithm().infer_type(exp)
+        print("Result is {0}".format(t))
+        assert types_equivalent(t, result)
+        print("Passed\n")
+
+    a = TVar("a")
+    b = TVar("b")
+
+    # Type of x is in the context, so it must not be generalized in y
+    test_type(Abstraction(x, Let(y, x, y)), TImpl(a, a))
+    test_type(Abstraction(x, Let(y, Abstraction(z, x), Applique(y, y))), TImpl(a, a))
+    test_type(Let(y, Abstraction(z, z), Applique(y, y)), TImpl(a, a))
+    test_type(Abstraction(x, Let(y, Abstraction(z, Applique(z, x)), Applique(y, id))), TImpl(a, a))
+    test_type(Let(Var("f"), fst, Applique(Applique(Var("f"), Applique(Var("f"), id)), y)),
+              TImpl(b, TImpl(a, a)))
+
+    # y : b is found after the type of the let body is returned, it must be applied to the result too
+    f, g, h = Var("f"), Var("g"), Var("h")
+    v = Var("v")
+    body = Let(v, Applique(Applique(f, Applique(h, Applique(g, x))), Applique(h, y)),
+               Applique(h, Applique(g, Applique(Applique(f, v), x))))
+    test_type(Abstraction(f, Abstraction(g, Abstraction(h, Abstraction(x, Abstraction(y, body))))),
+              TImpl(TImpl(a, TImpl(a, a)), TImpl(TImpl(a, b), TImpl(TImpl(b, a), TImpl(a, TImpl(b, a))))))
+
 
 if __name__ == "__main__":
     test()
\ No newline at end of file